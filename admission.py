@@ -0,0 +1,276 @@
+"""
+Controle de admissão para o caminho de inferência da API.
+
+- No máximo `max_in_flight` requisições processando e `max_queue` esperando;
+  a fila é ordenada por prioridade (high > normal > low) e, dentro da mesma
+  classe, por ordem de chegada.
+- Com a fila cheia, uma requisição de prioridade maior desaloja a de menor
+  prioridade mais recente (que recebe 503); senão, a nova é recusada na hora.
+- Quem espera mais que `queue_timeout` segundos recebe 503, o que limita a
+  latência de cauda em vez de acumular trabalho que o cliente já abandonou.
+- Limite de taxa por cliente (token bucket): excedeu -> 429.
+Todas as recusas levam `Retry-After`.
+
+`AdmissionMiddleware` é um middleware ASGI puro: a vaga só é liberada ao fim
+do corpo da resposta (importante para respostas em streaming, como /process/batch),
+e a recusa acontece antes de o upload ser lido.
+"""
+
+import asyncio
+import bisect
+import itertools
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        Consome um token; retorna 0 se permitido ou os segundos até haver um token.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Um token bucket por cliente (`rate` req/s, rajada `burst`); mantém no
+    máximo `max_clients` buckets (os menos recentes são descartados).
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check(self, client: str) -> None:
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        wait = bucket.take(time.monotonic())
+        if wait > 0:
+            raise Rejected(429, "rate limit exceeded", wait)
+
+
+class _Waiter:
+    __slots__ = ("sort_key", "priority", "future")
+
+    def __init__(self, priority: int, seq: int, future: "asyncio.Future[None]") -> None:
+        self.sort_key = (priority, seq)
+        self.priority = priority
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.sort_key < other.sort_key
+
+
+class AdmissionController:
+    """
+    Semáforo com fila limitada e prioridades. Usar apenas a partir do event loop.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float) -> None:
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Média móvel do tempo de serviço, para estimar o Retry-After
+        self._service_avg = 1.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _retry_after(self) -> float:
+        return self._service_avg * (len(self._queue) + 1) / self.max_in_flight
+
+    async def acquire(self, priority: int = PRIORITIES["normal"]) -> float:
+        """
+        Aguarda uma vaga; retorna o tempo de espera na fila (s). Levanta `Rejected`.
+        """
+        if self.in_flight < self.max_in_flight and not self._queue:
+            self.in_flight += 1
+            return 0.0
+        if len(self._queue) >= self.max_queue:
+            worst = self._queue[-1] if self._queue else None
+            if worst is None or worst.priority <= priority:
+                raise Rejected(503, "server saturated", self._retry_after())
+            # Desaloja o pedido de menor prioridade mais recente
+            self._queue.pop()
+            worst.future.set_exception(Rejected(503, "shed for higher priority work", self._retry_after()))
+
+        t0 = time.perf_counter()
+        waiter = _Waiter(priority, next(self._seq), asyncio.get_running_loop().create_future())
+        bisect.insort(self._queue, waiter)
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=self.queue_timeout)
+        except BaseException:
+            # Cliente desconectou/tarefa cancelada enquanto esperava
+            self._abandon(waiter)
+            raise
+        if not done:
+            self._abandon(waiter)
+            raise Rejected(503, "queue wait timeout", self._retry_after())
+        waiter.future.result()  # levanta Rejected se foi desalojado
+        return time.perf_counter() - t0
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter.future.done():
+            if not waiter.future.cancelled() and waiter.future.exception() is None:
+                # a vaga já tinha sido concedida
+                self.release()
+            return
+        waiter.future.cancel()
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, service_seconds: Optional[float] = None) -> None:
+        if service_seconds is not None:
+            self._service_avg = 0.9 * self._service_avg + 0.1 * service_seconds
+        self.in_flight -= 1
+        while self._queue and self.in_flight < self.max_in_flight:
+            waiter = self._queue.pop(0)
+            if not waiter.future.done():
+                self.in_flight += 1
+                waiter.future.set_result(None)
+
+
+def parse_priority_keys(spec: Optional[str]) -> Dict[str, int]:
+    """
+    "chave1:high,chave2:low" -> {chave: prioridade}.
+    """
+    out: Dict[str, int] = {}
+    for item in (spec or "").split(","):
+        key, _, cls = item.strip().rpartition(":")
+        if key and cls.strip().lower() in PRIORITIES:
+            out[key] = PRIORITIES[cls.strip().lower()]
+    return out
+
+
+class AdmissionMiddleware:
+    """
+    Aplica `limiter` e `controller` às requisições cujo path começa por um de `paths`.
+
+    Prioridade: a da chave (`x-api-key`) em `priority_keys`; sem chave mapeada,
+    o header `X-Priority` pode pedir `normal` ou `low` (nunca `high`).
+    Cliente (para o limite de taxa): a chave de API, ou o IP.
+    Callbacks opcionais: `on_admit(priority_name, wait_s)`, `on_reject(status, reason)`.
+    """
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        limiter: Optional[RateLimiter] = None,
+        paths: Sequence[str] = ("/process",),
+        priority_keys: Optional[Dict[str, int]] = None,
+        on_admit: Optional[Callable[[str, float], None]] = None,
+        on_reject: Optional[Callable[[int, str], None]] = None,
+    ) -> None:
+        self.app = app
+        self.controller = controller
+        self.limiter = limiter
+        self.paths = tuple(paths)
+        self.priority_keys = priority_keys or {}
+        self.on_admit = on_admit
+        self.on_reject = on_reject
+        self._names = {v: k for k, v in PRIORITIES.items()}
+
+    def _classify(self, scope) -> Tuple[str, int]:
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        api_key = headers.get("x-api-key")
+        if api_key and api_key in self.priority_keys:
+            priority = self.priority_keys[api_key]
+        else:
+            requested = PRIORITIES.get(headers.get("x-priority", "").strip().lower(), PRIORITIES["normal"])
+            priority = max(requested, PRIORITIES["normal"])
+        client = f"key:{api_key}" if api_key else f"ip:{(scope.get('client') or ('?',))[0]}"
+        return client, priority
+
+    async def _reject(self, send, exc: Rejected) -> None:
+        if self.on_reject is not None:
+            self.on_reject(exc.status, exc.reason)
+        body = json.dumps({"detail": exc.reason}).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": exc.status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(exc.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope.get("method") != "POST" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        client, priority = self._classify(scope)
+        try:
+            if self.limiter is not None:
+                self.limiter.check(client)
+            wait = await self.controller.acquire(priority)
+        except Rejected as exc:
+            await self._reject(send, exc)
+            return
+        if self.on_admit is not None:
+            self.on_admit(self._names[priority], wait)
+
+        t0 = time.perf_counter()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(time.perf_counter() - t0)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                timing = f"queue;dur={wait * 1000.0:.1f}".encode("latin-1")
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing)]}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
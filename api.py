@@ -1,18 +1,51 @@
 
 import os
+import re
+import json
+import asyncio
+import base64
+import shutil
+import zipfile
 import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 
-from fastapi import FastAPI, UploadFile, File, Query, HTTPException, Header
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Query, HTTPException, Header, Request, Depends
+from fastapi.responses import Response, JSONResponse, StreamingResponse, PlainTextResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
-import psycopg2
-from psycopg2.extras import Json
-
-from count_people import marcar_pessoas, _db_connect_from_env, _db_ensure_table
+from count_people import (
+    marcar_pessoas,
+    marcar_pessoas_batch,
+    _db_connect_from_env,
+    _db_ensure_table,
+    _db_insert_image,
+    _db_insert_images,
+    _parse_sizes,
+    _read_renditions,
+    _tick,
+    OUTPUT_FORMATS,
+    codec_fingerprint,
+    output_codec,
+    model_version,
+    model_loaded,
+    warm_up,
+)
+from lru import ByteLRU
+from profiling import ProfileStore, RequestProfiler
+from result_cache import ResultCache, cache_key
+from roi import load_roi_config, roi_for
+from heatmap import HeatmapStore
+from events import CountBroker
+from sources import SourceRegistry, SourceScheduler, make_processor
+from admission import AdmissionController, AdmissionMiddleware, RateLimiter, parse_priority_keys
+import metrics
 import hashlib
+import time
 
 
 app = FastAPI(title="People Counter API", version="1.0")
@@ -23,15 +56,213 @@ allow_origins = [o.strip() for o in cors_origins.split(",") if o.strip()]
 if not allow_origins:
     allow_origins = ["http://localhost:8501"]
 
+# Admission control for the inference endpoints (POST /process, /process/batch):
+# bounded in-flight + priority queue, per-client rate limit, 429/503 with Retry-After
+_admission = AdmissionController(
+    max_in_flight=int(os.getenv("API_MAX_IN_FLIGHT", "4")),
+    max_queue=int(os.getenv("API_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("API_QUEUE_TIMEOUT", "10")),
+)
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=_admission,
+    limiter=RateLimiter(float(os.getenv("API_RATE_LIMIT", "0")), float(os.getenv("API_RATE_BURST", "10"))),
+    paths=("/process",),
+    priority_keys=parse_priority_keys(os.getenv("API_PRIORITY_KEYS")),
+    on_admit=lambda priority, wait: QUEUE_WAIT_SECONDS.observe(wait, priority),
+    on_reject=lambda status, reason: ADMISSION_REJECTED.inc(1, str(status), reason),
+)
+
+
+# Operational metrics exposed at /metrics (see metrics.py: lock-free, per-thread shards)
+STAGE_SECONDS = metrics.Histogram(
+    "people_stage_seconds", "Time spent in each marcar_pessoas stage.", ["stage"]
+)
+DB_SECONDS = metrics.Histogram("people_db_seconds", "Database call latency.", ["op"])
+REQUEST_SECONDS = metrics.Histogram(
+    "people_http_request_seconds", "HTTP request latency.", ["method", "path", "status"]
+)
+IN_FLIGHT = metrics.Gauge("people_http_requests_in_flight", "Requests currently being served.")
+UPLOAD_BYTES = metrics.Histogram(
+    "people_upload_bytes",
+    "Size of uploaded images.",
+    buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6),
+)
+DEDUP_TOTAL = metrics.Counter(
+    "people_dedup_total", "Result cache lookups on /process (hit-memory, hit-db, miss).", ["result"]
+)
+PEOPLE_PER_IMAGE = metrics.Histogram(
+    "people_detected_per_image",
+    "People detected per processed image.",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    "people_queue_wait_seconds", "Time inference requests waited for admission.", ["priority"]
+)
+ADMISSION_REJECTED = metrics.Counter(
+    "people_admission_rejected_total", "Inference requests refused by admission control.", ["status", "reason"]
+)
+ADMISSION_IN_FLIGHT = metrics.Gauge(
+    "people_admission_in_flight", "Inference requests admitted and running.", function=lambda: _admission.in_flight
+)
+ADMISSION_QUEUED = metrics.Gauge(
+    "people_admission_queued", "Inference requests waiting for admission.", function=lambda: _admission.queued
+)
+OUTPUT_BYTES = metrics.Histogram(
+    "people_output_bytes",
+    "Size of encoded annotated images.",
+    ["mime"],
+    buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6),
+)
+SOURCE_FRAMES = metrics.Counter(
+    "people_source_frames_total", "Frames processed by the source scheduler.", ["source", "result"]
+)
+SOURCE_SECONDS = metrics.Histogram("people_source_frame_seconds", "Per-frame processing time by source.", ["source"])
+SOURCE_DROPPED = metrics.Counter(
+    "people_source_dropped_total", "Live frames dropped because the source fell behind.", ["source"]
+)
+STREAM_SUBSCRIBERS = metrics.Gauge("people_stream_subscribers", "Open /stream/counts connections.")
+STREAM_EVENTS = metrics.Counter("people_stream_events_total", "Count events published to /stream/counts.")
+STREAM_DROPPED = metrics.Counter(
+    "people_stream_dropped_total", "Count events dropped for slow /stream/counts subscribers."
+)
+
+
+@app.middleware("http")
+async def _precheck_upload_size(request: Request, call_next):
+    # Refuse declared oversized bodies before multipart parsing spools them
+    if request.method == "POST" and request.url.path in ("/process", "/process/batch"):
+        if request.url.path == "/process":
+            limit, detail = _MAX_UPLOAD_BYTES + 64 * 1024, f"Upload exceeds {_MAX_UPLOAD_BYTES} bytes"
+        else:
+            # Multipart/zip headers: allowance per file on top of the batch byte limit
+            limit = _BATCH_MAX_BYTES + 64 * 1024 + _BATCH_MAX_FILES * 1024
+            detail = f"Batch exceeds {_BATCH_MAX_BYTES} bytes"
+        declared = request.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > limit:
+            return JSONResponse({"detail": detail}, status_code=413)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def _track_requests(request: Request, call_next):
+    IN_FLIGHT.inc()
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.dec()
+        # Route template (e.g. /images/{image_id}) keeps label cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, request.method, path, str(status))
+
+
+# CORS is registered last so it is the outermost middleware: 413/429/503 answered by
+# the upload precheck and admission control also carry CORS headers, and browsers
+# can read Retry-After instead of seeing an opaque network error
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Image-Id", "X-Duplicate", "X-Cache", "Server-Timing"],
 )
 
 
+@app.get("/metrics", summary="Prometheus metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def _record_db(timings: Dict[str, float], op: str, t0: float) -> float:
+    """Record a DB call (`op` prefixed with db_) in metrics and `timings`; returns now."""
+    t1 = time.perf_counter()
+    DB_SECONDS.observe(t1 - t0, op[len("db_"):])
+    timings[op] = (t1 - t0) * 1000.0
+    return t1
+
+
+# Models warmed up in the background after startup; /readyz reports their state
+_WARMUP_MODES = [m.strip() for m in os.getenv("API_WARMUP_MODES", "seg").split(",") if m.strip()]
+_warmup_state: Dict[str, Any] = {"started": False, "done": False, "error": None, "seconds": None}
+
+
+def _warm_up_models() -> None:
+    t0 = time.perf_counter()
+    try:
+        warm_up(_WARMUP_MODES, device=os.getenv("API_DEVICE", "cpu"))
+    except Exception as exc:
+        _warmup_state["error"] = repr(exc)
+    finally:
+        _warmup_state["seconds"] = round(time.perf_counter() - t0, 3)
+        _warmup_state["done"] = True
+
+
+@app.on_event("startup")
+def _start_warm_up() -> None:
+    # Runs in a daemon thread so the server binds and answers /healthz immediately
+    _warmup_state["started"] = True
+    threading.Thread(target=_warm_up_models, name="model-warmup", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def _flush_heatmaps() -> None:
+    if _heatmaps is not None:
+        _heatmaps.flush()
+
+
+@app.on_event("startup")
+def _start_sources() -> None:
+    global _scheduler
+    if _sources is None or _API_SOURCES_WORKERS <= 0:
+        return
+    _scheduler = SourceScheduler(
+        _sources,
+        make_processor(
+            _SOURCES_OUTPUT_DIR,
+            device=os.getenv("API_DEVICE", "cpu"),
+            codec=_API_CODEC,
+            renditions=_API_RENDITIONS,
+            rendition_format=_API_RENDITION_FORMAT,
+            db_store=True,
+            max_pixels=_MAX_WORKING_PIXELS,
+        ),
+        _SOURCES_OUTPUT_DIR,
+        workers=_API_SOURCES_WORKERS,
+        on_result=_on_source_result,
+        on_drop=lambda cfg: SOURCE_DROPPED.inc(1, cfg.id),
+    )
+    _scheduler.start()
+
+
+@app.on_event("shutdown")
+def _stop_sources() -> None:
+    if _scheduler is not None:
+        _scheduler.stop()
+
+
+@app.get("/healthz", summary="Liveness probe")
+def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz", summary="Readiness probe (models loaded)")
+def readyz():
+    models = {mode: model_loaded(mode) for mode in _WARMUP_MODES}
+    ready = _warmup_state["done"] and all(models.values())
+    body = {"ready": ready, "models": models, "warmup": _warmup_state}
+    return JSONResponse(content=body, status_code=200 if ready else 503)
+
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings.items())
+
+
 def _require_api_key(x_api_key: Optional[str] = Header(None)):
     """
     If `API_KEY` env var is set, require `x-api-key` header to match.
@@ -44,78 +275,302 @@ def _require_api_key(x_api_key: Optional[str] = Header(None)):
     return True
 
 
+def _require_admin(x_api_key: Optional[str] = Header(None)):
+    """Admin endpoints are only available when `API_KEY` is configured."""
+    configured = os.getenv("API_KEY")
+    if not configured:
+        raise HTTPException(status_code=403, detail="Admin endpoints require API_KEY to be configured")
+    if x_api_key != configured:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    return True
+
+
+# Opt-in profiling of marcar_pessoas: per request via `X-Profile: 1` (requires
+# API_KEY) or 1 in PROFILE_SAMPLE_N requests. Profiles are kept in a bounded
+# on-disk ring buffer and served by /admin/profiles.
+_profiler = RequestProfiler(
+    ProfileStore(
+        Path(os.getenv("PROFILE_DIR", str(Path(tempfile.gettempdir()) / "people_profiles"))),
+        max_items=int(os.getenv("PROFILE_MAX", "50")),
+    ),
+    sample_every=int(os.getenv("PROFILE_SAMPLE_N", "0")),
+    engine=os.getenv("PROFILE_ENGINE", "cprofile"),
+)
+
+
+def _profile_reason(x_profile: Optional[str], x_api_key: Optional[str]) -> Optional[str]:
+    configured = os.getenv("API_KEY")
+    if x_profile and x_profile.lower() in ("1", "true", "yes") and configured and x_api_key == configured:
+        return "header"
+    if _profiler.should_sample():
+        return "sampled"
+    return None
+
+
+_schema_ready = False
+
+
 def _ensure_db():
-    conn = _db_connect_from_env()
+    global _schema_ready
+    with DB_SECONDS.time("connect"):
+        conn = _db_connect_from_env()
     if conn is None:
         return None
-    _db_ensure_table(conn)
+    # Schema and indexes are created once per process, not on every request
+    if not _schema_ready:
+        _db_ensure_table(conn)
+        _schema_ready = True
     return conn
 
 
+# Hot annotated images (most recent results) served without touching Postgres.
+# Keys are (image_id, requested size or 0), values (bytes, etag, mime);
+# stored results are immutable so entries never go stale.
+_hot_images = ByteLRU(
+    max_bytes=int(os.getenv("API_IMAGE_CACHE_MB", "64")) * 1024 * 1024,
+    max_item_bytes=int(os.getenv("API_IMAGE_CACHE_MAX_ITEM_MB", "4")) * 1024 * 1024,
+)
+_IMAGE_CHUNK = 256 * 1024
+_IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+# Results keyed by (content hash, mode, conf, model version): in-memory LRU + result_cache table
+_results = ResultCache(memory_bytes=int(os.getenv("API_RESULT_CACHE_MB", "128")) * 1024 * 1024)
+
+
+# Thumbnails generated at ingest and stored in image_renditions
+_API_RENDITIONS = _parse_sizes(os.getenv("API_RENDITION_SIZES", "256,1024"))
+_API_RENDITION_FORMAT = os.getenv("API_RENDITION_FORMAT", "jpeg")
+
+# Annotated output codec: format (auto|jpeg|png|webp), JPEG/WebP quality, PNG level, max side (0 = keep)
+_API_CODEC = output_codec(
+    os.getenv("API_OUTPUT_FORMAT", "jpeg"),
+    int(os.getenv("API_OUTPUT_QUALITY", "85")),
+    int(os.getenv("API_PNG_COMPRESSION", "1")),
+    int(os.getenv("API_OUTPUT_MAX_SIDE", "0")),
+)
+_MIME_EXT = {mime: ext for ext, mime in OUTPUT_FORMATS.values()}
+
+# People per megapixel above which seg/bbox requests are re-run in density mode (unset = never)
+_API_DENSITY_SWITCH = float(os.getenv("API_DENSITY_SWITCH", "0")) or None
+
+# Per-source regions of interest (polygons); see roi.py for the file format
+_ROI_CONFIG = load_roi_config(os.getenv("API_ROI_CONFIG"))
+
+# Occupancy heatmaps accumulated per source from /process detections (unset = disabled)
+_HEATMAP_DIR = os.getenv("API_HEATMAP_DIR")
+_heatmaps = HeatmapStore(Path(_HEATMAP_DIR)) if _HEATMAP_DIR else None
+
+# Live count events fanned out from memory to /stream/counts subscribers
+_STREAM_HEARTBEAT = float(os.getenv("API_STREAM_HEARTBEAT", "15"))
+_counts = CountBroker(
+    buffer=int(os.getenv("API_STREAM_BUFFER", "100")),
+    max_dropped=int(os.getenv("API_STREAM_MAX_DROPPED", "1000")),
+)
+
+
+def _publish_count(origin: str, source: Optional[str], count, image_id=None, **extra) -> None:
+    """Publish a count event to /stream/counts subscribers (never raises into the caller)."""
+    try:
+        _counts.publish({"origin": origin, "source": source, "image_id": image_id, "count": count, **extra})
+        STREAM_EVENTS.inc()
+    except Exception:
+        pass
+
+
 def _compute_hash(data: bytes) -> str:
     h = hashlib.sha256()
     h.update(data)
     return h.hexdigest()
 
 
+def _model_key(mode: str, roi) -> str:
+    """Model part of the result cache key: weights plus anything else that changes the output."""
+    model = model_version(mode)
+    if _API_DENSITY_SWITCH and mode != "density":
+        # the auto-switch can change the output, so it is part of the cache key
+        model = f"{model}+{model_version('density')}@{_API_DENSITY_SWITCH:g}"
+    if roi is not None:
+        model = f"{model}+roi@{roi.fingerprint}"
+    if _MAX_WORKING_PIXELS:
+        model = f"{model}+px@{_MAX_WORKING_PIXELS}"
+    # cached bytes are the encoded output, so the codec settings are part of the key too
+    return f"{model}+out@{codec_fingerprint(_API_CODEC)}"
+
+
+# Memory budget: larger frames are processed in a downscaled working copy (0 = off)
+_MAX_WORKING_PIXELS = int(float(os.getenv("API_MAX_WORKING_MEGAPIXELS", "0")) * 1_000_000) or None
+
+# Upload guards: body size (also prechecked from Content-Length) and decoded frame size,
+# checked from the image header before OpenCV allocates the full frame
+_MAX_UPLOAD_BYTES = int(float(os.getenv("API_MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+_MAX_PIXELS = int(float(os.getenv("API_MAX_MEGAPIXELS", "50")) * 1_000_000)
+_UPLOAD_CHUNK = 1024 * 1024
+# Leading bytes of the formats OpenCV decodes here -> file suffix
+_IMAGE_MAGIC = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"BM", ".bmp"),
+    (b"II*\x00", ".tif"),
+    (b"MM\x00*", ".tif"),
+]
+
+
+def _sniff_image(head: bytes) -> Optional[str]:
+    """Return the file suffix for a supported image header, or None."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    for magic, suffix in _IMAGE_MAGIC:
+        if head.startswith(magic):
+            return suffix
+    return None
+
+
+def _check_pixels(path: Path) -> None:
+    """Raise 413 when the image header declares more than API_MAX_MEGAPIXELS (decompression bombs)."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {_MAX_PIXELS} pixels")
+    except Exception:
+        # Unreadable header: let the decoder report it
+        return
+    if w * h > _MAX_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Image is {w}x{h}; limit is {_MAX_PIXELS} pixels")
+
+
+async def _spool_stream(
+    file, dest_dir: Path, stem: str = "input", limit: Optional[int] = None, too_large: Optional[str] = None
+):
+    """Copy `file` (anything with an async `read(n)`) to `dest_dir/<stem><suffix>` in chunks.
+
+    Returns (path, size, sha256 hex). Only one chunk is held in memory. The
+    format is sniffed from the first bytes (415 if unsupported) and the size
+    is capped at `limit` while reading (413 with `too_large` as detail).
+    """
+    limit = _MAX_UPLOAD_BYTES if limit is None else limit
+    h = hashlib.sha256()
+    size = 0
+    first = await file.read(_UPLOAD_CHUNK)
+    if not first:
+        raise HTTPException(status_code=400, detail="Empty file")
+    suffix = _sniff_image(first[:16])
+    if suffix is None:
+        raise HTTPException(status_code=415, detail="Unsupported image format (expected JPEG, PNG, WebP, BMP or TIFF)")
+    path = dest_dir / f"{stem}{suffix}"
+    with open(path, "wb") as f:
+        chunk = first
+        while chunk:
+            size += len(chunk)
+            if size > limit:
+                raise HTTPException(status_code=413, detail=too_large or f"Upload exceeds {limit} bytes")
+            h.update(chunk)
+            f.write(chunk)
+            chunk = await file.read(_UPLOAD_CHUNK)
+    return path, size, h.hexdigest()
+
+
+async def _spool_upload(file: UploadFile, dest_dir: Path):
+    """Spool a /process upload (see _spool_stream) and refuse decompression bombs (413)."""
+    path, size, digest = await _spool_stream(file, dest_dir)
+    _check_pixels(path)
+    return path, size, digest
+
+
 @app.post("/process", summary="Process image and return annotated image")
 async def process_image(
     file: UploadFile = File(...),
-    mode: str = Query("seg", enum=["seg", "bbox"]),
+    mode: str = Query("seg", enum=["seg", "bbox", "density"]),
     conf: float = Query(0.25, ge=0.0, le=1.0),
+    source: Optional[str] = Query(None, max_length=128),
+    x_profile: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
 ):
-    # Read file bytes
-    content = await file.read()
-    if not content:
-        raise HTTPException(status_code=400, detail="Empty file")
-
-    # DB connection (opcional). Se não houver DB configurado, apenas processa.
-    conn = _ensure_db()
+    # Stage timings (ms) for metrics and the Server-Timing header
+    timings: Dict[str, float] = {}
 
-    # Check dedup by hash (somente se DB disponível)
-    h = _compute_hash(content)
-    if conn is not None:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, output_image, metadata FROM images WHERE hash = %s LIMIT 1;", [h])
-            row = cur.fetchone()
-            if row:
-                img_id, output_bytes, meta = row
-                # meta pode conter a contagem salva
-                count_val = None
-                try:
-                    if isinstance(meta, dict):
-                        count_val = meta.get("count")
-                except Exception:
-                    count_val = None
-                headers = {
-                    "X-Image-Id": str(img_id),
-                    "X-Duplicate": "true",
-                    "X-Count": str(count_val) if count_val is not None else "",
-                    "Content-Type": "image/jpeg",
-                }
-                return Response(content=bytes(output_bytes), media_type="image/jpeg", headers=headers)
-
-    # Not a duplicate — save temp input and process
-    suffix = Path(file.filename or "uploaded.jpg").suffix or ".jpg"
     with tempfile.TemporaryDirectory() as td:
-        tmp_in = Path(td) / f"input{suffix}"
+        # Spool the upload to disk in chunks (bounded memory), hashing as it goes;
+        # unsupported formats (415) and oversized files/frames (413) are refused here
+        t = time.perf_counter()
+        tmp_in, size, h = await _spool_upload(file, Path(td))
+        t = _tick(timings, "upload", t)
+        UPLOAD_BYTES.observe(size)
+
+        # DB connection (opcional). Se não houver DB configurado, apenas processa.
+        t = time.perf_counter()
+        conn = _ensure_db()
+        t = _tick(timings, "db_connect", t)
+
+        # Result cache lookup by (content hash, mode, conf, model version)
+        roi = roi_for(_ROI_CONFIG, source)
+        model = _model_key(mode, roi)
+        key = cache_key(h, mode, conf, model)
+        cached, cache_status = _results.get(conn, key)
+        if conn is not None and cache_status != "hit-memory":
+            _record_db(timings, "db_cache_lookup", t)
+        DEDUP_TOTAL.inc(1, cache_status)
+        if cached is not None:
+            img_id = cached.get("image_id")
+            _publish_count("process", source, cached.get("count"), img_id, mode=mode, duplicate=True)
+            headers = {
+                "X-Image-Id": str(img_id) if img_id else "",
+                "X-Duplicate": "true",
+                "X-Cache": cache_status,
+                "X-Count": str(cached["count"]) if cached.get("count") is not None else "",
+                "Content-Type": cached["mime"],
+                "Server-Timing": _server_timing(timings),
+            }
+            return Response(content=cached["output"], media_type=cached["mime"], headers=headers)
+
+        # Not a duplicate — process the spooled input
         tmp_out_dir = Path(td) / "out"
         tmp_out_dir.mkdir(parents=True, exist_ok=True)
-        with open(tmp_in, "wb") as f:
-            f.write(content)
 
         # Device selection (API runs on CPU by default)
         device = os.getenv("API_DEVICE", "cpu")
-        res = marcar_pessoas(
-            input_image=tmp_in,
-            output_dir=tmp_out_dir,
-            mode=mode,
-            conf=conf,
-            thickness=3,
-            show_label=True,
-            device=device,
-            export_csv=False,
-        )
+
+        def run():
+            return marcar_pessoas(
+                input_image=tmp_in,
+                output_dir=tmp_out_dir,
+                mode=mode,
+                conf=conf,
+                thickness=3,
+                show_label=True,
+                device=device,
+                export_csv=False,
+                renditions=_API_RENDITIONS,
+                rendition_format=_API_RENDITION_FORMAT,
+                timings=timings,
+                density_switch=_API_DENSITY_SWITCH,
+                roi=roi,
+                codec=_API_CODEC,
+                max_pixels=_MAX_WORKING_PIXELS,
+            )
+
+        profile_id = None
+        reason = _profile_reason(x_profile, x_api_key)
+        if reason:
+            res, profile_id = await run_in_threadpool(
+                _profiler.run,
+                run,
+                meta={"reason": reason, "mode": mode, "conf": conf, "upload_bytes": size, "timings": timings},
+            )
+        else:
+            # Off the event loop, so admission control and other requests keep being served
+            res = await run_in_threadpool(run)
+        for stage, ms in timings.items():
+            if not stage.startswith("db_"):
+                STAGE_SECONDS.observe(ms / 1000.0, stage)
+        PEOPLE_PER_IMAGE.observe(res.get("count", 0))
+        out_mime = res["output_mime"]
+        OUTPUT_BYTES.observe(res["output_bytes"], out_mime)
+        if _heatmaps is not None and "density_count" not in res:
+            _heatmaps.add(source, res["detections"], res["frame_size"])
 
         out_path = Path(res["output_image"])
         if not out_path.exists():
@@ -124,81 +579,898 @@ async def process_image(
 
         # Store in DB (somente se DB disponível)
         img_id = None
+        inserted = False
         if conn is not None:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO images (input_filename, output_filename, metadata, input_image, output_image, hash)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (hash) DO NOTHING
-                    RETURNING id;
-                    """,
-                    [
-                        Path(file.filename or "uploaded.jpg").name,
-                        out_path.name,
-                        Json({k: v for k, v in res.items() if k != "detections"}),
-                        psycopg2.Binary(content),
-                        psycopg2.Binary(out_bytes),
-                        h,
-                    ],
-                )
-                row = cur.fetchone()
-                if row and row[0]:
-                    img_id = row[0]
-                else:
-                    cur.execute("SELECT id FROM images WHERE hash = %s LIMIT 1;", [h])
-                    r2 = cur.fetchone()
-                    img_id = r2[0] if r2 else None
+            t = time.perf_counter()
+            img_id, inserted = _db_insert_image(
+                conn,
+                input_filename=Path(file.filename or "uploaded.jpg").name,
+                output_filename=out_path.name,
+                metadata={k: v for k, v in res.items() if k != "detections"},
+                input_bytes=tmp_in.read_bytes(),
+                output_bytes=out_bytes,
+                img_hash=h,
+                count=int(res.get("count", 0)),
+                source=source,
+                renditions=_read_renditions(res),
+                output_mime=out_mime,
+            )
+            _record_db(timings, "db_insert", t)
+            if inserted:
+                _hot_images.put((img_id, 0), (out_bytes, _etag(_compute_hash(out_bytes)), out_mime), len(out_bytes))
+        # When the image row already existed (other params), the cache keeps its own copy
+        t = time.perf_counter()
+        _results.put(
+            conn,
+            key,
+            {"output": out_bytes, "mime": out_mime, "count": int(res.get("count", 0)), "image_id": img_id},
+            content_hash=h,
+            mode=mode,
+            conf=conf,
+            model=model,
+            output_in_images=inserted,
+        )
+        if conn is not None:
+            _record_db(timings, "db_cache_store", t)
+    _publish_count(
+        "process", source, int(res.get("count", 0)), img_id, mode=res.get("mode", mode), duplicate=False,
+        **({"density_count": res["density_count"]} if "density_count" in res else {}),
+    )
 
     headers = {
         "X-Image-Id": str(img_id) if img_id else "",
         "X-Duplicate": "false",
+        "X-Cache": "miss",
         "X-Count": str(res.get("count", "")),
-        "Content-Type": "image/jpeg",
+        "Content-Type": out_mime,
+        "Server-Timing": _server_timing(timings),
     }
-    return Response(content=out_bytes, media_type="image/jpeg", headers=headers)
+    if profile_id:
+        headers["X-Profile-Id"] = profile_id
+    return Response(content=out_bytes, media_type=out_mime, headers=headers)
 
 
-@app.get("/images/{image_id}", summary="Fetch processed image by id")
-def get_image(image_id: int):
+# POST /process/batch limits: files per request, total (uncompressed) bytes and model batch size
+_BATCH_MAX_FILES = int(os.getenv("API_BATCH_MAX_FILES", "100"))
+_BATCH_MAX_BYTES = int(os.getenv("API_BATCH_MAX_MB", "200")) * 1024 * 1024
+_BATCH_SIZE = int(os.getenv("API_BATCH_SIZE", "8"))
+# Zip entries expanding more than this are treated as zip bombs
+_BATCH_MAX_ZIP_RATIO = 100
+_BATCH_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+class _SyncReader:
+    """Async `read(n)` over a blocking file object (zip entries), for _spool_stream."""
+
+    def __init__(self, f) -> None:
+        self._f = f
+
+    async def read(self, n: int) -> bytes:
+        return self._f.read(n)
+
+
+async def _batch_inputs(files: Optional[List[UploadFile]], archive: Optional[UploadFile], in_dir: Path) -> List[Dict[str, Any]]:
+    """Spool batch inputs to `in_dir`; returns [{index, filename, path, hash, size}].
+
+    Each part is copied in chunks through _spool_stream, so only one chunk is
+    held in memory; limits are enforced while reading (413). Items whose
+    format is not a supported image get an `error` and fail on their own line.
+    """
+    items: List[Dict[str, Any]] = []
+    total = 0
+
+    async def add(filename: str, reader) -> None:
+        nonlocal total
+        if len(items) >= _BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {_BATCH_MAX_FILES} files")
+        index = len(items)
+        remaining = _BATCH_MAX_BYTES - total
+        if remaining < _MAX_UPLOAD_BYTES:
+            limit, too_large = remaining, f"Batch exceeds {_BATCH_MAX_BYTES} bytes"
+        else:
+            limit, too_large = _MAX_UPLOAD_BYTES, f"{filename} exceeds {_MAX_UPLOAD_BYTES} bytes"
+        try:
+            path, size, digest = await _spool_stream(reader, in_dir, f"{index:05d}", limit, too_large)
+        except HTTPException as exc:
+            if exc.status_code == 413:
+                raise
+            items.append({"index": index, "filename": filename, "path": None, "hash": None, "size": 0, "error": exc.detail})
+            return
+        total += size
+        items.append({"index": index, "filename": filename, "path": path, "hash": digest, "size": size})
+
+    for f in files or []:
+        await add(Path(f.filename or "upload.jpg").name, f)
+
+    if archive is not None:
+        try:
+            zf = zipfile.ZipFile(archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="archive is not a valid zip file")
+        with zf:
+            entries = [
+                i for i in zf.infolist()
+                if not i.is_dir()
+                and not i.filename.startswith("__MACOSX/")
+                and not Path(i.filename).name.startswith(".")
+                and Path(i.filename).suffix.lower() in _BATCH_EXTS
+            ]
+            # Declared sizes are checked up front; actual reads are capped in case headers lie
+            if len(items) + len(entries) > _BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {_BATCH_MAX_FILES} files")
+            if total + sum(i.file_size for i in entries) > _BATCH_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {_BATCH_MAX_BYTES} bytes")
+            for info in entries:
+                if info.compress_size and info.file_size / info.compress_size > _BATCH_MAX_ZIP_RATIO:
+                    raise HTTPException(status_code=413, detail=f"Suspicious compression ratio in {info.filename}")
+                n = len(items)
+                try:
+                    with zf.open(info) as src:
+                        await add(info.filename, _SyncReader(src))
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"Corrupt zip entry {info.filename}")
+                if items[n]["size"] > info.file_size:
+                    raise HTTPException(status_code=400, detail=f"Corrupt zip entry {info.filename}")
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in batch (send files=... or a zip archive=...)")
+    return items
+
+
+def _run_batch(items, mode: str, conf: float, source: Optional[str], out_dir: Path):
+    """Process a batch; yields (result line, annotated bytes or None) per item.
+
+    Failed items and cache hits are yielded first, without inference; misses
+    follow in input order, go through marcar_pessoas_batch and are persisted
+    with one DB transaction per model batch.
+    """
     conn = _ensure_db()
+    roi = roi_for(_ROI_CONFIG, source)
+    model = _model_key(mode, roi)
+    device = os.getenv("API_DEVICE", "cpu")
+
+    misses = []
+    for it in items:
+        if it.get("error"):
+            yield {"index": it["index"], "filename": it["filename"], "ok": False, "error": it["error"]}, None
+            continue
+        try:
+            _check_pixels(it["path"])
+        except HTTPException as exc:
+            yield {"index": it["index"], "filename": it["filename"], "ok": False, "error": exc.detail}, None
+            continue
+        it["key"] = cache_key(it["hash"], mode, conf, model)
+        cached, status = _results.get(conn, it["key"])
+        DEDUP_TOTAL.inc(1, status)
+        if cached is None:
+            misses.append(it)
+            continue
+        line = {"index": it["index"], "filename": it["filename"], "ok": True, "cache": status,
+                "image_id": cached.get("image_id"), "count": cached.get("count"), "mime": cached["mime"]}
+        _publish_count("batch", source, line["count"], line["image_id"], mode=mode, duplicate=True)
+        yield line, cached["output"]
+
+    timings: Dict[str, float] = {}
+    pending: List[Any] = []
+
+    def flush():
+        rows = [
+            dict(
+                input_filename=it["filename"],
+                output_filename=Path(res["output_image"]).name,
+                metadata={k: v for k, v in res.items() if k != "detections"},
+                input_bytes=it["path"].read_bytes(),
+                output_bytes=out_bytes,
+                img_hash=it["hash"],
+                count=int(res.get("count", 0)),
+                source=source,
+                renditions=_read_renditions(res),
+                output_mime=res["output_mime"],
+            )
+            for it, res, out_bytes in pending
+        ] if conn is not None else []
+        t = time.perf_counter()
+        stored = _db_insert_images(conn, rows) if rows else [(None, False)] * len(pending)
+        if rows:
+            DB_SECONDS.observe(time.perf_counter() - t, "insert_batch")
+        for (it, res, out_bytes), db_res in zip(pending, stored):
+            line = {"index": it["index"], "filename": it["filename"], "ok": True, "cache": "miss",
+                    "count": int(res.get("count", 0)), "mime": res["output_mime"]}
+            if isinstance(db_res, Exception):
+                line.update(image_id=None, db_error=str(db_res))
+                inserted = False
+            else:
+                img_id, inserted = db_res
+                line["image_id"] = img_id
+                if inserted:
+                    _hot_images.put((img_id, 0), (out_bytes, _etag(_compute_hash(out_bytes)), line["mime"]), len(out_bytes))
+            _results.put(
+                conn, it["key"],
+                {"output": out_bytes, "mime": line["mime"], "count": line["count"], "image_id": line.get("image_id")},
+                content_hash=it["hash"], mode=mode, conf=conf, model=model, output_in_images=inserted,
+            )
+            _publish_count("batch", source, line["count"], line.get("image_id"), mode=res.get("mode", mode), duplicate=False)
+            yield line, out_bytes
+        pending.clear()
+
+    results = marcar_pessoas_batch(
+        [it["path"] for it in misses],
+        out_dir,
+        mode=mode,
+        conf=conf,
+        device=device,
+        export_csv=False,
+        renditions=_API_RENDITIONS,
+        rendition_format=_API_RENDITION_FORMAT,
+        roi=roi,
+        batch_size=_BATCH_SIZE,
+        timings=timings,
+        codec=_API_CODEC,
+        max_pixels=_MAX_WORKING_PIXELS,
+        density_switch=_API_DENSITY_SWITCH,
+    )
+    for it, res in zip(misses, results):
+        if isinstance(res, Exception):
+            error = str(res).replace(str(it["path"]), it["filename"])
+            yield {"index": it["index"], "filename": it["filename"], "ok": False, "error": error}, None
+            continue
+        PEOPLE_PER_IMAGE.observe(res.get("count", 0))
+        OUTPUT_BYTES.observe(res["output_bytes"], res["output_mime"])
+        if _heatmaps is not None and "density_count" not in res:
+            _heatmaps.add(source, res["detections"], res["frame_size"])
+        pending.append((it, res, Path(res["output_image"]).read_bytes()))
+        if len(pending) >= _BATCH_SIZE:
+            yield from flush()
+    yield from flush()
+    # Stage times are summed over the batch; record the per-image average once per image
+    for stage, ms in timings.items():
+        for _ in misses:
+            STAGE_SECONDS.observe(ms / 1000.0 / len(misses), stage)
+
+
+@app.post("/process/batch", summary="Process many images (multipart files or a zip archive)")
+async def process_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    mode: str = Query("seg", enum=["seg", "bbox", "density"]),
+    conf: float = Query(0.25, ge=0.0, le=1.0),
+    source: Optional[str] = Query(None, max_length=128),
+    output: str = Query("ndjson", enum=["ndjson", "zip"]),
+):
+    """Stream one NDJSON line per image as results complete, then a summary line.
+
+    Lines: {index, filename, ok, cache, image_id, count} or {index, filename, ok: false, error}.
+    With output=zip the response is a zip of the annotated images plus results.ndjson.
+    """
+    work = Path(tempfile.mkdtemp(prefix="people_batch_"))
+    try:
+        in_dir = work / "in"
+        in_dir.mkdir()
+        items = await _batch_inputs(files, archive, in_dir)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    UPLOAD_BYTES.observe(sum(it["size"] for it in items))
+    out_dir = work / "out"
+    # Also removes the work dir when the client disconnects before the body is consumed
+    cleanup = BackgroundTask(shutil.rmtree, work, ignore_errors=True)
+
+    def lines():
+        summary = {"total": len(items), "ok": 0, "failed": 0, "people": 0}
+        try:
+            for line, out_bytes in _run_batch(items, mode, conf, source, out_dir):
+                if line["ok"]:
+                    summary["ok"] += 1
+                    summary["people"] += int(line.get("count") or 0)
+                else:
+                    summary["failed"] += 1
+                yield line, out_bytes
+            yield {"summary": summary}, None
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if output == "ndjson":
+        body = (json.dumps(line, ensure_ascii=False) + "\n" for line, _ in lines())
+        return StreamingResponse(body, media_type="application/x-ndjson", background=cleanup)
+
+    # zip: annotated images are spooled (to disk past 64 MiB) and streamed at the end
+    def zipped():
+        spool = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+        with zipfile.ZipFile(spool, "w", compression=zipfile.ZIP_STORED) as zf:
+            report = []
+            for line, out_bytes in lines():
+                report.append(json.dumps(line, ensure_ascii=False))
+                if out_bytes is not None:
+                    stem = Path(line["filename"]).stem
+                    ext = _MIME_EXT.get(line.get("mime"), ".jpg")
+                    zf.writestr(f"{line['index']:05d}_{stem}_marked{ext}", out_bytes)
+            zf.writestr("results.ndjson", "\n".join(report) + "\n")
+        spool.seek(0)
+        with spool:
+            while True:
+                chunk = spool.read(_IMAGE_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+
+    return StreamingResponse(
+        zipped(),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="annotated.zip"'},
+        background=cleanup,
+    )
+
+
+def _sse(event: Dict[str, Any], name: str = "count") -> str:
+    """Format one Server-Sent Events message; broker events carry an `id` for resuming."""
+    head = f"id: {event['id']}\n" if "id" in event else ""
+    return f"{head}event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.get("/stream/counts", summary="Live count events (Server-Sent Events)")
+async def stream_counts(
+    request: Request,
+    source: Optional[str] = Query(None, max_length=128),
+    last_event_id: Optional[str] = Header(None),
+):
+    """Push one `count` event per result from /process, /process/batch and external producers.
+
+    Each subscriber has a bounded buffer (API_STREAM_BUFFER); when the client
+    falls behind, the oldest events are dropped and a `dropped` event reports
+    how many. Reconnecting clients resume from `Last-Event-ID` while the
+    events are still in the broker's recent history.
+    """
+    try:
+        resume = int(last_event_id) if last_event_id else None
+    except ValueError:
+        resume = None
+    sub = _counts.subscribe(source=source, last_event_id=resume)
+    STREAM_SUBSCRIBERS.inc()
+
+    async def events():
+        try:
+            yield f"retry: 3000\n: subscribed source={source or '*'}\n\n"
+            while not sub.closed:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if sub.dropped:
+                    STREAM_DROPPED.inc(sub.dropped)
+                    yield _sse({"dropped": sub.dropped}, "dropped")
+                    sub.dropped = 0
+                yield _sse(event)
+            if sub.closed and sub.dropped_total > _counts.max_dropped:
+                yield _sse({"dropped": sub.dropped_total, "reason": "slow consumer"}, "close")
+        finally:
+            _counts.unsubscribe(sub)
+            STREAM_SUBSCRIBERS.dec()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@app.post("/stream/counts", summary="Publish a count event from an external producer")
+def publish_count(payload: Dict[str, Any], authorized: bool = Depends(_require_api_key)):
+    """Used by the CLI folder/video modes (`--notify-url`) to feed /stream/counts."""
+    if not isinstance(payload.get("count"), (int, float)):
+        raise HTTPException(status_code=400, detail="count is required")
+    allowed = {"source", "image_id", "count", "ts", "mode", "input", "zones", "density_count"}
+    event = {k: v for k, v in payload.items() if k in allowed}
+    _publish_count(str(payload.get("origin") or "external"), event.pop("source", None), event.pop("count"),
+                   event.pop("image_id", None), **event)
+    return {"published": True, "subscribers": _counts.subscribers()}
+
+
+def _etag(content_hash: str) -> str:
+    return f'"{content_hash}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag == etag or tag == f"W/{etag}":
+            return True
+    return False
+
+
+def _parse_range(range_header: Optional[str], size: int):
+    """Parse a single `bytes=` range. Returns (start, end) inclusive, None to
+    serve the full body, or raises 416 when unsatisfiable."""
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        # Multiple ranges are not supported; RFC 9110 allows ignoring Range
+        return None
+    first, _, last = spec.partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                # invalid range-spec (not merely unsatisfiable): ignore Range
+                raise ValueError
+            end = min(end, size - 1)
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _stream_db_blob(conn, select_sql: str, key_params: List[Any], start: int, end: int, cache_key, etag: str, mime: str):
+    """Yield `blob[start:end]` in chunks using substr() on the BYTEA selected by
+    `select_sql` (output_image uses EXTERNAL storage, so Postgres only reads the
+    needed TOAST chunks). When `cache_key` is given and the whole blob was read,
+    it is added to the hot-image LRU."""
+    collected = [] if cache_key is not None else None
+    pos = start
     with conn.cursor() as cur:
-        cur.execute("SELECT output_image FROM images WHERE id = %s;", [image_id])
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Image not found")
-        return Response(content=bytes(row[0]), media_type="image/jpeg")
+        while pos <= end:
+            n = min(_IMAGE_CHUNK, end - pos + 1)
+            cur.execute(select_sql, [pos + 1, n] + key_params)
+            row = cur.fetchone()
+            if not row or not row[0]:
+                break
+            chunk = bytes(row[0])
+            if collected is not None:
+                collected.append(chunk)
+            yield chunk
+            pos += len(chunk)
+    if collected is not None and pos > end:
+        data = b"".join(collected)
+        _hot_images.put(cache_key, (data, etag, mime), len(data))
+
+
+@app.get("/images/{image_id}", summary="Fetch processed image by id")
+def get_image(
+    image_id: int,
+    size: Optional[int] = Query(None, ge=1, description="Longest side of a stored rendition (e.g. 256, 1024)"),
+    range_header: Optional[str] = Header(None, alias="range"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Serve the annotated image with a strong ETag (sha256 of the content),
+    `If-None-Match` -> 304 and single `Range` requests. Hot images come from an
+    in-process LRU; otherwise the blob is streamed from Postgres in chunks.
+
+    With `size`, the smallest stored rendition whose longest side is >= size is
+    served; if there is none (e.g. the original is already smaller), the
+    original image is returned.
+    """
+    conn = None
+    rendition_size = 0
+    cached = _hot_images.get((image_id, size or 0))
+    if cached is not None:
+        data, etag, mime = cached
+        total = len(data)
+        if size:
+            rendition_size = size
+    else:
+        conn = _ensure_db()
+        if conn is None:
+            raise HTTPException(status_code=503, detail="DB not available")
+        row = None
+        with DB_SECONDS.time("image_meta"), conn.cursor() as cur:
+            if size:
+                cur.execute(
+                    "SELECT size, content_hash, length(data), mime FROM image_renditions "
+                    "WHERE image_id = %s AND size >= %s ORDER BY size LIMIT 1;",
+                    [image_id, size],
+                )
+                row = cur.fetchone()
+            if row:
+                rendition_size, out_hash, total, mime = row
+            else:
+                cur.execute(
+                    "SELECT output_hash, length(output_image), COALESCE(output_mime, 'image/jpeg') FROM images WHERE id = %s;",
+                    [image_id],
+                )
+                row = cur.fetchone()
+                if not row:
+                    raise HTTPException(status_code=404, detail="Image not found")
+                out_hash, total, mime = row
+                if not out_hash:
+                    # Legacy row stored before output_hash existed: backfill once
+                    cur.execute(
+                        "UPDATE images SET output_hash = encode(sha256(output_image), 'hex') WHERE id = %s RETURNING output_hash;",
+                        [image_id],
+                    )
+                    out_hash = cur.fetchone()[0]
+        data = None
+        total = int(total or 0)
+        etag = _etag(out_hash)
+
+    headers = {"ETag": etag, "Cache-Control": _IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_range(range_header, total)
+    status = 200
+    start, end = 0, total - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    if data is not None:
+        return Response(content=data[start:end + 1], status_code=status, media_type=mime, headers=headers)
+    if rendition_size:
+        select_sql = "SELECT substr(data, %s, %s) FROM image_renditions WHERE image_id = %s AND size = %s;"
+        key_params = [image_id, rendition_size]
+    else:
+        select_sql = "SELECT substr(output_image, %s, %s) FROM images WHERE id = %s;"
+        key_params = [image_id]
+    return StreamingResponse(
+        _stream_db_blob(
+            conn,
+            select_sql,
+            key_params,
+            start,
+            end,
+            cache_key=(image_id, size or 0) if status == 200 else None,
+            etag=etag,
+            mime=mime,
+        ),
+        status_code=status,
+        media_type=mime,
+        headers=headers,
+    )
+
+
+# Projectable fields for GET /images -> SQL expression.
+# `count` reads the typed column and only falls back to the JSONB for legacy rows.
+_COUNT_EXPR = "COALESCE(people_count, CAST(metadata->>'count' AS INTEGER))"
+_LIST_FIELDS = {
+    "id": "id",
+    "created_at": "created_at",
+    "input_filename": "input_filename",
+    "output_filename": "output_filename",
+    "count": _COUNT_EXPR,
+    "source": "source",
+    "title": "metadata->>'title'",
+    "description": "metadata->>'description'",
+    "metadata": "metadata",
+}
+_LIST_DEFAULT_FIELDS = ["id", "created_at", "input_filename", "count", "metadata"]
+
+
+def _encode_cursor(created_at: datetime, img_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{img_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        ts, img_id = raw.rsplit("|", 1)
+        created_at, img_id = datetime.fromisoformat(ts), int(img_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Cursors we issue carry the UTC offset of a timestamptz and a BIGINT id;
+    # anything else was edited and would fail (or compare wrongly) in Postgres
+    if created_at.tzinfo is None or not 0 < img_id < 2**63:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, img_id
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(_LIST_DEFAULT_FIELDS)
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in _LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # id and created_at are always needed to build the next cursor
+    return [f for f in ("id", "created_at") if f not in names] + names
 
 
 @app.get("/images", summary="List processed images (paginated)")
-def list_images(page: int = 1, per_page: int = 20):
-    """Return a paginated list of images with minimal metadata.
+def list_images(
+    page: int = Query(1, ge=1),
+    per_page: int = Query(20, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    min_count: Optional[int] = Query(None, ge=0),
+    max_count: Optional[int] = Query(None, ge=0),
+):
+    """Return a page of images, newest first, with minimal metadata.
 
-    Response: JSON list of {id, created_at, input_filename, metadata}
+    Pagination is keyset-based on `(created_at, id)`: pass the `next_cursor`
+    from a previous response as `cursor`. `page` is kept for compatibility and
+    only used when no cursor is given (OFFSET; slow on deep pages).
+
+    `fields` is a comma separated projection (id, created_at, input_filename,
+    output_filename, count, source, title, description, metadata). Filters:
+    `created_from`/`created_to` (inclusive/exclusive) and `min_count`/`max_count`.
+
+    Response: {images: [...], page, per_page, next_cursor}
     """
     conn = _ensure_db()
     if conn is None:
-        return JSONResponse(content={"images": [], "page": page, "per_page": per_page})
+        return JSONResponse(content={"images": [], "page": page, "per_page": per_page, "next_cursor": None})
 
-    offset = max(0, (page - 1)) * max(1, per_page)
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT id, created_at, input_filename, metadata FROM images ORDER BY created_at DESC LIMIT %s OFFSET %s;",
-            [per_page, offset],
-        )
+    names = _parse_fields(fields)
+    where: List[str] = []
+    params: List[Any] = []
+    if cursor:
+        cur_ts, cur_id = _decode_cursor(cursor)
+        where.append("(created_at, id) < (%s, %s)")
+        params += [cur_ts, cur_id]
+    if created_from is not None:
+        where.append("created_at >= %s")
+        params.append(created_from)
+    if created_to is not None:
+        where.append("created_at < %s")
+        params.append(created_to)
+    if min_count is not None:
+        where.append(f"{_COUNT_EXPR} >= %s")
+        params.append(min_count)
+    if max_count is not None:
+        where.append(f"{_COUNT_EXPR} <= %s")
+        params.append(max_count)
+
+    query = "SELECT " + ", ".join(_LIST_FIELDS[n] for n in names) + " FROM images"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    params.append(per_page)
+    if not cursor and page > 1:
+        query += " OFFSET %s"
+        params.append((page - 1) * per_page)
+
+    with DB_SECONDS.time("list"), conn.cursor() as cur:
+        cur.execute(query + ";", params)
         rows = cur.fetchall()
 
     images: List[Dict[str, Any]] = []
     for r in rows:
-        img_id, created_at, input_fn, meta = r
-        images.append({
-            "id": int(img_id),
-            "created_at": created_at.isoformat() if hasattr(created_at, "isoformat") else str(created_at),
-            "input_filename": input_fn,
-            "metadata": meta if isinstance(meta, dict) else {},
-        })
+        item = dict(zip(names, r))
+        created_at = item["created_at"]
+        item["id"] = int(item["id"])
+        item["created_at"] = created_at.isoformat() if hasattr(created_at, "isoformat") else str(created_at)
+        if "metadata" in item and not isinstance(item["metadata"], dict):
+            item["metadata"] = {}
+        images.append(item)
+
+    next_cursor = None
+    if len(rows) == per_page:
+        last = dict(zip(names, rows[-1]))
+        next_cursor = _encode_cursor(last["created_at"], int(last["id"]))
 
-    return JSONResponse(content={"images": images, "page": page, "per_page": per_page})
+    return JSONResponse(content={"images": images, "page": page, "per_page": per_page, "next_cursor": next_cursor})
+
+
+_INTERVAL_RE = re.compile(r"^(\d+)([mhd])$")
+_INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400}
+# Guard against unbounded scans of the minute rollup
+_TIMESERIES_MAX_ROWS = 200_000
+
+
+def _rollup_for_interval(seconds: int) -> str:
+    """Pick the coarsest rollup granularity that evenly divides the interval."""
+    if seconds % 86400 == 0:
+        return "day"
+    if seconds % 3600 == 0:
+        return "hour"
+    return "minute"
+
+
+@app.get("/stats/heatmap", summary="Accumulated occupancy heatmap as an overlay image")
+def stats_heatmap(source: Optional[str] = None, background: bool = True):
+    """Render the heatmap of `source` as PNG, blended over its latest stored frame.
+
+    Only the accumulated grid is read; no stored image is reprocessed. The
+    background is the smallest stored rendition of that frame; the full
+    input image is fetched only when the row has no renditions.
+    """
+    import cv2
+    import numpy as np
+
+    if _heatmaps is None:
+        raise HTTPException(status_code=404, detail="Heatmaps are disabled (set API_HEATMAP_DIR)")
+    bg = None
+    conn = _ensure_db() if background else None
+    if conn is not None:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT i.id, (
+                    SELECT r.data FROM image_renditions r WHERE r.image_id = i.id ORDER BY r.size LIMIT 1
+                )
+                FROM images i WHERE i.source IS NOT DISTINCT FROM %s
+                ORDER BY i.created_at DESC, i.id DESC LIMIT 1;
+                """,
+                [source],
+            )
+            row = cur.fetchone()
+            data = row[1] if row else None
+            if row and data is None:
+                cur.execute("SELECT input_image FROM images WHERE id = %s;", [row[0]])
+                data = (cur.fetchone() or [None])[0]
+        if data is not None:
+            bg = cv2.imdecode(np.frombuffer(bytes(data), dtype=np.uint8), cv2.IMREAD_COLOR)
+    img = _heatmaps.render(source, bg)
+    if img is None:
+        raise HTTPException(status_code=404, detail="No heatmap for this source")
+    ok, buf = cv2.imencode(".png", img)
+    if not ok:
+        raise HTTPException(status_code=500, detail="Failed to encode heatmap")
+    return Response(content=buf.tobytes(), media_type="image/png", headers={"Cache-Control": "no-store"})
+
+
+@app.get("/stats/timeseries", summary="People counts aggregated over time")
+def stats_timeseries(
+    interval: str = Query("5m", description="Bucket size, e.g. 1m, 5m, 1h, 1d"),
+    source: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Return per-source series of {t, n, sum, max, avg} read from `count_rollups`.
+
+    `start`/`end` default to the last 24 hours. Buckets are aligned to UTC epoch
+    multiples of `interval`.
+    """
+    m = _INTERVAL_RE.match(interval.strip())
+    if not m or int(m.group(1)) <= 0:
+        raise HTTPException(status_code=400, detail="interval must look like 5m, 1h or 1d")
+    step = int(m.group(1)) * _INTERVAL_UNITS[m.group(2)]
+    granularity = _rollup_for_interval(step)
+
+    end = end or datetime.now(timezone.utc)
+    start = start or (end - timedelta(days=1))
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    conn = _ensure_db()
+    if conn is None:
+        return JSONResponse(content={"interval": interval, "granularity": granularity, "series": []})
+
+    query = (
+        "SELECT source, bucket_start, n, total, max_count FROM count_rollups "
+        "WHERE granularity = %s AND bucket_start >= %s AND bucket_start < %s"
+    )
+    params: List[Any] = [granularity, start, end]
+    if source is not None:
+        query += " AND source = %s"
+        params.append(source)
+    query += " ORDER BY source, bucket_start LIMIT %s;"
+    params.append(_TIMESERIES_MAX_ROWS + 1)
+    with DB_SECONDS.time("timeseries"), conn.cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    if len(rows) > _TIMESERIES_MAX_ROWS:
+        raise HTTPException(status_code=400, detail="Range too large; use a larger interval or filter by source")
+
+    # Re-bucket the rollup rows into `interval` buckets
+    series: Dict[str, Dict[int, List[int]]] = {}
+    for src, bucket_start, n, total, max_count in rows:
+        epoch = int(bucket_start.timestamp())
+        key = epoch - epoch % step
+        acc = series.setdefault(src, {}).setdefault(key, [0, 0, 0])
+        acc[0] += int(n)
+        acc[1] += int(total)
+        acc[2] = max(acc[2], int(max_count))
+
+    out = []
+    for src, buckets in series.items():
+        points = [
+            {
+                "t": datetime.fromtimestamp(k, timezone.utc).isoformat(),
+                "n": n,
+                "sum": total,
+                "max": mx,
+                "avg": round(total / n, 3) if n else None,
+            }
+            for k, (n, total, mx) in sorted(buckets.items())
+        ]
+        out.append({"source": src or None, "points": points})
+
+    return JSONResponse(content={"interval": interval, "granularity": granularity, "series": out})
+
+
+# Camera/source registry (SOURCES_CONFIG); with API_SOURCES_WORKERS > 0 the
+# scheduler runs in this process, otherwise `python sources.py` picks up changes
+_SOURCES_CONFIG = os.getenv("SOURCES_CONFIG")
+_sources = SourceRegistry(Path(_SOURCES_CONFIG)) if _SOURCES_CONFIG else None
+_API_SOURCES_WORKERS = int(os.getenv("API_SOURCES_WORKERS", "0"))
+_SOURCES_OUTPUT_DIR = Path(os.getenv("API_SOURCES_OUTPUT_DIR", str(Path(tempfile.gettempdir()) / "people_sources")))
+_scheduler: Optional[SourceScheduler] = None
+
+
+def _on_source_result(cfg, job, result, seconds: float) -> None:
+    SOURCE_SECONDS.observe(seconds, cfg.id)
+    if isinstance(result, Exception):
+        SOURCE_FRAMES.inc(1, cfg.id, "error")
+        return
+    SOURCE_FRAMES.inc(1, cfg.id, "ok")
+    PEOPLE_PER_IMAGE.observe(result.get("count", 0))
+    if _heatmaps is not None and "density_count" not in result:
+        _heatmaps.add(cfg.id, result["detections"], result["frame_size"])
+    _publish_count("source", cfg.id, int(result.get("count", 0)), result.get("db_id"), mode=cfg.mode,
+                   input=job["path"].name)
+
+
+def _registry():
+    if _sources is None:
+        raise HTTPException(status_code=503, detail="Source registry not configured (set SOURCES_CONFIG)")
+    return _sources
+
+
+def _source_body(cfg) -> Dict[str, Any]:
+    body = {"id": cfg.id, **cfg.to_dict()}
+    if _scheduler is not None:
+        body["stats"] = _scheduler.stats().get(cfg.id)
+    return body
+
+
+@app.get("/sources", summary="List registered sources (cameras)")
+def list_sources():
+    return {"sources": [_source_body(cfg) for cfg in _registry().list()], "scheduler": _scheduler is not None}
+
+
+@app.get("/sources/{source_id}", summary="Get one source and its scheduler stats")
+def get_source(source_id: str):
+    cfg = _registry().get(source_id)
+    if cfg is None:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return _source_body(cfg)
+
+
+@app.put("/sources/{source_id}", summary="Create or replace a source")
+def put_source(source_id: str, payload: Dict[str, Any], authorized: bool = Depends(_require_api_key)):
+    """Body: {kind, path, mode, conf, interval, priority, roi, recursive, enabled, loop} (see sources.py)."""
+    try:
+        cfg = _registry().put(source_id, payload)
+    except (TypeError, ValueError) as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    if _scheduler is not None:
+        _scheduler.sync()
+    return _source_body(cfg)
+
+
+@app.delete("/sources/{source_id}", summary="Remove a source")
+def delete_source(source_id: str, authorized: bool = Depends(_require_api_key)):
+    if not _registry().delete(source_id):
+        raise HTTPException(status_code=404, detail="Source not found")
+    if _scheduler is not None:
+        _scheduler.sync()
+    return {"deleted": source_id}
+
+
+@app.get("/admin/profiles", summary="List captured profiles")
+def list_profiles(authorized: bool = Depends(_require_admin)):
+    return JSONResponse(content={"profiles": _profiler.store.list()})
+
+
+@app.get("/admin/profiles/{profile_id}/{artifact}", summary="Download a profile artifact")
+def get_profile_artifact(profile_id: str, artifact: str, authorized: bool = Depends(_require_admin)):
+    """Artifacts: cprofile.prof (pstats), cprofile.txt, torch_ops.txt, pyinstrument.html, meta.json."""
+    path = _profiler.store.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=f"{profile_id}-{artifact}")
 
 
 @app.patch("/images/{image_id}", summary="Update metadata for an image")
@@ -226,6 +1498,8 @@ def patch_image_metadata(image_id: int, payload: Dict[str, Any], authorized: boo
         for k, v in payload.items():
             merged[k] = v
 
+        from psycopg2.extras import Json
+
         cur.execute(
             "UPDATE images SET metadata = %s WHERE id = %s RETURNING id;",
             [Json(merged), image_id],
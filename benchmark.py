@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark offline do pipeline de detecção (marcar_pessoas).
+
+- Gera imagens sintéticas em várias resoluções e densidades de "pessoas"
+  (ou usa uma pasta local com --input-dir).
+- Mede cada etapa de marcar_pessoas separadamente (decode, model_load,
+  inference, masks, draw, encode, write) e, opcionalmente, o armazenamento
+  no DB (db_store).
+- Reporta p50/p95/p99, throughput e pico de RSS em JSON.
+- Mede o tempo de importação (startup) dos módulos com `python -X importtime` (--import-time).
+- Compara com um baseline salvo (--compare) e sai com código 1 se houver regressão.
+
+Exemplos:
+    python benchmark.py --output bench.json
+    python benchmark.py --resolutions 1280x720,3840x2160 --densities 0,50 --repeat 5
+    python benchmark.py --input-dir fotos/ --mode bbox --output atual.json --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import cv2
+
+from count_people import marcar_pessoas, _db_connect_from_env, _db_ensure_table, _db_store_result
+
+
+STAGES = ["decode", "model_load", "inference", "masks", "draw", "encode", "write", "db_store"]
+IMAGE_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+def _parse_resolutions(value: str) -> List[Tuple[int, int]]:
+    out = []
+    for item in value.split(","):
+        w, h = item.lower().strip().split("x")
+        out.append((int(w), int(h)))
+    return out
+
+
+def _parse_ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _synthetic_image(width: int, height: int, people: int, seed: int) -> np.ndarray:
+    """
+    Gera um frame BGR com fundo texturizado e `people` silhuetas simples
+    (cabeça + tronco + pernas) em posições e escalas aleatórias.
+    """
+    rng = np.random.default_rng(seed)
+    # fundo: gradiente vertical + ruído
+    grad = np.linspace(60, 200, height, dtype=np.float32)[:, None, None]
+    img = np.broadcast_to(grad, (height, width, 3)).astype(np.float32)
+    img = img + rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+
+    for _ in range(people):
+        scale = rng.uniform(0.05, 0.25) * height
+        cx = int(rng.uniform(0, width))
+        cy = int(rng.uniform(scale * 0.3, height))
+        color = tuple(int(c) for c in rng.integers(0, 255, size=3))
+        head_r = max(2, int(scale * 0.09))
+        torso_w, torso_h = int(scale * 0.22), int(scale * 0.38)
+        top = cy - int(scale)
+        cv2.circle(img, (cx, top + head_r), head_r, color, -1, cv2.LINE_AA)
+        cv2.rectangle(img, (cx - torso_w // 2, top + 2 * head_r), (cx + torso_w // 2, top + 2 * head_r + torso_h), color, -1)
+        leg_top = top + 2 * head_r + torso_h
+        leg_thick = max(1, torso_w // 4)
+        cv2.line(img, (cx - torso_w // 4, leg_top), (cx - torso_w // 3, cy), color, leg_thick, cv2.LINE_AA)
+        cv2.line(img, (cx + torso_w // 4, leg_top), (cx + torso_w // 3, cy), color, leg_thick, cv2.LINE_AA)
+    return img
+
+
+def _build_cases(args: argparse.Namespace, workdir: Path) -> Dict[str, List[Path]]:
+    """
+    Retorna {nome_do_caso: [imagens]}.
+    """
+    if args.input_dir:
+        folder = Path(args.input_dir).expanduser().resolve()
+        images = [p for p in sorted(folder.iterdir()) if p.is_file() and p.suffix.lower() in IMAGE_EXTS]
+        if not images:
+            raise SystemExit(f"Nenhuma imagem *.jpg/*.jpeg/*.png encontrada em: {folder}")
+        return {folder.name or "input": images[: args.images or None]}
+
+    cases: Dict[str, List[Path]] = {}
+    for w, h in _parse_resolutions(args.resolutions):
+        for density in _parse_ints(args.densities):
+            name = f"{w}x{h}_d{density}"
+            case_dir = workdir / name
+            case_dir.mkdir(parents=True, exist_ok=True)
+            paths = []
+            for i in range(args.images or 3):
+                path = case_dir / f"synthetic_{i:03d}.jpg"
+                cv2.imwrite(str(path), _synthetic_image(w, h, density, seed=args.seed + i))
+                paths.append(path)
+            cases[name] = paths
+    return cases
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """
+    Percentil com interpolação linear (q em 0..100) sobre valores já ordenados.
+    """
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    v = sorted(values)
+    return {
+        "n": len(v),
+        "mean": round(sum(v) / len(v), 3) if v else 0.0,
+        "p50": round(_percentile(v, 50), 3),
+        "p95": round(_percentile(v, 95), 3),
+        "p99": round(_percentile(v, 99), 3),
+        "max": round(v[-1], 3) if v else 0.0,
+    }
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS reporta bytes
+    return round(peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0, 1)
+
+
+def import_time_report(module: str, top: int = 10) -> Dict[str, Any]:
+    """
+    Importa `module` num interpretador novo com `-X importtime` e resume o custo:
+    tempo de parede do processo, tempo cumulativo do módulo e os imports mais caros.
+    """
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=str(Path(__file__).parent), capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - t0) * 1000.0
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # cabeçalho
+        # o nome vem com um espaço fixo; espaços extras indicam imports aninhados
+        entries.append((parts[2][1:].rstrip(), self_us, cumulative_us))
+    module_entry = next((e for e in entries if e[0].strip() == module), None)
+    # Somente imports de primeiro nível (sem indentação) para o ranking
+    top_level = sorted((e for e in entries if not e[0].startswith(" ")), key=lambda e: e[2], reverse=True)
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "wall_ms": round(wall_ms, 1),
+        "cumulative_ms": round(module_entry[2] / 1000.0, 1) if module_entry else None,
+        "top": [{"name": n.strip(), "cumulative_ms": round(c / 1000.0, 1)} for n, _, c in top_level[:top]],
+    }
+
+
+def _run_case(name: str, images: List[Path], args: argparse.Namespace, out_dir: Path, conn) -> Dict[str, Any]:
+    samples: Dict[str, List[float]] = {s: [] for s in STAGES}
+    totals: List[float] = []
+    people: List[int] = []
+
+    def one(img_path: Path) -> Dict[str, float]:
+        timings: Dict[str, float] = {}
+        t0 = time.perf_counter()
+        r = marcar_pessoas(
+            input_image=img_path,
+            output_dir=out_dir,
+            mode=args.mode,
+            conf=args.conf,
+            device=args.device,
+            export_csv=True,
+            timings=timings,
+        )
+        if conn is not None:
+            t1 = time.perf_counter()
+            _db_store_result(conn, img_path, r, source="benchmark")
+            timings["db_store"] = (time.perf_counter() - t1) * 1000.0
+        timings["total"] = (time.perf_counter() - t0) * 1000.0
+        timings["_count"] = r["count"]
+        return timings
+
+    for _ in range(args.warmup):
+        one(images[0])
+
+    wall0 = time.perf_counter()
+    for _ in range(args.repeat):
+        for img_path in images:
+            timings = one(img_path)
+            for stage in STAGES:
+                if stage in timings:
+                    samples[stage].append(timings[stage])
+            totals.append(timings["total"])
+            people.append(int(timings["_count"]))
+    wall = time.perf_counter() - wall0
+
+    return {
+        "name": name,
+        "images": len(images),
+        "runs": len(totals),
+        "stages_ms": {s: _summarize(v) for s, v in samples.items() if v},
+        "total_ms": _summarize(totals),
+        "throughput_ips": round(len(totals) / wall, 3) if wall > 0 else 0.0,
+        "people_mean": round(sum(people) / len(people), 2) if people else 0.0,
+    }
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_abs_ms: float) -> List[str]:
+    """
+    Compara dois relatórios. Retorna a lista de regressões encontradas:
+    p50/p95 de cada etapa (e do total) acima de baseline * (1 + tolerance)
+    por mais de `min_abs_ms`, ou throughput abaixo de baseline * (1 - tolerance).
+    """
+    regressions = []
+    base_cases = {c["name"]: c for c in baseline.get("cases", [])}
+    for case in current.get("cases", []):
+        base = base_cases.get(case["name"])
+        if base is None:
+            continue
+        pairs = [("total", case["total_ms"], base["total_ms"])]
+        pairs += [(s, v, base["stages_ms"][s]) for s, v in case["stages_ms"].items() if s in base["stages_ms"]]
+        for stage, cur_stats, base_stats in pairs:
+            for q in ("p50", "p95"):
+                cur_v, base_v = cur_stats[q], base_stats[q]
+                if cur_v > base_v * (1 + tolerance) and cur_v - base_v > min_abs_ms:
+                    regressions.append(f"{case['name']} {stage} {q}: {base_v:.1f} -> {cur_v:.1f} ms")
+        if case["throughput_ips"] < base["throughput_ips"] * (1 - tolerance):
+            regressions.append(
+                f"{case['name']} throughput: {base['throughput_ips']:.2f} -> {case['throughput_ips']:.2f} img/s"
+            )
+    base_startup = {m["module"]: m for m in baseline.get("startup", [])}
+    for mod in current.get("startup", []):
+        base = base_startup.get(mod["module"])
+        if base is None or mod["cumulative_ms"] is None or base["cumulative_ms"] is None:
+            continue
+        cur_v, base_v = mod["cumulative_ms"], base["cumulative_ms"]
+        if cur_v > base_v * (1 + tolerance) and cur_v - base_v > min_abs_ms:
+            regressions.append(f"import {mod['module']}: {base_v:.1f} -> {cur_v:.1f} ms")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Benchmark offline do pipeline de contagem de pessoas.")
+    p.add_argument("--input-dir", type=str, default=None, help="Pasta com imagens reais (em vez de imagens sintéticas).")
+    p.add_argument("--resolutions", type=str, default="640x480,1920x1080,3840x2160", help="Resoluções sintéticas LxA separadas por vírgula.")
+    p.add_argument("--densities", type=str, default="0,10,100", help="Pessoas sintéticas por imagem, separadas por vírgula.")
+    p.add_argument("--images", type=int, default=None, help="Imagens por caso (sintéticas, padrão 3) ou limite de imagens da pasta.")
+    p.add_argument("--repeat", type=int, default=3, help="Repetições de cada imagem.")
+    p.add_argument("--warmup", type=int, default=1, help="Execuções descartadas antes de medir cada caso.")
+    p.add_argument("--seed", type=int, default=0, help="Semente das imagens sintéticas.")
+    p.add_argument("--mode", type=str, default="seg", choices=["seg", "bbox"], help="Modo de anotação.")
+    p.add_argument("--conf", type=float, default=0.25, help="Confiança mínima para deteção.")
+    p.add_argument("--device", type=str, default="cpu", help='Device: "cpu", "cuda", "mps", etc.')
+    p.add_argument("--import-time", type=str, default=None, help="Módulos cujo tempo de importação medir, ex.: count_people,api.")
+    p.add_argument("--no-pipeline", action="store_true", help="Não executa os casos do pipeline (útil com --import-time).")
+    p.add_argument("--db-store", action="store_true", help="Mede também o armazenamento no DB (requer DB_* no ambiente).")
+    p.add_argument("--output", type=str, default=None, help="Arquivo JSON do relatório (padrão: stdout).")
+    p.add_argument("--compare", type=str, default=None, help="Relatório baseline para detectar regressões.")
+    p.add_argument("--tolerance", type=float, default=0.15, help="Tolerância relativa na comparação (padrão 0.15).")
+    p.add_argument("--min-abs-ms", type=float, default=2.0, help="Diferença mínima absoluta (ms) para contar regressão.")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    conn = None
+    if args.db_store:
+        conn = _db_connect_from_env()
+        if conn is None:
+            print("Aviso: --db-store ativo, mas conexão com DB não disponível. Pulando db_store.", file=sys.stderr)
+        else:
+            _db_ensure_table(conn)
+
+    # Medido antes do pipeline, em subprocessos, para não herdar módulos já importados
+    startup = [import_time_report(m.strip()) for m in (args.import_time or "").split(",") if m.strip()]
+
+    results = []
+    if not args.no_pipeline:
+        with tempfile.TemporaryDirectory(prefix="people_bench_") as td:
+            workdir = Path(td)
+            out_dir = workdir / "out"
+            out_dir.mkdir()
+            cases = _build_cases(args, workdir / "inputs")
+            for name, images in cases.items():
+                print(f"Caso {name}: {len(images)} imagem(ns) x {args.repeat}", file=sys.stderr)
+                results.append(_run_case(name, images, args, out_dir, conn))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": args.mode,
+            "conf": args.conf,
+            "device": args.device,
+            "repeat": args.repeat,
+            "db_store": conn is not None,
+        },
+        "cases": results,
+        "startup": startup,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+        print(f"Relatório: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare_reports(report, baseline, args.tolerance, args.min_abs_ms)
+        if regressions:
+            print("Regressões em relação ao baseline:", file=sys.stderr)
+            for line in regressions:
+                print(f"  - {line}", file=sys.stderr)
+            return 1
+        print("Sem regressões em relação ao baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -19,34 +19,199 @@ Exemplos:
 Autor: (você)
 """
 
+from __future__ import annotations
+
 import argparse
 import os
 import sys
 import json
 import csv
 import hashlib
+import time
+from datetime import timezone
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict, Any
+import threading
+import signal
+from typing import TYPE_CHECKING, List, Tuple, Optional, Dict, Any
 
-import numpy as np
-import cv2
-from PIL import Image, ImageOps
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import Json
+from roi import load_roi_config, roi_for
 
+# Importações pesadas (numpy, cv2, PIL, psycopg2 e sobretudo ultralytics/torch)
+# são feitas sob demanda dentro das funções: `--help`, a API antes do warm-up e
+# ferramentas que só usam helpers de DB não pagam esse custo na inicialização.
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Pesos usados por modo de anotação
+MODEL_NAMES = {"seg": "yolov8n-seg.pt", "bbox": "yolov8n.pt"}
+# Entradas tratadas como vídeo (amostradas a cada --video-stride frames)
+VIDEO_EXTS = {".mp4", ".avi", ".mov", ".mkv"}
+
+
+def model_version(mode: str) -> str:
+    """
+    Identificador do modelo usado em `mode` (parte da chave do cache de resultados).
+    MODEL_VERSION no ambiente diferencia pesos trocados sob o mesmo nome de arquivo.
+    """
+    if mode == "density":
+        import density
+
+        return density.model_version()
+    base = MODEL_NAMES[mode]
+    if os.getenv("PEOPLE_MODEL_STUB"):
+        # Resultados do stub nunca podem ser servidos como se fossem do modelo real
+        base = f"{base}+stub"
+    extra = os.getenv("MODEL_VERSION")
+    return f"{base}@{extra}" if extra else base
+
+
+_ULTRALYTICS_HINT = "Erro ao importar 'ultralytics'. Instale com:\n    pip install ultralytics\n"
+
+# Modelos carregados (um por arquivo de pesos), compartilhados entre chamadas
+_MODELS: Dict[str, Any] = {}
+_MODELS_LOCK = threading.Lock()
+# Um lock de inferência por modelo: o predictor do Ultralytics não é thread-safe,
+# e a API roda marcar_pessoas em threads do threadpool
+_INFER_LOCKS: Dict[int, threading.Lock] = {}
 
-# Checagem amigável para ultralytics
-try:
-    from ultralytics import YOLO
-except Exception as exc:
-    print(
-        "Erro ao importar 'ultralytics'. Instale com:\n"
-        "    pip install ultralytics\n"
-        f"Detalhes: {exc}",
-        file=sys.stderr,
-    )
-    sys.exit(1)
+
+def _infer_lock(model) -> threading.Lock:
+    lock = _INFER_LOCKS.get(id(model))
+    if lock is None:
+        with _MODELS_LOCK:
+            lock = _INFER_LOCKS.setdefault(id(model), threading.Lock())
+    return lock
+
+
+class _StubTensor:
+    def __init__(self, array) -> None:
+        self._array = array
+
+    def cpu(self) -> "_StubTensor":
+        return self
+
+    def numpy(self):
+        return self._array
+
+
+class _StubModel:
+    """
+    Substituto do YOLO para testes de carga (PEOPLE_MODEL_STUB="<latência ms>[:<pessoas>]"):
+    dorme a latência fixa por frame (liberando o GIL, como a inferência real)
+    e devolve `people` caixas numa grade; no modo seg, também as máscaras
+    (`data`, como as do YOLO) e polígonos retangulares (`xy`).
+    Não importa ultralytics/torch nem precisa dos pesos.
+    """
+
+    def __init__(self, spec: str, seg: bool) -> None:
+        latency, _, people = spec.partition(":")
+        self.latency = max(0.0, float(latency or 0)) / 1000.0
+        self.people = max(0, int(people or 3))
+        self.seg = seg
+
+    def _result(self, frame):
+        import numpy as np
+        from types import SimpleNamespace
+
+        h, w = frame.shape[:2]
+        cols = max(1, int(np.ceil(np.sqrt(self.people))))
+        bw, bh = w / (cols * 2), h / (cols * 2)
+        boxes = []
+        for i in range(self.people):
+            x1 = (i % cols) * 2 * bw + bw / 2
+            y1 = (i // cols) * 2 * bh + bh / 2
+            boxes.append([x1, y1, x1 + bw, y1 + bh])
+        xyxy = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        masks = None
+        if self.seg and len(xyxy):
+            masks = SimpleNamespace(
+                data=self._mask_data(xyxy, (h, w)),
+                orig_shape=(h, w),
+                xy=[np.array([[a, b], [c, b], [c, d], [a, d]], dtype=np.float32) for a, b, c, d in xyxy],
+            )
+        return SimpleNamespace(
+            boxes=SimpleNamespace(xyxy=_StubTensor(xyxy), conf=_StubTensor(np.full(len(xyxy), 0.9, dtype=np.float32))),
+            masks=masks,
+            orig_shape=(h, w),
+        )
+
+    @staticmethod
+    def _mask_data(xyxy, orig_shape, imgsz: int = 640, stride: int = 32):
+        """
+        Máscaras (N, h, w) como as do YOLO-seg: uma elipse por caixa, no frame
+        com letterbox de lado maior `imgsz` (bordas múltiplas de `stride`).
+        """
+        import cv2
+        import numpy as np
+
+        oh, ow = orig_shape
+        gain = imgsz / float(max(oh, ow))
+        mh = int(np.ceil(oh * gain / stride) * stride)
+        mw = int(np.ceil(ow * gain / stride) * stride)
+        pad_x, pad_y = (mw - ow * gain) / 2, (mh - oh * gain) / 2
+        data = np.zeros((len(xyxy), mh, mw), dtype=np.float32)
+        for i, (x1, y1, x2, y2) in enumerate(xyxy):
+            center = (int((x1 + x2) / 2 * gain + pad_x), int((y1 + y2) / 2 * gain + pad_y))
+            axes = (max(1, int((x2 - x1) / 2 * gain)), max(1, int((y2 - y1) / 2 * gain)))
+            cv2.ellipse(data[i], center, axes, 0, 0, 360, 1.0, -1)
+        return data
+
+    def __call__(self, source, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        time.sleep(self.latency * len(frames))
+        return [self._result(f) for f in frames]
+
+
+def _get_model(model_name: str):
+    """
+    Retorna o modelo YOLO `model_name`, carregando-o (e importando ultralytics) só na primeira vez.
+    Com PEOPLE_MODEL_STUB definido, retorna um _StubModel (testes de carga sem GPU/pesos).
+    """
+    model = _MODELS.get(model_name)
+    if model is not None:
+        return model
+    with _MODELS_LOCK:
+        model = _MODELS.get(model_name)
+        stub = os.getenv("PEOPLE_MODEL_STUB")
+        if model is None and stub:
+            model = _MODELS[model_name] = _StubModel(stub, seg="-seg" in model_name)
+        if model is None:
+            try:
+                from ultralytics import YOLO
+            except Exception as exc:
+                raise RuntimeError(f"{_ULTRALYTICS_HINT}Detalhes: {exc}") from exc
+            model = YOLO(model_name)
+            _MODELS[model_name] = model
+    return model
+
+
+def model_loaded(mode: str) -> bool:
+    if mode == "density":
+        import density
+
+        return density.loaded()
+    return MODEL_NAMES[mode] in _MODELS
+
+
+def warm_up(modes: List[str], device: Optional[str] = None) -> None:
+    """
+    Carrega os modelos de `modes` e executa uma inferência num frame vazio,
+    para que a primeira requisição real não pague import, leitura dos pesos e
+    inicialização do torch.
+    """
+    import numpy as np
+
+    dummy = np.zeros((64, 64, 3), dtype=np.uint8)
+    for mode in modes:
+        if mode == "density":
+            import density
+
+            density.get_estimator().predict(dummy)
+            continue
+        model = _get_model(MODEL_NAMES[mode])
+        with _infer_lock(model):
+            model(dummy, device=_auto_device_hint(device), classes=[0], verbose=False)
 
 
 def _ensure_dir(path: Path) -> None:
@@ -57,11 +222,139 @@ def _read_image_fix_exif(image_path: Path) -> np.ndarray:
     """
     Lê a imagem corrigindo rotação EXIF e retornando como array BGR (OpenCV).
     """
+    return _read_image_bounded(image_path)[0]
+
+
+def _working_scale(width: int, height: int, max_pixels: Optional[int]) -> float:
+    """
+    Fator (<= 1) que leva um frame width x height a no máximo `max_pixels` pixels.
+    """
+    if not max_pixels or width * height <= max_pixels:
+        return 1.0
+    return (max_pixels / float(width * height)) ** 0.5
+
+
+def _read_image_bounded(image_path: Path, max_pixels: Optional[int] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Lê a imagem (com correção EXIF) como BGR com no máximo `max_pixels` pixels.
+    JPEGs são decodificados já reduzidos (escala DCT do libjpeg via draft do PIL),
+    então o frame em resolução cheia nunca é alocado; os demais formatos são
+    reduzidos logo após a leitura. Retorna (frame, (largura, altura) originais).
+    """
+    import numpy as np
+    import cv2
+    from PIL import Image, ImageOps
+
     img = Image.open(str(image_path))
+    width, height = img.size
+    if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+        # orientações com rotação de 90°: largura e altura trocam após exif_transpose
+        width, height = height, width
+    scale = _working_scale(width, height, max_pixels)
+    if scale < 1.0:
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        img.draft("RGB", size)  # JPEG: menor escala 1/2, 1/4 ou 1/8 que ainda cobre `size`
+        img.thumbnail(size, Image.BILINEAR, reducing_gap=None)
     img = ImageOps.exif_transpose(img).convert("RGB")  # corrige orientação
-    arr = np.array(img)  # RGB
-    arr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)  # para BGR (OpenCV)
-    return arr
+    arr = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)  # para BGR (OpenCV)
+    return arr, (width, height)
+
+
+def _scale_detections(detections: List[Dict[str, Any]], sx: float, sy: float) -> None:
+    """
+    Leva bbox e polígonos das detecções do frame de trabalho ao frame original (no lugar).
+    """
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        det["bbox"] = [x1 * sx, y1 * sy, x2 * sx, y2 * sy]
+        if "polygons" in det:
+            det["polygons"] = [[[x * sx, y * sy] for x, y in seg] for seg in det["polygons"]]
+
+
+def _reset_peak_rss() -> None:
+    """
+    Zera o pico de memória residente do processo (VmHWM; Linux >= 4.0).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class _PeakRss:
+    """
+    Pico de RSS de uma imagem. O VmHWM é do processo inteiro: só é zerado
+    quando nenhuma outra imagem está em andamento, e uma imagem que começa
+    invalida o pico das que estão em andamento. Com imagens simultâneas
+    (threads da API, workers das fontes) o pico não é atribuível a nenhuma
+    delas e `peak_mb()` retorna None.
+
+    `shared`: medição já encerrada das etapas que a imagem dividiu com outras
+    do mesmo lote (decode e inferência de marcar_pessoas_batch); o pico da
+    imagem inclui o dessas etapas, e é None se elas não foram atribuíveis.
+    """
+
+    _lock = threading.Lock()
+    _active = 0
+    _epoch = 0
+
+    def __init__(self, shared: Optional["_PeakRss"] = None) -> None:
+        self.floor = shared.peak_mb() if shared is not None else None
+        cls = type(self)
+        with cls._lock:
+            cls._epoch += 1
+            cls._active += 1
+            self.epoch = cls._epoch
+            self.isolated = cls._active == 1 and (shared is None or self.floor is not None)
+            if self.isolated:
+                _reset_peak_rss()
+        self._closed = False
+        self._final: Optional[float] = None
+
+    def peak_mb(self) -> Optional[float]:
+        with self._lock:
+            if self._closed:
+                return self._final
+            if not (self.isolated and self.epoch == type(self)._epoch):
+                return None
+        peak = _rss_mb("VmHWM")
+        if peak is None or self.floor is None:
+            return peak
+        return max(peak, self.floor)
+
+    def close(self) -> None:
+        """Encerra a medição; `peak_mb()` passa a devolver o pico fixado aqui."""
+        final = self.peak_mb()
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._final = final
+                type(self)._active -= 1
+
+
+def _rss_mb(field: str = "VmRSS") -> Optional[float]:
+    """
+    VmRSS (atual) ou VmHWM (pico) do processo em MB, lidos de /proc/self/status; None fora do Linux.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _tick(timings: Optional[Dict[str, float]], stage: str, t0: float) -> float:
+    """
+    Acumula em `timings[stage]` o tempo (ms) desde `t0` e retorna o instante atual.
+    """
+    t1 = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (t1 - t0) * 1000.0
+    return t1
 
 
 def _auto_device_hint(device_arg: Optional[str]) -> str:
@@ -83,6 +376,8 @@ def _color_from_index(idx: int) -> Tuple[int, int, int]:
     """
     Gera uma cor BGR estável a partir de um índice.
     """
+    import numpy as np
+
     # Paleta determinística simples via hashing
     rng = np.random.default_rng(seed=idx + 12345)
     c = rng.integers(0, 255, size=3).tolist()
@@ -98,16 +393,29 @@ def _draw_mask_overlay(
 ) -> None:
     """
     Desenha contornos e um leve preenchimento transparente para os polígonos da máscara.
+    A mistura é feita só no retângulo que envolve os polígonos (mais a espessura
+    do contorno), sem copiar o frame inteiro por pessoa.
     """
-    overlay = base_img.copy()
-    for pts in polygons:
-        if pts.shape[0] < 3:
-            continue
-        pts_i32 = pts.astype(np.int32)
-        cv2.fillPoly(overlay, [pts_i32], color)
+    import numpy as np
+    import cv2
+
+    pts_list = [pts.astype(np.int32) for pts in polygons if pts.shape[0] >= 3]
+    if not pts_list:
+        return
+    h, w = base_img.shape[:2]
+    bx, by, bw, bh = cv2.boundingRect(np.concatenate(pts_list))
+    grow = thickness + 1
+    x0, y0 = max(bx - grow, 0), max(by - grow, 0)
+    x1, y1 = min(bx + bw + grow, w), min(by + bh + grow, h)
+    if x1 <= x0 or y1 <= y0:
+        return
+    region = base_img[y0:y1, x0:x1]
+    overlay = region.copy()
+    for pts_i32 in pts_list:
+        cv2.fillPoly(overlay, [pts_i32], color, offset=(-x0, -y0))
         cv2.polylines(base_img, [pts_i32], isClosed=True, color=color, thickness=thickness, lineType=cv2.LINE_AA)
-    # aplica transparência
-    cv2.addWeighted(overlay, alpha, base_img, 1 - alpha, 0, dst=base_img)
+    # aplica transparência (region é uma view de base_img)
+    cv2.addWeighted(overlay, alpha, region, 1 - alpha, 0, dst=region)
 
 
 def _draw_bbox(
@@ -117,6 +425,8 @@ def _draw_bbox(
     label: Optional[str],
     thickness: int = 3,
 ) -> None:
+    import cv2
+
     x1, y1, x2, y2 = map(int, box)
     cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
     if label:
@@ -148,6 +458,8 @@ def _draw_total_count(
 
     position: "top_left", "top_right", "bottom_left", "bottom_right"
     """
+    import cv2
+
     label = f"Total de pessoas: {total}"
     font = cv2.FONT_HERSHEY_SIMPLEX
     font_scale = 0.9
@@ -164,16 +476,10 @@ def _draw_total_count(
     else:  # bottom_right
         x, y = w - (tw + 2 * pad) - 12, h - (th + 2 * pad) - 12
 
-    # Fundo semitransparente
-    overlay = img.copy()
-    cv2.rectangle(
-        overlay,
-        (x, y),
-        (x + tw + 2 * pad, y + th + 2 * pad),
-        (0, 0, 0),
-        -1,
-    )
-    cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, dst=img)
+    # Fundo semitransparente (preto): escurece só o retângulo do rótulo, no lugar
+    region = img[max(y, 0):max(y + th + 2 * pad + 1, 0), max(x, 0):max(x + tw + 2 * pad + 1, 0)]
+    if region.size:
+        cv2.addWeighted(region, 1 - alpha, region, 0, 0, dst=region)
 
     # Texto em branco
     cv2.putText(
@@ -188,68 +494,179 @@ def _draw_total_count(
     )
 
 
-def marcar_pessoas(
-    input_image: Path,
-    output_dir: Optional[Path] = None,
-    mode: str = "seg",
-    conf: float = 0.25,
-    thickness: int = 3,
-    show_label: bool = True,
-    device: Optional[str] = None,
-    export_csv: bool = True,
+# Formatos de rendição -> (extensão, mime, (flag de qualidade do cv2.imencode, valor))
+RENDITION_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", ("IMWRITE_JPEG_QUALITY", 85)),
+    "webp": (".webp", "image/webp", ("IMWRITE_WEBP_QUALITY", 80)),
+}
+
+
+# Formatos da imagem anotada -> (extensão, mime); "auto" espelha a entrada (.png -> png, demais -> jpeg)
+OUTPUT_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+}
+# Padrões iguais aos do cv2.imwrite (saída idêntica à anterior quando nada é configurado)
+DEFAULT_JPEG_QUALITY = 95
+DEFAULT_WEBP_QUALITY = 80
+DEFAULT_PNG_COMPRESSION = 1
+
+_ENCODE_POOL = None
+_ENCODE_POOL_LOCK = threading.Lock()
+
+
+def _encode_pool():
+    """
+    Pool de threads para a codificação da imagem anotada (cv2.imencode libera o GIL),
+    fora da thread que faz a inferência. Tamanho: ENCODE_WORKERS (padrão 2).
+    """
+    global _ENCODE_POOL
+    if _ENCODE_POOL is None:
+        with _ENCODE_POOL_LOCK:
+            if _ENCODE_POOL is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                workers = max(1, int(os.getenv("ENCODE_WORKERS", "2")))
+                _ENCODE_POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+    return _ENCODE_POOL
+
+
+def output_codec(
+    fmt: str = "auto",
+    quality: Optional[int] = None,
+    png_compression: Optional[int] = None,
+    max_side: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
-    Processa a imagem, detecta pessoas e escreve resultado anotado.
+    Valida e normaliza a configuração de saída da imagem anotada.
+    `quality` vale para jpeg (0..100) e webp (1..100); `png_compression` 0..9;
+    `max_side` reduz a imagem anotada (lado maior) antes de codificar.
+    """
+    fmt = (fmt or "auto").lower().strip()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt != "auto" and fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato de saída inválido: {fmt} (use auto, jpeg, png ou webp)")
+    if quality is not None and not 0 <= int(quality) <= 100:
+        raise ValueError("Qualidade de saída deve estar entre 0 e 100.")
+    if png_compression is not None and not 0 <= int(png_compression) <= 9:
+        raise ValueError("Compressão PNG deve estar entre 0 e 9.")
+    return {
+        "format": fmt,
+        "quality": None if quality is None else int(quality),
+        "png_compression": None if png_compression is None else int(png_compression),
+        "max_side": int(max_side) if max_side else None,
+    }
 
-    Retorna um dicionário com:
-        {
-            "count": int,
-            "output_image": str,
-            "json_path": str,
-            "csv_path": Optional[str],
-            "detections": [
-                {
-                    "id": int,
-                    "score": float,
-                    "bbox": [x1, y1, x2, y2],
-                    "polygons": [ [[x,y], ...], ... ]  # quando seg
-                },
-                ...
-            ]
-        }
+
+def codec_fingerprint(codec: Dict[str, Any]) -> str:
     """
-    assert input_image.exists(), f"Arquivo não encontrado: {input_image}"
-    if output_dir is None:
-        output_dir = input_image.parent
-    _ensure_dir(output_dir)
+    Identificador curto da configuração de saída (entra na chave do cache de resultados).
+    """
+    return "{format}:{quality}:{png_compression}:{max_side}".format(**codec)
 
-    device = _auto_device_hint(device)
 
-    # Modelo: segmentação se possível
-    mode = mode.lower().strip()
-    if mode not in {"seg", "bbox"}:
-        raise ValueError("Parâmetro --mode deve ser 'seg' ou 'bbox'.")
+def _encode_output(img: np.ndarray, input_suffix: str, codec: Dict[str, Any]) -> Tuple[bytes, str, str]:
+    """
+    Codifica a imagem anotada conforme `codec`; retorna (bytes, extensão, mime).
+    """
+    import cv2
+
+    fmt = codec["format"]
+    if fmt == "auto":
+        fmt = "png" if input_suffix == ".png" else "jpeg"
+    ext, mime = OUTPUT_FORMATS[fmt]
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, codec["quality"] if codec["quality"] is not None else DEFAULT_JPEG_QUALITY]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, max(1, codec["quality"] if codec["quality"] is not None else DEFAULT_WEBP_QUALITY)]
+    else:
+        level = codec["png_compression"] if codec["png_compression"] is not None else DEFAULT_PNG_COMPRESSION
+        params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+    max_side = codec.get("max_side")
+    h, w = img.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / float(max(h, w))
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise RuntimeError(f"Falha ao codificar a imagem anotada como {fmt}.")
+    return buf.tobytes(), ext, mime
 
-    model_name = "yolov8n-seg.pt" if mode == "seg" else "yolov8n.pt"
-    model = YOLO(model_name)
 
-    # Leitura e correção de EXIF
-    img_bgr = _read_image_fix_exif(input_image)
+def _parse_sizes(value: Optional[str]) -> List[int]:
+    """
+    Converte "256,1024" em [256, 1024] (ordenado, sem repetidos).
+    """
+    if not value:
+        return []
+    return sorted({int(v) for v in value.split(",") if v.strip()})
 
-    # Inferência restringindo à classe 0 (person)
-    # Nota: Ultralytics faz NMS internamente.
-    results = model(img_bgr, conf=conf, device=device, classes=[0])
-    r = results[0]  # processamos uma imagem
 
-    detections = []
-    count = 0
+def _write_renditions(
+    img: np.ndarray,
+    output_dir: Path,
+    stem: str,
+    sizes: List[int],
+    fmt: str = "jpeg",
+) -> Dict[str, str]:
+    """
+    Gera versões reduzidas (lado maior = size) da imagem já decodificada/anotada.
+    Nunca amplia: tamanhos >= ao lado maior da imagem são ignorados.
+    Retorna {"256": caminho, ...}.
+    """
+    import cv2
+
+    if fmt not in RENDITION_FORMATS:
+        raise ValueError(f"Formato de rendição inválido: {fmt}")
+    ext, _, (flag, quality) = RENDITION_FORMATS[fmt]
+    params = [getattr(cv2, flag), quality]
+    h, w = img.shape[:2]
+    longest = max(h, w)
+    out: Dict[str, str] = {}
+    for size in sizes:
+        if size <= 0 or size >= longest:
+            continue
+        scale = size / float(longest)
+        small = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        path = output_dir / f"{stem}_marked_{size}{ext}"
+        ok, buf = cv2.imencode(ext, small, params)
+        if not ok:
+            continue
+        path.write_bytes(buf.tobytes())
+        out[str(size)] = str(path)
+    return out
+
+
+def _infer(model, img_bgr: np.ndarray, conf: float, device: str):
+    """
+    Inferência restringindo à classe 0 (person); retorna o resultado da única imagem.
+    Nota: Ultralytics faz NMS internamente.
+    """
+    with _infer_lock(model):
+        results = model(img_bgr, conf=conf, device=device, classes=[0])
+    return results[0]
+
+
+def _collect_detections(r, mode: str) -> Tuple[np.ndarray, List[float], List[List[np.ndarray]]]:
+    """
+    Extrai do resultado do YOLO (caixas xyxy, scores, polígonos por máscara).
+    """
+    import numpy as np
 
-    # Coleta de caixas e máscaras
     boxes_xyxy = r.boxes.xyxy.cpu().numpy() if r.boxes is not None else np.zeros((0, 4))
     scores = r.boxes.conf.cpu().numpy().tolist() if r.boxes is not None and r.boxes.conf is not None else []
     masks_polys: List[List[np.ndarray]] = []
 
-    if mode == "seg" and r.masks is not None:
+    data = getattr(r.masks, "data", None) if mode == "seg" and r.masks is not None else None
+    orig_shape = getattr(r.masks, "orig_shape", None) or getattr(r, "orig_shape", None)
+    if data is not None and orig_shape is not None and os.getenv("MASK_POLYGONS", "data") != "xy":
+        # Contornos só no recorte de cada caixa da máscara de baixa resolução, em paralelo
+        from mask_polygons import extract_polygons
+
+        masks_polys = extract_polygons(data, boxes_xyxy, orig_shape)
+    elif mode == "seg" and r.masks is not None:
         # r.masks.xy é uma lista de listas de polígonos (cada máscara pode ter 1+ segmentos)
         # Em versões recentes, usar r.masks.xyn (normalizado) ou r.masks.xy (em pixels).
         # Preferimos r.masks.xy (coordenadas já na escala original).
@@ -274,9 +691,26 @@ def marcar_pessoas(
                     masks_polys.append([])
     else:
         masks_polys = [[] for _ in range(len(boxes_xyxy))]
-
-    # Desenho
-    annotated = img_bgr.copy()
+    return boxes_xyxy, scores, masks_polys
+
+
+def _draw_detections(
+    img_bgr: np.ndarray,
+    boxes_xyxy: np.ndarray,
+    scores: List[float],
+    masks_polys: List[List[np.ndarray]],
+    mode: str,
+    thickness: int,
+    show_label: bool,
+    in_place: bool = False,
+) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+    """
+    Desenha caixas/contornos e o total numa cópia do frame (ou no próprio frame,
+    com `in_place`); retorna (anotada, detections).
+    """
+    detections = []
+    count = 0
+    annotated = img_bgr if in_place else img_bgr.copy()
     for i, box in enumerate(boxes_xyxy):
         count += 1
         color = _color_from_index(i)
@@ -305,36 +739,336 @@ def marcar_pessoas(
 
     # Desenha total de pessoas na imagem
     _draw_total_count(annotated, count, position="top_left", alpha=0.4, pad=10)
+    return annotated, detections
 
-    # Saídas
-    stem = input_image.stem
-    ext = input_image.suffix.lower()
-    out_image_path = output_dir / f"{stem}_marked{ext if ext in ('.jpg', '.jpeg', '.png') else '.jpg'}"
-    json_path = output_dir / f"{stem}_marked_meta.json"
-    csv_path = output_dir / f"{stem}_marked_boxes.csv"
 
-    # Escreve imagem anotada (garante formato suportado)
-    ok = cv2.imwrite(str(out_image_path), annotated)
-    if not ok:
-        # fallback para .png
-        out_image_path = output_dir / f"{stem}_marked.png"
-        cv2.imwrite(str(out_image_path), annotated)
+def marcar_pessoas(
+    input_image: Path,
+    output_dir: Optional[Path] = None,
+    mode: str = "seg",
+    conf: float = 0.25,
+    thickness: int = 3,
+    show_label: bool = True,
+    device: Optional[str] = None,
+    export_csv: bool = True,
+    renditions: Optional[List[int]] = None,
+    rendition_format: str = "jpeg",
+    timings: Optional[Dict[str, float]] = None,
+    motion_gate: Optional[Any] = None,
+    gate_source: Optional[str] = None,
+    density_model: Optional[str] = None,
+    density_switch: Optional[float] = None,
+    roi: Optional[Any] = None,
+    codec: Optional[Dict[str, Any]] = None,
+    frame: Optional[np.ndarray] = None,
+    max_pixels: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Processa a imagem, detecta pessoas e escreve resultado anotado.
+
+    `renditions`: lados maiores (px) das versões reduzidas a gerar a partir do
+    frame anotado, ex.: [256, 1024]; `rendition_format`: "jpeg" ou "webp".
+    `timings`: se informado, recebe o tempo (ms) de cada etapa: decode, gate,
+    model_load, inference, masks, draw, encode e write.
+    `motion_gate`: instância de motion_gate.MotionGate; com o frame estático em
+    relação ao último inferido da mesma fonte (`gate_source`, padrão: pasta da
+    imagem), reaproveita as detecções e pula model_load/inference/masks.
+    `mode="density"`: estima a contagem com um modelo de densidade ONNX em CPU
+    (`density_model` ou DENSITY_MODEL); o metadata traz `density_count` e uma
+    grade de baixa resolução (`density_grid`), e a imagem recebe um heatmap.
+    `density_switch`: pessoas por megapixel a partir das quais uma detecção
+    seg/bbox é refeita no modo density (multidões onde o YOLO satura).
+    `roi`: instância de roi.RegionOfInterest; a inferência roda no recorte da
+    ROI com as áreas excluídas mascaradas, e só ficam detecções com centroide
+    dentro dela (coordenadas sempre no frame completo).
+    `codec`: saída de output_codec() (formato, qualidade, compressão PNG e
+    redução da imagem anotada); padrão: espelha a entrada, jpeg qualidade 95.
+    A codificação roda no pool de encode (ENCODE_WORKERS threads).
+    `frame`: frame BGR já decodificado (ex.: vídeo); pula a leitura do disco e
+    `input_image` serve só para nomear as saídas.
+    `max_pixels`: orçamento de memória; frames maiores são processados numa
+    cópia de trabalho reduzida (JPEG já decodificado reduzido). A imagem anotada
+    sai na resolução de trabalho; bbox/polígonos, `frame_size`, ROI e heatmap
+    seguem no frame original. O metadata traz `memory` (RSS no início e pico
+    de RSS durante a imagem, em MB; o pico é None quando outra imagem rodou ao
+    mesmo tempo no processo) e `working_size` quando reduzido.
+
+    Retorna um dicionário com:
+        {
+            "count": int,
+            "output_image": str,
+            "output_mime": str,
+            "output_bytes": int,
+            "json_path": str,
+            "csv_path": Optional[str],
+            "renditions": {"256": str, ...},
+            "detections": [
+                {
+                    "id": int,
+                    "score": float,
+                    "bbox": [x1, y1, x2, y2],
+                    "polygons": [ [[x,y], ...], ... ]  # quando seg
+                },
+                ...
+            ]
+        }
+    """
+    peak = _PeakRss()
+    try:
+        return _marcar_pessoas(
+            input_image,
+            output_dir,
+            mode,
+            conf,
+            thickness,
+            show_label,
+            device,
+            export_csv,
+            renditions,
+            rendition_format,
+            timings,
+            motion_gate,
+            gate_source,
+            density_model,
+            density_switch,
+            roi,
+            codec,
+            frame,
+            max_pixels,
+            peak,
+        )
+    finally:
+        peak.close()
+
+
+def _marcar_pessoas(
+    input_image: Path,
+    output_dir: Optional[Path],
+    mode: str,
+    conf: float,
+    thickness: int,
+    show_label: bool,
+    device: Optional[str],
+    export_csv: bool,
+    renditions: Optional[List[int]],
+    rendition_format: str,
+    timings: Optional[Dict[str, float]],
+    motion_gate: Optional[Any],
+    gate_source: Optional[str],
+    density_model: Optional[str],
+    density_switch: Optional[float],
+    roi: Optional[Any],
+    codec: Optional[Dict[str, Any]],
+    frame: Optional[np.ndarray],
+    max_pixels: Optional[int],
+    peak: "_PeakRss",
+) -> Dict[str, Any]:
+    """
+    Corpo de marcar_pessoas; `peak` mede o pico de RSS da imagem.
+    """
+    if frame is None:
+        assert input_image.exists(), f"Arquivo não encontrado: {input_image}"
+    if output_dir is None:
+        output_dir = input_image.parent
+    _ensure_dir(output_dir)
+
+    device = _auto_device_hint(device)
+
+    # Modelo: segmentação se possível
+    mode = mode.lower().strip()
+    if mode not in {"seg", "bbox", "density"}:
+        raise ValueError("Parâmetro --mode deve ser 'seg', 'bbox' ou 'density'.")
+
+    memory = {"rss_start_mb": _rss_mb()}
+    t = time.perf_counter()
+    # Leitura e correção de EXIF; acima de `max_pixels`, já na resolução de trabalho
+    if frame is not None:
+        frame_size = (int(frame.shape[1]), int(frame.shape[0]))
+        scale = _working_scale(frame_size[0], frame_size[1], max_pixels)
+        img_bgr = frame
+        if scale < 1.0:
+            import cv2
+
+            work = (max(1, int(frame_size[0] * scale)), max(1, int(frame_size[1] * scale)))
+            img_bgr = cv2.resize(frame, work, interpolation=cv2.INTER_AREA)
+    else:
+        img_bgr, frame_size = _read_image_bounded(input_image, max_pixels)
+    # O frame de trabalho é nosso (decodificado ou reduzido aqui): a anotação é feita nele, sem cópia
+    own_frame = img_bgr is not frame
+    sx, sy = frame_size[0] / float(img_bgr.shape[1]), frame_size[1] / float(img_bgr.shape[0])
+    scaled = img_bgr.shape[1] != frame_size[0] or img_bgr.shape[0] != frame_size[1]
+    work_roi = roi.scaled(1.0 / sx, 1.0 / sy) if roi is not None and scaled else roi
+    t = _tick(timings, "decode", t)
+
+    # Porta de movimento: frame estático reaproveita as detecções anteriores da fonte
+    gate_info = None
+    reused = None
+    if motion_gate is not None and mode != "density":
+        reused, gate_info = motion_gate.check(gate_source or str(input_image.parent), img_bgr)
+        t = _tick(timings, "gate", t)
+
+    switched_from = None
+    density_info: Dict[str, Any] = {}
+    if mode != "density":
+        if reused is not None:
+            boxes_xyxy, scores, masks_polys = reused
+        else:
+            model = _get_model(MODEL_NAMES[mode])
+            t = _tick(timings, "model_load", t)
+
+            if work_roi is not None:
+                infer_img, roi_offset, roi_mask = work_roi.apply(img_bgr)
+                t = _tick(timings, "roi", t)
+            else:
+                infer_img = img_bgr
+            r = _infer(model, infer_img, conf, device)
+            t = _tick(timings, "inference", t)
+
+            boxes_xyxy, scores, masks_polys = _collect_detections(r, mode)
+            if work_roi is not None:
+                boxes_xyxy, scores, masks_polys = work_roi.filter_detections(
+                    boxes_xyxy, scores, masks_polys, roi_offset, roi_mask
+                )
+            if motion_gate is not None:
+                motion_gate.update(gate_source or str(input_image.parent), (boxes_xyxy, scores, masks_polys))
+            t = _tick(timings, "masks", t)
+
+        # Multidão densa: o YOLO satura e o desenho por pessoa fica caro -> refaz por densidade
+        if _density_switched(len(boxes_xyxy), frame_size, density_model, density_switch):
+            switched_from, mode = mode, "density"
+
+    if mode == "density":
+        annotated, count, density_info, t = _density_estimate(img_bgr, work_roi, density_model, frame_size, timings, t)
+        if switched_from:
+            density_info["switched_from"] = {"mode": switched_from, "boxes": int(len(boxes_xyxy))}
+        detections = []
+    else:
+        # Desenho
+        annotated, detections = _draw_detections(
+            img_bgr, boxes_xyxy, scores, masks_polys, mode, thickness, show_label, in_place=own_frame
+        )
+        if scaled:
+            _scale_detections(detections, sx, sy)
+        count = len(detections)
+        t = _tick(timings, "draw", t)
 
-    # JSON
     meta = {
         "input": str(input_image),
-        "output_image": str(out_image_path),
+        "output_image": None,
         "mode": mode,
         "confidence_threshold": conf,
         "device": device,
         "count": count,
+        "frame_size": [frame_size[0], frame_size[1]],
         "detections": detections,
+        **density_info,
+    }
+    if scaled:
+        meta["working_size"] = [int(img_bgr.shape[1]), int(img_bgr.shape[0])]
+    if roi is not None:
+        meta["roi"] = {"fingerprint": roi.fingerprint, "bbox": list(roi.bbox((frame_size[1], frame_size[0])))}
+    if gate_info is not None:
+        meta["motion_gate"] = gate_info
+    meta["memory"] = memory
+    result = _write_outputs(
+        input_image, output_dir, annotated, meta, export_csv, renditions, rendition_format, timings, t, codec, peak
+    )
+    result["motion_gate"] = gate_info
+    return result
+
+
+def _density_switched(
+    boxes: int, frame_size: Tuple[int, int], density_model: Optional[str], density_switch: Optional[float]
+) -> bool:
+    """
+    True quando a detecção passou de `density_switch` pessoas por megapixel
+    (do frame original) e há modelo de densidade configurado.
+    """
+    if not density_switch:
+        return False
+    megapixels = frame_size[0] * frame_size[1] / 1e6
+    if boxes / megapixels < density_switch:
+        return False
+    import density
+
+    return bool(density.model_path(density_model))
+
+
+def _density_estimate(
+    img_bgr: np.ndarray,
+    work_roi: Optional[Any],
+    density_model: Optional[str],
+    frame_size: Tuple[int, int],
+    timings: Optional[Dict[str, float]],
+    t: float,
+) -> Tuple[np.ndarray, int, Dict[str, Any], float]:
+    """
+    Contagem por densidade do frame de trabalho: (imagem com heatmap, contagem,
+    density_count/density_grid para o metadata, instante da última etapa).
+    """
+    import density
+
+    estimator = density.get_estimator(density_model)
+    t = _tick(timings, "model_load", t)
+    # Sem recorte: o mapa precisa cobrir o frame inteiro; áreas fora da ROI ficam com densidade ~0
+    dmap = estimator.predict(work_roi.apply(img_bgr, crop=False)[0] if work_roi is not None else img_bgr)
+    t = _tick(timings, "inference", t)
+
+    density_count = float(dmap.sum())
+    density_info = {
+        "density_count": round(density_count, 2),
+        "density_grid": density.density_grid(dmap, (frame_size[1], frame_size[0])),
     }
+    count = int(round(density_count))
+    # Uma única mistura de heatmap no lugar do desenho por pessoa
+    annotated = density.render_heatmap(img_bgr, dmap)
+    _draw_total_count(annotated, count, position="top_left", alpha=0.4, pad=10)
+    t = _tick(timings, "draw", t)
+    return annotated, count, density_info, t
+
+
+def _write_outputs(
+    input_image: Path,
+    output_dir: Path,
+    annotated: np.ndarray,
+    meta: Dict[str, Any],
+    export_csv: bool,
+    renditions: Optional[List[int]],
+    rendition_format: str,
+    timings: Optional[Dict[str, float]],
+    t: float,
+    codec: Optional[Dict[str, Any]] = None,
+    peak: Optional[_PeakRss] = None,
+) -> Dict[str, Any]:
+    """
+    Grava imagem anotada, miniaturas, JSON (`meta`) e CSV; retorna o dicionário
+    de resultado de marcar_pessoas.
+    """
+    # Saídas
+    stem = input_image.stem
+    json_path = output_dir / f"{stem}_marked_meta.json"
+    csv_path = output_dir / f"{stem}_marked_boxes.csv"
+
+    # A imagem anotada é codificada no pool de encode enquanto as miniaturas
+    # são geradas nesta thread, a partir do mesmo frame em memória
+    pending = _encode_pool().submit(_encode_output, annotated, input_image.suffix.lower(), codec or output_codec())
+    renditions_out = _write_renditions(annotated, output_dir, stem, renditions or [], rendition_format)
+    out_bytes, ext, out_mime = pending.result()
+    t = _tick(timings, "encode", t)
+    out_image_path = output_dir / f"{stem}_marked{ext}"
+    out_image_path.write_bytes(out_bytes)
+
+    # JSON
+    meta["output_image"] = str(out_image_path)
+    if peak is not None and "memory" in meta:
+        # pico medido depois da codificação, a última etapa que aloca frames
+        meta["memory"]["peak_rss_mb"] = peak.peak_mb()
     with open(json_path, "w", encoding="utf-8") as f:
         json.dump(meta, f, ensure_ascii=False, indent=2)
 
-    # CSV (opcional)
-    if export_csv:
+    # CSV (opcional; no modo density não há caixas)
+    detections = meta["detections"]
+    if export_csv and meta["mode"] != "density":
         with open(csv_path, "w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             header = ["id", "score", "x1", "y1", "x2", "y2"]
@@ -345,14 +1079,173 @@ def marcar_pessoas(
         csv_out = str(csv_path)
     else:
         csv_out = None
+    _tick(timings, "write", t)
 
-    return {
-        "count": count,
+    result = {
+        "count": meta["count"],
         "output_image": str(out_image_path),
+        "output_mime": out_mime,
+        "output_bytes": len(out_bytes),
         "json_path": str(json_path),
         "csv_path": csv_out,
+        "renditions": renditions_out,
+        "frame_size": meta["frame_size"],
         "detections": detections,
     }
+    for key in ("density_count", "density_grid", "switched_from", "working_size", "memory"):
+        if key in meta:
+            result[key] = meta[key]
+    return result
+
+
+def marcar_pessoas_batch(
+    input_images: List[Path],
+    output_dir: Path,
+    mode: str = "seg",
+    conf: float = 0.25,
+    thickness: int = 3,
+    show_label: bool = True,
+    device: Optional[str] = None,
+    export_csv: bool = True,
+    renditions: Optional[List[int]] = None,
+    rendition_format: str = "jpeg",
+    roi: Optional[Any] = None,
+    batch_size: int = 8,
+    timings: Optional[Dict[str, float]] = None,
+    codec: Optional[Dict[str, Any]] = None,
+    max_pixels: Optional[int] = None,
+    density_model: Optional[str] = None,
+    density_switch: Optional[float] = None,
+):
+    """
+    Processa várias imagens com uma única chamada ao modelo por lote de
+    `batch_size` (seg/bbox). Gera, em ordem, um item por imagem: o mesmo
+    dicionário de marcar_pessoas ou a exceção daquela imagem (falhas não
+    interrompem o lote). No modo density, processa imagem a imagem.
+    `timings` acumula o tempo das etapas somado sobre o lote.
+    `max_pixels`, `density_model` e `density_switch`: como em marcar_pessoas
+    (valem por imagem do lote; a troca para density é decidida imagem a imagem).
+    """
+    mode = mode.lower().strip()
+    if mode == "density":
+        for path in input_images:
+            try:
+                yield marcar_pessoas(
+                    path, output_dir, mode=mode, conf=conf, thickness=thickness, show_label=show_label,
+                    device=device, export_csv=export_csv, renditions=renditions,
+                    rendition_format=rendition_format, timings=timings, density_model=density_model,
+                    roi=roi, codec=codec, max_pixels=max_pixels,
+                )
+            except Exception as exc:
+                yield exc
+        return
+    if mode not in {"seg", "bbox"}:
+        raise ValueError("Parâmetro --mode deve ser 'seg', 'bbox' ou 'density'.")
+    _ensure_dir(output_dir)
+    device = _auto_device_hint(device)
+    batch_size = max(1, int(batch_size))
+
+    for start in range(0, len(input_images), batch_size):
+        chunk = input_images[start:start + batch_size]
+        # Decode e inferência são do lote inteiro: o pico delas entra no de cada imagem
+        rss_start = _rss_mb()
+        chunk_peak = _PeakRss()
+        t = time.perf_counter()
+        decoded: List[Any] = []
+        sizes: List[Tuple[int, int]] = []
+        for path in chunk:
+            try:
+                img, size = _read_image_bounded(path, max_pixels)
+                decoded.append(img)
+                sizes.append(size)
+            except Exception as exc:
+                decoded.append(exc)
+                sizes.append((0, 0))
+        t = _tick(timings, "decode", t)
+
+        def work_roi(i: int):
+            h, w = decoded[i].shape[:2]
+            if roi is None or (w, h) == sizes[i]:
+                return roi
+            return roi.scaled(w / float(sizes[i][0]), h / float(sizes[i][1]))
+
+        ok_idx = [i for i, img in enumerate(decoded) if not isinstance(img, Exception)]
+        results_by_idx: Dict[int, Any] = {}
+        if ok_idx:
+            try:
+                model = _get_model(MODEL_NAMES[mode])
+                t = _tick(timings, "model_load", t)
+                rois = {i: work_roi(i) for i in ok_idx}
+                prepared = [rois[i].apply(decoded[i]) if roi is not None else (decoded[i], None, None) for i in ok_idx]
+                with _infer_lock(model):
+                    outs = model([p[0] for p in prepared], conf=conf, device=device, classes=[0])
+                t = _tick(timings, "inference", t)
+                for i, (infer_img, roi_offset, roi_mask), r in zip(ok_idx, prepared, outs):
+                    boxes_xyxy, scores, masks_polys = _collect_detections(r, mode)
+                    if roi is not None:
+                        boxes_xyxy, scores, masks_polys = rois[i].filter_detections(
+                            boxes_xyxy, scores, masks_polys, roi_offset, roi_mask
+                        )
+                    results_by_idx[i] = (boxes_xyxy, scores, masks_polys)
+                t = _tick(timings, "masks", t)
+            except Exception as exc:
+                for i in ok_idx:
+                    results_by_idx[i] = exc
+        chunk_peak.close()
+
+        for i, path in enumerate(chunk):
+            item = decoded[i] if isinstance(decoded[i], Exception) else results_by_idx.get(i)
+            if isinstance(item, Exception):
+                yield item
+                continue
+            peak = _PeakRss(shared=chunk_peak)
+            try:
+                img_bgr = decoded[i]
+                (w, h), (ww, wh) = sizes[i], (int(img_bgr.shape[1]), int(img_bgr.shape[0]))
+                boxes_xyxy, scores, masks_polys = item
+                t = time.perf_counter()
+                density_info: Dict[str, Any] = {}
+                item_mode = mode
+                if _density_switched(len(boxes_xyxy), (w, h), density_model, density_switch):
+                    item_mode = "density"
+                    annotated, count, density_info, t = _density_estimate(
+                        img_bgr, work_roi(i), density_model, (w, h), timings, t
+                    )
+                    density_info["switched_from"] = {"mode": mode, "boxes": int(len(boxes_xyxy))}
+                    detections = []
+                else:
+                    annotated, detections = _draw_detections(
+                        img_bgr, boxes_xyxy, scores, masks_polys, mode, thickness, show_label, in_place=True
+                    )
+                    if (ww, wh) != (w, h):
+                        _scale_detections(detections, w / float(ww), h / float(wh))
+                    count = len(detections)
+                    t = _tick(timings, "draw", t)
+                meta = {
+                    "input": str(path),
+                    "output_image": None,
+                    "mode": item_mode,
+                    "confidence_threshold": conf,
+                    "device": device,
+                    "count": count,
+                    "frame_size": [w, h],
+                    "detections": detections,
+                    **density_info,
+                }
+                if (ww, wh) != (w, h):
+                    meta["working_size"] = [ww, wh]
+                if roi is not None:
+                    meta["roi"] = {"fingerprint": roi.fingerprint, "bbox": list(roi.bbox((h, w)))}
+                meta["memory"] = {"rss_start_mb": rss_start, "batch_images": len(chunk)}
+                result = _write_outputs(
+                    path, output_dir, annotated, meta, export_csv, renditions, rendition_format, timings, t, codec, peak
+                )
+            except Exception as exc:
+                result = exc
+            finally:
+                peak.close()
+                decoded[i] = None  # libera o frame assim que a imagem termina
+            yield result
 
 
 def _db_connect_from_env():
@@ -361,7 +1254,9 @@ def _db_connect_from_env():
     Requer: DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
     Retorna conexão ou None se não configurado ou sem psycopg2.
     """
-    if psycopg2 is None:
+    try:
+        import psycopg2
+    except ImportError:
         return None
     host = os.getenv("DB_HOST")
     port = os.getenv("DB_PORT", "5432")
@@ -415,18 +1310,303 @@ def _db_ensure_table(conn) -> None:
             END$$;
             """
         )
+        # Contagem em coluna tipada (evita ler/parsear o JSONB em listagens e filtros)
+        cur.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS people_count INTEGER;")
+        # Índice para paginação por cursor (keyset) em (created_at, id)
+        cur.execute("CREATE INDEX IF NOT EXISTS images_created_at_id_idx ON images (created_at DESC, id DESC);")
+        # Origem (câmera/fonte) em coluna tipada
+        cur.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS source TEXT;")
+        # Hash da imagem anotada (ETag) e armazenamento sem compressão para leitura em fatias (substr)
+        cur.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS output_hash TEXT;")
+        cur.execute("ALTER TABLE images ALTER COLUMN output_image SET STORAGE EXTERNAL;")
+        # Content-Type da imagem anotada (NULL em linhas antigas = image/jpeg)
+        cur.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS output_mime TEXT;")
+        # Versões reduzidas da imagem anotada (miniaturas), servidas por GET /images/{id}?size=
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS image_renditions (
+                image_id BIGINT NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+                size INTEGER NOT NULL,
+                mime TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                data BYTEA NOT NULL,
+                PRIMARY KEY (image_id, size)
+            );
+            """
+        )
+        # Cache persistente de resultados por (hash, modo, conf, modelo); output_image só é
+        # preenchido quando difere de images.output_image (referenciada por image_id)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS result_cache (
+                cache_key TEXT PRIMARY KEY,
+                image_hash TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                conf REAL NOT NULL,
+                model TEXT NOT NULL,
+                image_id BIGINT REFERENCES images(id) ON DELETE CASCADE,
+                people_count INTEGER,
+                output_mime TEXT NOT NULL,
+                output_image BYTEA,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        # Agregados por minuto/hora/dia, mantidos incrementalmente a cada inserção
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS count_rollups (
+                granularity TEXT NOT NULL,
+                source TEXT NOT NULL DEFAULT '',
+                bucket_start TIMESTAMPTZ NOT NULL,
+                n BIGINT NOT NULL,
+                total BIGINT NOT NULL,
+                max_count INTEGER NOT NULL,
+                PRIMARY KEY (granularity, source, bucket_start)
+            );
+            """
+        )
+        # Migrações de dados que rodam uma única vez
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        _db_backfill_counts(cur)
+
+
+# Granularidades mantidas em count_rollups -> função de truncamento do timestamp (UTC)
+ROLLUP_GRANULARITIES = {
+    "minute": lambda ts: ts.replace(second=0, microsecond=0),
+    "hour": lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    "day": lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def _db_backfill_counts(cur) -> None:
+    """
+    Migração única (registrada em schema_migrations): linhas gravadas antes das
+    colunas tipadas recebem people_count/source a partir do metadata, e
+    count_rollups é recalculada a partir de images. Roda numa transação com
+    count_rollups travada: inserções concorrentes esperam e somam a sua linha
+    depois, sem contagem dupla nem perdida.
+    """
+    cur.execute("BEGIN;")
+    try:
+        cur.execute(
+            "INSERT INTO schema_migrations (name) VALUES ('count_rollups_backfill') "
+            "ON CONFLICT (name) DO NOTHING RETURNING name;"
+        )
+        if cur.fetchone() is None:
+            cur.execute("COMMIT;")
+            return
+        cur.execute("LOCK TABLE count_rollups IN EXCLUSIVE MODE;")
+        cur.execute(
+            """
+            UPDATE images SET people_count = (metadata->>'count')::numeric::int
+            WHERE people_count IS NULL AND jsonb_typeof(metadata->'count') = 'number';
+            """
+        )
+        cur.execute(
+            """
+            UPDATE images SET source = metadata->>'source'
+            WHERE source IS NULL AND jsonb_typeof(metadata->'source') = 'string';
+            """
+        )
+        cur.execute("DELETE FROM count_rollups;")
+        for granularity in ROLLUP_GRANULARITIES:
+            # Mesmo truncamento em UTC de ROLLUP_GRANULARITIES
+            cur.execute(
+                """
+                INSERT INTO count_rollups (granularity, source, bucket_start, n, total, max_count)
+                SELECT %s, COALESCE(source, ''), date_trunc(%s, created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+                       COUNT(*), SUM(people_count), MAX(people_count)
+                FROM images
+                WHERE people_count IS NOT NULL
+                GROUP BY 2, 3;
+                """,
+                [granularity, granularity],
+            )
+        cur.execute("COMMIT;")
+    except Exception:
+        cur.execute("ROLLBACK;")
+        raise
+
+
+def _db_update_rollups(cur, created_at, source: Optional[str], count: int) -> None:
+    """
+    Soma uma observação (contagem de uma imagem) nos agregados minute/hour/day.
+    """
+    ts = created_at.astimezone(timezone.utc) if created_at.tzinfo else created_at.replace(tzinfo=timezone.utc)
+    for granularity, trunc in ROLLUP_GRANULARITIES.items():
+        cur.execute(
+            """
+            INSERT INTO count_rollups (granularity, source, bucket_start, n, total, max_count)
+            VALUES (%s, %s, %s, 1, %s, %s)
+            ON CONFLICT (granularity, source, bucket_start) DO UPDATE SET
+                n = count_rollups.n + 1,
+                total = count_rollups.total + EXCLUDED.total,
+                max_count = CASE WHEN EXCLUDED.max_count > count_rollups.max_count
+                                 THEN EXCLUDED.max_count ELSE count_rollups.max_count END;
+            """,
+            [granularity, source or "", trunc(ts), count, count],
+        )
 
 
-def _db_store_result(conn, input_path: Path, result: Dict[str, Any]) -> Optional[int]:
+def _db_insert_image(
+    conn,
+    input_filename: str,
+    output_filename: str,
+    metadata: Dict[str, Any],
+    input_bytes: bytes,
+    output_bytes: bytes,
+    img_hash: str,
+    count: int,
+    source: Optional[str] = None,
+    renditions: Optional[List[Tuple[int, str, bytes]]] = None,
+    output_mime: Optional[str] = None,
+) -> Tuple[Optional[int], bool]:
+    """
+    Insere uma imagem processada (deduplicada por hash), suas rendições
+    [(size, mime, bytes), ...] e atualiza os agregados na mesma transação.
+    Retorna (id, inserido); se o hash já existia, inserido=False.
+    """
+    row = dict(
+        input_filename=input_filename,
+        output_filename=output_filename,
+        metadata=metadata,
+        input_bytes=input_bytes,
+        output_bytes=output_bytes,
+        img_hash=img_hash,
+        count=count,
+        source=source,
+        renditions=renditions,
+        output_mime=output_mime,
+    )
+    result = _db_insert_images(conn, [row])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _db_insert_images(conn, rows: List[Dict[str, Any]]) -> List[Any]:
+    """
+    Insere várias imagens numa única transação (um round-trip de BEGIN/COMMIT
+    para o lote). Cada linha tem as chaves dos parâmetros de _db_insert_image.
+    Falhas são isoladas por SAVEPOINT: o item recebe a exceção no lugar de
+    (id, inserido) e os demais seguem.
+    """
+    out: List[Any] = []
+    with conn.cursor() as cur:
+        cur.execute("BEGIN;")
+        try:
+            for row in rows:
+                cur.execute("SAVEPOINT item;")
+                try:
+                    out.append(_db_insert_row(cur, **row))
+                    cur.execute("RELEASE SAVEPOINT item;")
+                except Exception as exc:
+                    cur.execute("ROLLBACK TO SAVEPOINT item;")
+                    out.append(exc)
+            cur.execute("COMMIT;")
+        except Exception:
+            cur.execute("ROLLBACK;")
+            raise
+    return out
+
+
+def _db_insert_row(
+    cur,
+    input_filename: str,
+    output_filename: str,
+    metadata: Dict[str, Any],
+    input_bytes: bytes,
+    output_bytes: bytes,
+    img_hash: str,
+    count: int,
+    source: Optional[str] = None,
+    renditions: Optional[List[Tuple[int, str, bytes]]] = None,
+    output_mime: Optional[str] = None,
+) -> Tuple[Optional[int], bool]:
+    import psycopg2
+    from psycopg2.extras import Json
+
+    cur.execute(
+        """
+        INSERT INTO images (
+            input_filename, output_filename, metadata, input_image, output_image, hash, people_count, source,
+            output_hash, output_mime
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (hash) DO NOTHING
+        RETURNING id, created_at;
+        """,
+        [
+            input_filename,
+            output_filename,
+            Json(metadata),
+            psycopg2.Binary(input_bytes),
+            psycopg2.Binary(output_bytes),
+            img_hash,
+            count,
+            source,
+            hashlib.sha256(output_bytes).hexdigest(),
+            output_mime,
+        ],
+    )
+    row = cur.fetchone()
+    if row and row[0]:
+        for size, mime, data in renditions or []:
+            cur.execute(
+                "INSERT INTO image_renditions (image_id, size, mime, content_hash, data) VALUES (%s, %s, %s, %s, %s);",
+                [row[0], size, mime, hashlib.sha256(data).hexdigest(), psycopg2.Binary(data)],
+            )
+        _db_update_rollups(cur, row[1], source, count)
+        return int(row[0]), True
+    # Caso já exista, retorna id existente
+    cur.execute("SELECT id FROM images WHERE hash = %s LIMIT 1;", [img_hash])
+    row = cur.fetchone()
+    return (int(row[0]) if row else None), False
+
+
+def _read_renditions(result: Dict[str, Any]) -> List[Tuple[int, str, bytes]]:
+    """
+    Lê os arquivos de rendição gerados por marcar_pessoas -> [(size, mime, bytes), ...].
+    """
+    mimes = {ext: mime for ext, mime, _ in RENDITION_FORMATS.values()}
+    out = []
+    for size, path in (result.get("renditions") or {}).items():
+        p = Path(path)
+        out.append((int(size), mimes.get(p.suffix.lower(), "image/jpeg"), p.read_bytes()))
+    return out
+
+
+def _db_store_result(
+    conn, input_path: Path, result: Dict[str, Any], source: Optional[str] = None, frame: Optional[np.ndarray] = None
+) -> Optional[int]:
     """
     Armazena a imagem de entrada, a imagem anotada e o JSON no Postgres.
-    Retorna o id inserido.
+    A entrada gravada (e o hash de deduplicação) são os bytes originais do
+    arquivo; só quando não há arquivo em disco (frame de vídeo ou de câmera)
+    o `frame` é codificado em JPEG. Retorna o id inserido.
     """
     try:
-        with open(input_path, "rb") as f:
-            input_bytes = f.read()
+        if frame is not None and not Path(input_path).is_file():
+            import cv2
+
+            ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            if not ok:
+                raise RuntimeError("falha ao codificar o frame de entrada")
+            input_bytes = buf.tobytes()
+        else:
+            with open(input_path, "rb") as f:
+                input_bytes = f.read()
         with open(result["output_image"], "rb") as f:
             output_bytes = f.read()
+        renditions = _read_renditions(result)
     except Exception as e:
         print(f"Aviso: falha ao ler arquivos de imagem para armazenamento: {e}", file=sys.stderr)
         return None
@@ -434,32 +1614,27 @@ def _db_store_result(conn, input_path: Path, result: Dict[str, Any]) -> Optional
     # Hash para deduplicação
     img_hash = hashlib.sha256(input_bytes).hexdigest()
 
-    with conn.cursor() as cur:
-        cur.execute(
-            sql.SQL(
-                """
-                INSERT INTO images (input_filename, output_filename, metadata, input_image, output_image, hash)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (hash) DO NOTHING
-                RETURNING id;
-                """
-            ),
-            [
-                str(input_path.name),
-                Path(result["output_image"]).name,
-                Json({k: v for k, v in result.items() if k != "detections"}),
-                psycopg2.Binary(input_bytes),
-                psycopg2.Binary(output_bytes),
-                img_hash,
-            ],
-        )
-        row = cur.fetchone()
-        if row and row[0]:
-            return int(row[0])
-        # Caso já exista, retorna id existente
-        cur.execute("SELECT id FROM images WHERE hash = %s LIMIT 1;", [img_hash])
-        row = cur.fetchone()
-        return int(row[0]) if row else None
+    img_id, _ = _db_insert_image(
+        conn,
+        input_filename=str(input_path.name),
+        output_filename=Path(result["output_image"]).name,
+        metadata={k: v for k, v in result.items() if k != "detections"},
+        input_bytes=input_bytes,
+        output_bytes=output_bytes,
+        img_hash=img_hash,
+        count=int(result.get("count", 0)),
+        source=source,
+        renditions=renditions,
+        output_mime=result.get("output_mime"),
+    )
+    return img_id
+
+
+def _load_roi_arg(path: str):
+    try:
+        return load_roi_config(path)
+    except (OSError, ValueError) as exc:
+        raise argparse.ArgumentTypeError(f"ROI inválida: {exc}")
 
 
 def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
@@ -471,7 +1646,26 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
         help="Caminho da imagem (jpg/png) ou de uma pasta contendo imagens.",
     )
     p.add_argument("--output_dir", type=str, default=None, help="Diretório de saída (padrão: pasta do input).")
-    p.add_argument("--mode", type=str, default="seg", choices=["seg", "bbox"], help="Modo de anotação: 'seg' (contorno) ou 'bbox' (caixa).")
+    p.add_argument(
+        "--mode",
+        type=str,
+        default="seg",
+        choices=["seg", "bbox", "density"],
+        help="Modo de anotação: 'seg' (contorno), 'bbox' (caixa) ou 'density' (mapa de densidade, multidões).",
+    )
+    p.add_argument(
+        "--roi-config",
+        type=_load_roi_arg,
+        default={},
+        help='JSON com polígonos include/exclude por fonte (chave = --source, ou "default").',
+    )
+    p.add_argument("--density-model", type=str, default=None, help="Modelo de densidade ONNX (padrão: env DENSITY_MODEL).")
+    p.add_argument(
+        "--density-switch",
+        type=float,
+        default=None,
+        help="Pessoas por megapixel a partir das quais seg/bbox passa automaticamente para o modo density.",
+    )
     p.add_argument("--conf", type=float, default=0.25, help="Confiança mínima para deteção.")
     p.add_argument("--thickness", type=int, default=3, help="Espessura de linhas para desenho.")
     p.add_argument("--label", dest="show_label", action="store_true", help="Exibir rótulos (índice/confiança). (padrão)")
@@ -480,11 +1674,193 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     p.add_argument("--device", type=str, default=None, help='Device: "cpu", "cuda", "cuda:0", etc. (padrão: auto)')
     p.add_argument("--no-csv", dest="export_csv", action="store_false", help="Não exportar CSV com caixas.")
     p.set_defaults(export_csv=True)
+    p.add_argument("--renditions", type=_parse_sizes, default=[], help="Lados maiores (px) das miniaturas a gerar, ex.: 256,1024.")
+    p.add_argument("--rendition-format", type=str, default="jpeg", choices=sorted(RENDITION_FORMATS), help="Formato das miniaturas.")
     # Armazenamento em banco
     p.add_argument("--db-store", dest="db_store", action="store_true", help="Salvar resultados no banco (Postgres) se configurado via env.")
     p.add_argument("--no-db-store", dest="db_store", action="store_false", help="Não salvar no banco.")
     p.set_defaults(db_store=None)
-    return p.parse_args(argv)
+    p.add_argument("--source", type=str, default=None, help="Identificador da câmera/fonte gravado junto ao resultado no DB.")
+    # Ingestão de pastas
+    p.add_argument("--recursive", action="store_true", help="Inclui subpastas quando --input é uma pasta.")
+    p.add_argument("--watch", action="store_true", help="Modo daemon: observa a pasta e processa apenas arquivos novos/alterados.")
+    p.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Manifesto SQLite dos arquivos já processados (padrão: <output_dir>/.manifest.sqlite). "
+        "Sem --watch, faz uma passada incremental única.",
+    )
+    p.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        help="Intervalo (s) entre passadas leves no modo polling (só diretórios cujo mtime mudou).",
+    )
+    p.add_argument(
+        "--rescan-interval",
+        type=float,
+        default=60.0,
+        help="Intervalo (s) entre varreduras completas (tamanho + mtime de cada arquivo; pega reescritas no lugar).",
+    )
+    p.add_argument("--settle-seconds", type=float, default=1.0, help="Idade mínima (s) do arquivo para considerá-lo completo.")
+    p.add_argument(
+        "--heatmap-dir",
+        type=str,
+        default=None,
+        help="Acumula o heatmap de ocupação da fonte (--source) em <dir>/<fonte>.npz; veja heatmap.py render.",
+    )
+    p.add_argument(
+        "--motion-gate",
+        action="store_true",
+        help="Câmera fixa: reaproveita as detecções quando o frame quase não mudou em relação ao último inferido.",
+    )
+    p.add_argument(
+        "--motion-threshold",
+        type=float,
+        default=0.002,
+        help="Fração de pixels alterados (0..1) abaixo da qual o frame é considerado estático.",
+    )
+    p.add_argument("--motion-max-skip", type=int, default=10, help="Máximo de frames seguidos sem inferência (defasagem máxima).")
+    p.add_argument(
+        "--watch-backend",
+        type=str,
+        default="auto",
+        choices=["auto", "inotify", "poll"],
+        help="auto: inotify (pacote watchdog) se disponível, com varredura periódica; poll: só varredura.",
+    )
+    p.add_argument(
+        "--output-format",
+        type=str,
+        default="auto",
+        choices=["auto", "jpeg", "png", "webp"],
+        help="Formato da imagem anotada (auto: PNG para entradas .png, JPEG para as demais).",
+    )
+    p.add_argument("--output-quality", type=int, default=None, help="Qualidade JPEG/WebP (0..100; padrão 95 JPEG, 80 WebP).")
+    p.add_argument("--png-compression", type=int, default=None, help="Nível de compressão PNG (0..9; padrão 1, mais rápido).")
+    p.add_argument(
+        "--output-max-side",
+        type=int,
+        default=None,
+        help="Reduz a imagem anotada para este lado maior (px). Coordenadas no JSON/CSV seguem no frame original.",
+    )
+    p.add_argument(
+        "--notify-url",
+        type=str,
+        default=os.getenv("NOTIFY_URL"),
+        help="Publica cada contagem em <url> (ex.: http://localhost:8000/stream/counts) para os clientes ao vivo.",
+    )
+    p.add_argument(
+        "--decode-workers",
+        type=int,
+        default=int(os.getenv("DECODE_WORKERS", "0")),
+        help="Processos de decodificação (pasta/vídeo); os frames chegam por memória compartilhada. 0 = no próprio processo.",
+    )
+    p.add_argument("--shm-slot-mb", type=int, default=32, help="Tamanho (MB) de cada slot de frame na memória compartilhada.")
+    p.add_argument("--video-stride", type=int, default=1, help="Vídeo: processa 1 a cada N frames.")
+    p.add_argument(
+        "--max-megapixels",
+        type=float,
+        default=float(os.getenv("MAX_WORKING_MEGAPIXELS", "0")),
+        help="Orçamento de memória: imagens maiores são processadas reduzidas a este tamanho (0 = sem limite).",
+    )
+    args = p.parse_args(argv)
+    args.max_pixels = int(args.max_megapixels * 1_000_000) or None
+    if args.decode_workers < 0 or args.shm_slot_mb < 1 or args.video_stride < 1:
+        p.error("--decode-workers deve ser >= 0; --shm-slot-mb e --video-stride, >= 1")
+    try:
+        args.codec = output_codec(args.output_format, args.output_quality, args.png_compression, args.output_max_side)
+    except ValueError as exc:
+        p.error(str(exc))
+    return args
+
+
+def _process_one(
+    img_path: Path,
+    output_dir: Path,
+    args: argparse.Namespace,
+    conn=None,
+    gate=None,
+    heatmaps=None,
+    frame: Optional[np.ndarray] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Processa uma imagem (anotação + DB opcional) e retorna um resumo
+    {"count", "output_image", "db_id"} para o log e o manifesto.
+    `frame`: frame já decodificado (workers de decodificação / vídeo);
+    `extra`: campos acrescentados ao resultado e ao metadata do DB (ex.: frame_index do vídeo).
+    """
+    r = marcar_pessoas(
+        input_image=img_path,
+        output_dir=output_dir,
+        mode=args.mode,
+        conf=args.conf,
+        thickness=args.thickness,
+        show_label=args.show_label,
+        device=args.device,
+        export_csv=args.export_csv,
+        renditions=args.renditions,
+        rendition_format=args.rendition_format,
+        motion_gate=gate,
+        gate_source=args.source,
+        density_model=args.density_model,
+        density_switch=args.density_switch,
+        roi=roi_for(args.roi_config, args.source),
+        codec=args.codec,
+        frame=frame,
+        max_pixels=args.max_pixels,
+    )
+    if extra:
+        r.update(extra)
+    if heatmaps is not None and "density_count" not in r:
+        heatmaps.add(args.source, r["detections"], r["frame_size"])
+    row_id = None
+    if conn is not None:
+        try:
+            row_id = _db_store_result(conn, img_path, r, source=args.source, frame=frame)
+        except Exception as db_e:
+            print(f"Aviso: falha ao salvar no DB: {db_e}", file=sys.stderr)
+    db_id_info = f" | DB id={row_id}" if row_id is not None else ""
+    reused_info = " (reaproveitado)" if (r.get("motion_gate") or {}).get("reused") else ""
+    print(f"OK: {img_path.name} -> {r['count']} pessoa(s){reused_info} | {r['output_image']}{db_id_info}")
+    _notify_count(
+        args.notify_url,
+        {"origin": "cli", "source": args.source, "image_id": row_id, "count": int(r.get("count", 0)),
+         "mode": args.mode, "input": img_path.name},
+    )
+    return {"count": int(r.get("count", 0)), "output_image": r["output_image"], "db_id": row_id}
+
+
+def _notify_count(url: Optional[str], event: Dict[str, Any]) -> None:
+    """
+    Envia um evento de contagem para POST /stream/counts da API. Falhas são
+    ignoradas (timeout curto) para nunca travar o processamento.
+    """
+    if not url:
+        return
+    import urllib.request
+
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(event, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json", "x-api-key": os.getenv("API_KEY", "")},
+        method="POST",
+    )
+    try:
+        urllib.request.urlopen(req, timeout=2).close()
+    except Exception as e:
+        print(f"Aviso: falha ao notificar {url}: {e}", file=sys.stderr)
+
+
+def _print_gate_stats(gate) -> None:
+    if gate is None:
+        return
+    st = gate.stats()
+    print(
+        f"Porta de movimento: {st['skipped']}/{st['frames']} frame(s) reaproveitado(s) "
+        f"(skip ratio {st['skip_ratio']:.1%}), custo médio {st['gate_ms_avg']:.2f} ms/frame"
+    )
 
 
 def main() -> None:
@@ -500,47 +1876,99 @@ def main() -> None:
     if db_store and conn is None:
         print("Aviso: --db-store ativo, mas conexão com DB não disponível. Pulando armazenamento.", file=sys.stderr)
         db_store = False
+    if db_store and conn is not None:
+        # Schema/índices criados uma única vez por execução
+        try:
+            _db_ensure_table(conn)
+        except Exception as db_e:
+            print(f"Aviso: falha ao preparar tabela no DB: {db_e}", file=sys.stderr)
+
+    # Porta de movimento (sequências de câmera fixa): só faz sentido para pastas e vídeos
+    gate = None
+    if args.motion_gate and (input_path.is_dir() or input_path.suffix.lower() in VIDEO_EXTS):
+        from motion_gate import MotionGate
+
+        gate = MotionGate(threshold=args.motion_threshold, max_skip=args.motion_max_skip)
+
+    # Heatmap de ocupação acumulado por fonte (persistido a cada 100 frames e no fim)
+    heatmaps = None
+    if args.heatmap_dir:
+        from heatmap import HeatmapStore
+
+        heatmaps = HeatmapStore(Path(args.heatmap_dir).expanduser().resolve())
+
+    if input_path.is_dir() and (args.watch or args.manifest):
+        from watch_folder import run_watch
 
-    if input_path.is_dir():
-        # Lista imagens de primeiro nível (sem recursão)
-        exts = {".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG"}
-        images = [p for p in sorted(input_path.iterdir()) if p.suffix in exts and p.is_file()]
+        output_dir = output_dir_arg if output_dir_arg else (input_path / "out")
+        _ensure_dir(output_dir)
+        manifest = Path(args.manifest).expanduser().resolve() if args.manifest else output_dir / ".manifest.sqlite"
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        def process(img_path: Path) -> Dict[str, Any]:
+            # Espelha a subpasta de origem na saída para evitar colisão de nomes
+            target = output_dir / img_path.parent.relative_to(input_path)
+            _ensure_dir(target)
+            return _process_one(img_path, target, args, conn if db_store else None, gate, heatmaps)
+
+        if args.decode_workers > 0:
+            print("Aviso: --decode-workers é ignorado no modo --watch/--manifest.", file=sys.stderr)
+        if args.watch:
+            print(f"Observando {input_path} (manifesto: {manifest}). Ctrl+C para sair.")
+        try:
+            counts = run_watch(
+                input_path,
+                process,
+                manifest,
+                recursive=args.recursive,
+                exclude=[output_dir],
+                poll_interval=args.poll_interval,
+                rescan_interval=args.rescan_interval,
+                settle_seconds=args.settle_seconds,
+                backend=args.watch_backend,
+                once=not args.watch,
+                stop_event=stop,
+            )
+        except KeyboardInterrupt:
+            stop.set()
+            return
+        finally:
+            if heatmaps is not None:
+                heatmaps.flush()
+        print("\nResumo do manifesto: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+        _print_gate_stats(gate)
+    elif input_path.is_dir():
+        # Lista imagens da pasta (recursivo com --recursive), ignorando a pasta de saída
+        exts = {".jpg", ".jpeg", ".png"}
+        output_dir = output_dir_arg if output_dir_arg else (input_path / "out")
+        candidates = input_path.rglob("*") if args.recursive else input_path.iterdir()
+        images = sorted(
+            p for p in candidates if p.suffix.lower() in exts and p.is_file() and output_dir not in p.parents
+        )
         if not images:
             print(f"Nenhuma imagem *.jpg/*.jpeg/*.png encontrada em: {input_path}", file=sys.stderr)
             sys.exit(1)
 
         # Define diretório de saída: se não for dado, cria subpasta 'out' dentro do input
-        output_dir = output_dir_arg if output_dir_arg else (input_path / "out")
         _ensure_dir(output_dir)
 
         total_images = 0
         total_people = 0
-        results_summary = []
-        for img_path in images:
+        if args.decode_workers > 0:
+            # Decodificação em processos separados; frames chegam por memória compartilhada
+            from shm_ring import iter_images
+
+            frames = iter_images(images, workers=args.decode_workers, slot_bytes=args.shm_slot_mb << 20)
+        else:
+            frames = ((p, None) for p in images)
+        for img_path, frame in frames:
             try:
-                r = marcar_pessoas(
-                    input_image=img_path,
-                    output_dir=output_dir,
-                    mode=args.mode,
-                    conf=args.conf,
-                    thickness=args.thickness,
-                    show_label=args.show_label,
-                    device=args.device,
-                    export_csv=args.export_csv,
-                )
+                target = output_dir / img_path.parent.relative_to(input_path)
+                _ensure_dir(target)
+                r = _process_one(img_path, target, args, conn if db_store else None, gate, heatmaps, frame=frame)
                 total_images += 1
                 total_people += int(r.get("count", 0))
-                results_summary.append(r)
-                db_id_info = ""
-                if db_store and conn is not None:
-                    try:
-                        _db_ensure_table(conn)
-                        row_id = _db_store_result(conn, img_path, r)
-                        if row_id is not None:
-                            db_id_info = f" | DB id={row_id}"
-                    except Exception as db_e:
-                        print(f"Aviso: falha ao salvar no DB: {db_e}", file=sys.stderr)
-                print(f"OK: {img_path.name} -> {r['count']} pessoa(s) | {r['output_image']}{db_id_info}")
             except Exception as e:
                 print(f"ERRO: {img_path.name} -> {e}", file=sys.stderr)
 
@@ -548,6 +1976,45 @@ def main() -> None:
         print(f"Imagens processadas: {total_images}")
         print(f"Total de pessoas detectadas (soma): {total_people}")
         print(f"Saídas em: {output_dir}")
+        _print_gate_stats(gate)
+        if heatmaps is not None:
+            heatmaps.flush()
+            print(f"Heatmap: {heatmaps.path_for(args.source)}")
+    elif input_path.suffix.lower() in VIDEO_EXTS:
+        from shm_ring import iter_video
+
+        output_dir = output_dir_arg if output_dir_arg else (input_path.parent / "out")
+        _ensure_dir(output_dir)
+        total_frames = 0
+        total_people = 0
+        frames = iter_video(input_path, stride=args.video_stride, use_process=args.decode_workers > 0)
+        for index, frame, pos_ms in frames:
+            # Nome virtual por frame: as saídas ficam <video>_<índice>_marked.*
+            frame_path = input_path.with_name(f"{input_path.stem}_{index:08d}.jpg")
+            try:
+                r = _process_one(
+                    frame_path,
+                    output_dir,
+                    args,
+                    conn if db_store else None,
+                    gate,
+                    heatmaps,
+                    frame=frame,
+                    extra={"video": input_path.name, "frame_index": index, "pos_ms": round(pos_ms, 1)},
+                )
+                total_frames += 1
+                total_people += int(r.get("count", 0))
+            except Exception as e:
+                print(f"ERRO: {frame_path.name} -> {e}", file=sys.stderr)
+
+        print("\nResumo:")
+        print(f"Frames processados: {total_frames}")
+        print(f"Total de pessoas detectadas (soma): {total_people}")
+        print(f"Saídas em: {output_dir}")
+        _print_gate_stats(gate)
+        if heatmaps is not None:
+            heatmaps.flush()
+            print(f"Heatmap: {heatmaps.path_for(args.source)}")
     else:
         output_dir = output_dir_arg
 
@@ -560,18 +2027,29 @@ def main() -> None:
             show_label=args.show_label,
             device=args.device,
             export_csv=args.export_csv,
+            renditions=args.renditions,
+            rendition_format=args.rendition_format,
+            density_model=args.density_model,
+            density_switch=args.density_switch,
+            roi=roi_for(args.roi_config, args.source),
+            codec=args.codec,
+            max_pixels=args.max_pixels,
         )
 
         print(json.dumps({k: v for k, v in result.items() if k != "detections"}, ensure_ascii=False, indent=2))
         print(f"\nPessoas detectadas: {result['count']}")
         print(f"Imagem anotada: {result['output_image']}")
+        if (result.get("memory") or {}).get("peak_rss_mb") is not None:
+            print(f"Pico de memória (RSS): {result['memory']['peak_rss_mb']:.0f} MB")
         print(f"Metadata JSON: {result['json_path']}")
         if result.get("csv_path"):
             print(f"CSV: {result['csv_path']}")
+        if heatmaps is not None and "density_count" not in result:
+            heatmaps.add(args.source, result["detections"], result["frame_size"])
+            heatmaps.flush()
         if db_store and conn is not None:
             try:
-                _db_ensure_table(conn)
-                row_id = _db_store_result(conn, input_path, result)
+                row_id = _db_store_result(conn, input_path, result, source=args.source)
                 if row_id is not None:
                     print(f"Armazenado no DB com id={row_id}")
             except Exception as db_e:
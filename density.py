@@ -0,0 +1,154 @@
+"""
+Estimativa de contagem por mapa de densidade (multidões muito densas).
+
+Usa um modelo de densidade de multidão exportado para ONNX (família CSRNet /
+DM-Count / SASNet: entrada RGB normalizada pela ImageNet, saída 1 x 1 x H' x W'
+cuja soma é o número de pessoas) executado em CPU via `cv2.dnn`, sem torch.
+
+Configuração:
+- DENSITY_MODEL: caminho do .onnx (ou `--density-model` no CLI)
+- DENSITY_MAX_SIDE: lado maior da entrada do modelo (padrão 1024); o mapa é
+  integrado na resolução reduzida, então a contagem não depende do redimensionamento.
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Colunas da grade de densidade gravada no metadata (linhas seguem a proporção do frame)
+GRID_COLS = 32
+
+_IMAGENET_MEAN = (0.485, 0.456, 0.406)
+_IMAGENET_STD = (0.229, 0.224, 0.225)
+
+_ESTIMATORS: Dict[Tuple[str, str], "DensityEstimator"] = {}
+_LOCK = threading.Lock()
+
+
+def model_path(path: Optional[str] = None) -> Optional[str]:
+    return path or os.getenv("DENSITY_MODEL") or None
+
+
+def _fingerprint(path: str) -> str:
+    """
+    Impressão digital do arquivo de pesos (tamanho + mtime): pesos trocados sob
+    o mesmo nome mudam a versão, sem ler o arquivo a cada requisição.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    return hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode("ascii")).hexdigest()[:12]
+
+
+def model_version(path: Optional[str] = None) -> str:
+    """
+    Identificador do modelo de densidade (parte da chave do cache de resultados).
+    """
+    p = model_path(path)
+    return f"density:{Path(p).name}@{_fingerprint(p)}" if p else "density:none"
+
+
+def get_estimator(path: Optional[str] = None) -> "DensityEstimator":
+    """
+    Retorna o estimador do modelo `path` (ou DENSITY_MODEL), carregado uma única vez.
+    """
+    p = model_path(path)
+    if not p:
+        raise RuntimeError("Modo 'density' requer um modelo ONNX: defina DENSITY_MODEL ou use --density-model.")
+    # Chave inclui a impressão digital: pesos trocados no lugar são recarregados
+    key = (p, _fingerprint(p))
+    est = _ESTIMATORS.get(key)
+    if est is not None:
+        return est
+    with _LOCK:
+        est = _ESTIMATORS.get(key)
+        if est is None:
+            est = DensityEstimator(p, max_side=int(os.getenv("DENSITY_MAX_SIDE", "1024")))
+            for old in [k for k in _ESTIMATORS if k[0] == p]:
+                del _ESTIMATORS[old]
+            _ESTIMATORS[key] = est
+    return est
+
+
+def loaded(path: Optional[str] = None) -> bool:
+    p = model_path(path)
+    return bool(p) and any(k[0] == p for k in _ESTIMATORS)
+
+
+class DensityEstimator:
+    def __init__(self, path: str, max_side: int = 1024) -> None:
+        import cv2
+
+        if not Path(path).is_file():
+            raise RuntimeError(f"Modelo de densidade não encontrado: {path}")
+        self.path = path
+        self.max_side = max(64, int(max_side))
+        self._net = cv2.dnn.readNetFromONNX(path)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # cv2.dnn.Net não é thread-safe
+        self._lock = threading.Lock()
+
+    def predict(self, img_bgr: "np.ndarray") -> "np.ndarray":
+        """
+        Retorna o mapa de densidade (float32, resolução do modelo) cuja soma é a contagem.
+        """
+        import cv2
+        import numpy as np
+
+        h, w = img_bgr.shape[:2]
+        scale = min(1.0, self.max_side / float(max(h, w)))
+        # múltiplos de 8 (stride típico desses modelos)
+        nh = max(8, int(round(h * scale / 8)) * 8)
+        nw = max(8, int(round(w * scale / 8)) * 8)
+        blob = cv2.dnn.blobFromImage(img_bgr, 1.0 / 255.0, (nw, nh), swapRB=True, crop=False)
+        blob -= np.array(_IMAGENET_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+        blob /= np.array(_IMAGENET_STD, dtype=np.float32).reshape(1, 3, 1, 1)
+        with self._lock:
+            self._net.setInput(blob)
+            out = self._net.forward()
+        dmap = np.asarray(out, dtype=np.float32).reshape(out.shape[-2], out.shape[-1])
+        return np.maximum(dmap, 0.0)
+
+
+def density_grid(dmap: "np.ndarray", frame_shape, cols: int = GRID_COLS) -> Dict[str, Any]:
+    """
+    Reduz o mapa a uma grade `rows x cols` preservando a soma (pessoas por célula).
+    `cell` é o tamanho de cada célula em pixels do frame original [h, w].
+    """
+    import numpy as np
+
+    fh, fw = frame_shape[:2]
+    mh, mw = dmap.shape
+    cols = max(1, min(cols, mw))
+    rows = max(1, min(mh, int(round(cols * fh / float(fw)))))
+    # soma por bloco com limites inteiros (np.add.reduceat), sem interpolação
+    ys = np.linspace(0, mh, rows + 1).astype(int)[:-1]
+    xs = np.linspace(0, mw, cols + 1).astype(int)[:-1]
+    grid = np.add.reduceat(np.add.reduceat(dmap, ys, axis=0), xs, axis=1)
+    return {
+        "rows": rows,
+        "cols": cols,
+        "cell": [round(fh / rows, 2), round(fw / cols, 2)],
+        "values": np.round(grid, 3).tolist(),
+    }
+
+
+def render_heatmap(img_bgr: "np.ndarray", dmap: "np.ndarray", alpha: float = 0.45) -> "np.ndarray":
+    """
+    Sobrepõe o mapa de densidade ao frame com uma única mistura (sem desenho por pessoa).
+    """
+    import cv2
+    import numpy as np
+
+    h, w = img_bgr.shape[:2]
+    peak = float(dmap.max()) if dmap.size else 0.0
+    norm = (dmap * (255.0 / peak)).astype(np.uint8) if peak > 0 else np.zeros(dmap.shape, np.uint8)
+    color = cv2.applyColorMap(cv2.resize(norm, (w, h), interpolation=cv2.INTER_LINEAR), cv2.COLORMAP_JET)
+    return cv2.addWeighted(color, alpha, img_bgr, 1.0 - alpha, 0)
@@ -0,0 +1,97 @@
+"""
+Distribuição em memória dos eventos de contagem (fan-out para /stream/counts).
+
+- Cada assinante tem uma fila asyncio limitada (`buffer`). Se o cliente não
+  consome a tempo, os eventos mais antigos da fila são descartados e o cliente
+  recebe um aviso `dropped`. Um assinante que descarta além de `max_dropped`
+  é desconectado.
+- `publish` é thread-safe: pode ser chamado de threads de inferência (threadpool)
+  e entrega os eventos no event loop de cada assinante.
+- Os últimos eventos ficam num buffer circular para retomada via Last-Event-ID.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer: int, source: Optional[str]) -> None:
+        self.loop = loop
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=buffer)
+        self.source = source
+        self.dropped = 0  # descartados desde o último aviso enviado
+        self.dropped_total = 0
+        self.closed = False
+
+    def _offer(self, event: Dict[str, Any], max_dropped: int) -> None:
+        # Executa no event loop do assinante
+        if self.closed:
+            return
+        while self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.dropped_total += 1
+        if self.dropped_total > max_dropped:
+            self.closed = True
+        self.queue.put_nowait(event)
+
+
+class CountBroker:
+    def __init__(self, buffer: int = 100, max_dropped: int = 1000, history: int = 256) -> None:
+        self.buffer = max(1, int(buffer))
+        self.max_dropped = max(0, int(max_dropped))
+        self._subs: Set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=max(0, int(history)))
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, source: Optional[str] = None, last_event_id: Optional[int] = None) -> Subscriber:
+        """
+        Registra um assinante (chamar de dentro do event loop). Com
+        `last_event_id`, reenvia os eventos recentes posteriores a ele.
+        """
+        sub = Subscriber(asyncio.get_running_loop(), self.buffer, source)
+        with self._lock:
+            backlog = [e for e in self._recent if last_event_id is not None and e["id"] > last_event_id]
+            self._subs.add(sub)
+        for event in backlog:
+            if source is None or event.get("source") == source:
+                sub._offer(event, self.max_dropped)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        sub.closed = True
+        with self._lock:
+            self._subs.discard(sub)
+            self.dropped += sub.dropped_total
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+    def publish(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Publica um evento de contagem; acrescenta `id` e `ts` (epoch, s) se ausente.
+        """
+        event = dict(event)
+        event["id"] = next(self._ids)
+        event.setdefault("ts", time.time())
+        with self._lock:
+            self._recent.append(event)
+            subs: List[Subscriber] = list(self._subs)
+            self.published += 1
+        for sub in subs:
+            if sub.closed or (sub.source is not None and event.get("source") != sub.source):
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event, self.max_dropped)
+            except RuntimeError:
+                # event loop do assinante já encerrado
+                sub.closed = True
+        return event
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Heatmap de ocupação acumulado ao longo de muitos frames, por câmera/fonte.
+
+- Grade float de tamanho fixo (padrão 90 x 160) por fonte: memória constante,
+  independente do número de frames (100k frames ocupam o mesmo que 1).
+- Caixas entram de forma vetorizada (array de diferenças 2D + cumsum); com
+  `footprint="feet"` só a faixa inferior da caixa (onde a pessoa pisa) conta.
+  Polígonos de máscara são rasterizados na resolução da grade.
+- Persistência incremental em .npz (escrita atômica) e renderização sob demanda
+  como overlay, sem reprocessar as imagens originais: o acúmulo pode ser feito
+  a partir dos *_marked_meta.json já gerados.
+
+Exemplos:
+    python heatmap.py accumulate --meta-dir out --source cam01 --store heatmaps
+    python heatmap.py render --store heatmaps --source cam01 --background frame.jpg --output cam01_heat.png
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+GRID_SHAPE = (90, 160)
+# Fração inferior da caixa usada como pegada no modo "feet"
+FEET_FRACTION = 0.15
+
+_SAFE_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class OccupancyHeatmap:
+    """
+    Grade de ocupação de uma fonte. `grid[r, c]` soma, por frame, quantas
+    pessoas ocupavam a célula; dividido por `frames` dá a ocupação média.
+    """
+
+    def __init__(self, shape: Tuple[int, int] = GRID_SHAPE, footprint: str = "feet") -> None:
+        import numpy as np
+
+        if footprint not in ("feet", "box"):
+            raise ValueError("footprint deve ser 'feet' ou 'box'.")
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.footprint = footprint
+        self.grid = np.zeros(self.shape, dtype=np.float64)
+        self.frames = 0
+        self.frame_size: Optional[Tuple[int, int]] = None  # (w, h) do frame original
+        # (mtime, caminho relativo) do último meta JSON acumulado (modo accumulate)
+        self.watermark: Tuple[float, str] = (0.0, "")
+        self.dirty = 0
+
+    def _scale(self, frame_size: Tuple[int, int]) -> Tuple[float, float]:
+        if self.frame_size is None:
+            self.frame_size = (int(frame_size[0]), int(frame_size[1]))
+        w, h = self.frame_size
+        return self.shape[1] / float(w), self.shape[0] / float(h)
+
+    def add_boxes(self, boxes_xyxy: Any, frame_size: Tuple[int, int]) -> None:
+        """
+        Soma as pegadas das caixas (N x 4, pixels do frame) de um frame.
+        """
+        import numpy as np
+
+        sx, sy = self._scale(frame_size)
+        boxes = np.asarray(boxes_xyxy, dtype=np.float64).reshape(-1, 4)
+        self.frames += 1
+        self.dirty += 1
+        if len(boxes) == 0:
+            return
+        rows, cols = self.shape
+        y0 = boxes[:, 1]
+        if self.footprint == "feet":
+            y0 = boxes[:, 3] - (boxes[:, 3] - boxes[:, 1]) * FEET_FRACTION
+        c0 = np.clip(np.floor(boxes[:, 0] * sx), 0, cols - 1).astype(np.int64)
+        c1 = np.clip(np.ceil(boxes[:, 2] * sx), 1, cols).astype(np.int64)
+        r0 = np.clip(np.floor(y0 * sy), 0, rows - 1).astype(np.int64)
+        r1 = np.clip(np.ceil(boxes[:, 3] * sy), 1, rows).astype(np.int64)
+        c1 = np.maximum(c1, c0 + 1)
+        r1 = np.maximum(r1, r0 + 1)
+        # Array de diferenças: cada caixa custa 4 somas, independente da área
+        diff = np.zeros((rows + 1, cols + 1), dtype=np.float64)
+        np.add.at(diff, (r0, c0), 1.0)
+        np.add.at(diff, (r0, c1), -1.0)
+        np.add.at(diff, (r1, c0), -1.0)
+        np.add.at(diff, (r1, c1), 1.0)
+        self.grid += diff.cumsum(axis=0).cumsum(axis=1)[:rows, :cols]
+
+    def add_polygons(self, polygons: Iterable[List[Any]], frame_size: Tuple[int, int]) -> None:
+        """
+        Soma as máscaras (lista por pessoa de segmentos [[x, y], ...]) de um frame.
+        """
+        import cv2
+        import numpy as np
+
+        sx, sy = self._scale(frame_size)
+        self.frames += 1
+        self.dirty += 1
+        scratch = np.zeros(self.shape, dtype=np.uint8)
+        scale = np.array([sx, sy], dtype=np.float64)
+        for segs in polygons:
+            pts = [np.round(np.asarray(seg, dtype=np.float64) * scale).astype(np.int32) for seg in segs if len(seg) >= 3]
+            if not pts:
+                continue
+            scratch[:] = 0
+            cv2.fillPoly(scratch, pts, 1)
+            self.grid += scratch
+
+    def add_detections(self, detections: List[Dict[str, Any]], frame_size: Tuple[int, int]) -> None:
+        """
+        Entrada no formato de `marcar_pessoas` (detections). Usa os polígonos
+        quando todas as detecções os têm e a pegada é "box"; senão, as caixas.
+        """
+        polys = [d.get("polygons") for d in detections]
+        if self.footprint == "box" and detections and all(polys):
+            self.add_polygons(polys, frame_size)
+        else:
+            self.add_boxes([d["bbox"] for d in detections], frame_size)
+
+    def occupancy(self) -> "np.ndarray":
+        return self.grid / max(1, self.frames)
+
+    def render(self, background: Optional["np.ndarray"] = None, alpha: float = 0.5) -> "np.ndarray":
+        """
+        Imagem BGR do heatmap (colormap), sobreposta a `background` se informado.
+        """
+        import cv2
+        import numpy as np
+
+        occ = self.occupancy()
+        peak = float(occ.max()) if occ.size else 0.0
+        norm = (occ * (255.0 / peak)).astype(np.uint8) if peak > 0 else np.zeros(self.shape, np.uint8)
+        if background is not None:
+            h, w = background.shape[:2]
+        elif self.frame_size is not None:
+            w, h = self.frame_size
+        else:
+            h, w = self.shape
+        color = cv2.applyColorMap(cv2.resize(norm, (w, h), interpolation=cv2.INTER_LINEAR), cv2.COLORMAP_JET)
+        if background is None:
+            return color
+        return cv2.addWeighted(color, alpha, background, 1.0 - alpha, 0)
+
+    def save(self, path: Path) -> None:
+        """
+        Grava em .npz de forma atômica (arquivo temporário + rename).
+        """
+        import numpy as np
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                grid=self.grid,
+                frames=np.array(self.frames),
+                frame_size=np.array(self.frame_size or (0, 0)),
+                watermark=np.array(self.watermark[0]),
+                watermark_path=np.array(self.watermark[1]),
+                footprint=np.array(self.footprint),
+            )
+        os.replace(tmp, path)
+        self.dirty = 0
+
+    @classmethod
+    def load(cls, path: Path, shape: Tuple[int, int] = GRID_SHAPE, footprint: str = "feet") -> "OccupancyHeatmap":
+        import numpy as np
+
+        path = Path(path)
+        if not path.exists():
+            return cls(shape, footprint)
+        with np.load(path) as data:
+            hm = cls(tuple(data["grid"].shape), str(data["footprint"]))
+            hm.grid = data["grid"].astype(np.float64)
+            hm.frames = int(data["frames"])
+            fs = tuple(int(v) for v in data["frame_size"])
+            hm.frame_size = fs if fs != (0, 0) else None
+            # Arquivos antigos só tinham o mtime, comparado com <=: o sentinela mantém esse corte
+            path_mark = str(data["watermark_path"]) if "watermark_path" in data.files else "\U0010ffff"
+            hm.watermark = (float(data["watermark"]), path_mark)
+        return hm
+
+
+class HeatmapStore:
+    """
+    Um heatmap por fonte em `directory/<fonte>.npz`, gravado a cada
+    `flush_every` frames (e em `flush()`).
+    """
+
+    def __init__(self, directory: Path, flush_every: int = 100, footprint: str = "feet") -> None:
+        self.directory = Path(directory)
+        self.flush_every = max(1, int(flush_every))
+        self.footprint = footprint
+        self._maps: Dict[str, OccupancyHeatmap] = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, source: Optional[str]) -> Path:
+        name = _SAFE_RE.sub("_", source or "default").strip("._") or "default"
+        return self.directory / f"{name}.npz"
+
+    def get(self, source: Optional[str]) -> OccupancyHeatmap:
+        key = source or "default"
+        hm = self._maps.get(key)
+        if hm is None:
+            hm = OccupancyHeatmap.load(self.path_for(key), footprint=self.footprint)
+            self._maps[key] = hm
+        return hm
+
+    def add(
+        self,
+        source: Optional[str],
+        detections: List[Dict[str, Any]],
+        frame_size: Tuple[int, int],
+        watermark: Optional[Tuple[float, str]] = None,
+    ) -> None:
+        """
+        Soma um frame. `watermark` avança junto com a grade, então cada .npz
+        gravado tem a marca d'água exatamente dos frames que contém.
+        """
+        with self._lock:
+            hm = self.get(source)
+            hm.add_detections(detections, frame_size)
+            if watermark is not None:
+                hm.watermark = watermark
+            if hm.dirty >= self.flush_every:
+                hm.save(self.path_for(source or "default"))
+
+    def flush(self) -> None:
+        with self._lock:
+            for key, hm in self._maps.items():
+                if hm.dirty:
+                    hm.save(self.path_for(key))
+
+    def render(self, source: Optional[str], background: Optional["np.ndarray"] = None) -> Optional["np.ndarray"]:
+        with self._lock:
+            key = source or "default"
+            hm = self._maps.get(key)
+            if hm is None:
+                if not self.path_for(key).exists():
+                    return None
+                hm = self.get(key)
+            return hm.render(background)
+
+
+def accumulate_meta(store: HeatmapStore, meta_dir: Path, source: Optional[str], frame_size: Optional[Tuple[int, int]]) -> int:
+    """
+    Acumula os *_marked_meta.json de `meta_dir` (recursivo) posteriores à
+    marca d'água da fonte, na ordem (mtime, caminho relativo): arquivos com o
+    mesmo mtime não se perdem, e após um crash a retomada parte do último
+    .npz gravado. Não lê as imagens. Retorna quantos frames entraram.
+    """
+    hm = store.get(source)
+    meta_dir = Path(meta_dir)
+    metas = sorted(
+        (p.stat().st_mtime, p.relative_to(meta_dir).as_posix(), p) for p in meta_dir.rglob("*_marked_meta.json")
+    )
+    added = 0
+    for mtime, rel, path in metas:
+        if (mtime, rel) <= hm.watermark:
+            continue
+        meta = json.loads(path.read_text(encoding="utf-8"))
+        size = tuple(meta.get("frame_size") or frame_size or ())
+        if len(size) != 2:
+            print(f"Aviso: {path.name} sem frame_size; use --frame-size LxA.", file=sys.stderr)
+            continue
+        store.add(source, meta.get("detections") or [], size, watermark=(mtime, rel))
+        added += 1
+    store.flush()
+    return added
+
+
+def _parse_frame_size(value: str) -> Tuple[int, int]:
+    try:
+        w, h = value.lower().split("x")
+        return int(w), int(h)
+    except ValueError:
+        raise argparse.ArgumentTypeError("use o formato LARGURAxALTURA, ex.: 1920x1080")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="Heatmap de ocupação acumulado por câmera.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    acc = sub.add_parser("accumulate", help="Acumula detecções a partir dos *_marked_meta.json.")
+    acc.add_argument("--meta-dir", required=True, help="Pasta com os *_marked_meta.json (busca recursiva).")
+    acc.add_argument("--store", required=True, help="Pasta dos heatmaps (.npz por fonte).")
+    acc.add_argument("--source", default=None, help="Fonte/câmera (padrão: default).")
+    acc.add_argument("--footprint", choices=["feet", "box"], default="feet", help="Pegada: base da caixa ou caixa/máscara inteira.")
+    acc.add_argument("--frame-size", type=_parse_frame_size, default=None, help="Tamanho do frame para metas antigos sem frame_size.")
+
+    ren = sub.add_parser("render", help="Gera a imagem do heatmap.")
+    ren.add_argument("--store", required=True, help="Pasta dos heatmaps (.npz por fonte).")
+    ren.add_argument("--source", default=None, help="Fonte/câmera (padrão: default).")
+    ren.add_argument("--background", default=None, help="Imagem de fundo (ex.: um frame da câmera).")
+    ren.add_argument("--output", required=True, help="Arquivo de saída (.png/.jpg).")
+
+    args = p.parse_args(argv)
+    if args.cmd == "accumulate":
+        store = HeatmapStore(Path(args.store), footprint=args.footprint)
+        n = accumulate_meta(store, Path(args.meta_dir), args.source, args.frame_size)
+        hm = store.get(args.source)
+        print(f"{n} frame(s) acumulado(s); total {hm.frames} em {store.path_for(args.source)}")
+    else:
+        import cv2
+
+        store = HeatmapStore(Path(args.store))
+        background = cv2.imread(args.background) if args.background else None
+        if args.background and background is None:
+            sys.exit(f"Não foi possível ler {args.background}")
+        img = store.render(args.source, background)
+        if img is None:
+            sys.exit(f"Nenhum heatmap para a fonte {args.source or 'default'} em {args.store}")
+        cv2.imwrite(args.output, img)
+        print(f"Heatmap: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
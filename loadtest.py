@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Teste de carga da API: reenvia as imagens de uma pasta local para /process e
+consulta /images, em fases descritas num cenário JSON (loadtest_scenario.json).
+
+- Carga fechada (`concurrency` clientes em laço) ou aberta (chegadas de
+  Poisson a `rate` req/s; a latência conta a partir do instante agendado,
+  então a fila do lado do cliente não esconde a saturação do servidor).
+- `duplicate_ratio`: fração de uploads que repetem bytes já enviados (cache
+  de resultados); os demais recebem um sufixo único depois do fim da imagem,
+  o que muda o hash sem alterar o conteúdo decodificado.
+- `mix`: proporção entre `process` (POST /process), `list` (GET /images) e
+  `image` (GET /images/{id} de um id devolvido antes).
+- Reporta por fase: p50/p90/p95/p99 por operação, throughput, erros por tipo
+  (429/503 do controle de admissão, 4xx, 5xx, conexão), taxa de acerto do
+  cache e RSS do servidor (process_resident_memory_bytes de /metrics).
+- `--serve` sobe a API localmente (uvicorn) com o `server.env` do cenário.
+  Com PEOPLE_MODEL_STUB o modelo é um stub de latência fixa (sem pesos/GPU) e
+  com `"db": "none"` a API roda sem Postgres (só o cache em memória), então o
+  teste roda offline; `"db": "env"` usa o Postgres das variáveis DB_*
+  (ex.: `docker compose up -d db`).
+- Com `slo` no cenário, sai com código 1 se alguma fase o violar.
+
+Exemplos:
+    python loadtest.py --scenario loadtest_scenario.json --images fotos/ --serve --output carga.json
+    python loadtest.py --scenario loadtest_scenario.json --images fotos/ --base-url http://localhost:8000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+OPS = ("process", "list", "image")
+DB_ENV = ("DB_HOST", "DB_PORT", "DB_NAME", "DB_USER", "DB_PASSWORD")
+_RSS_RE = re.compile(r"^process_resident_memory_bytes(?:\{[^}]*\})?\s+(\S+)", re.MULTILINE)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """
+    Percentil com interpolação linear (q em 0..100) sobre valores já ordenados.
+    """
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    v = sorted(values)
+    out: Dict[str, float] = {"n": len(v), "mean": round(sum(v) / len(v), 1) if v else 0.0}
+    for q in (50, 90, 95, 99):
+        out[f"p{q}"] = round(_percentile(v, q), 1)
+    out["max"] = round(v[-1], 1) if v else 0.0
+    return out
+
+
+class _Client:
+    """
+    Conexões HTTP keep-alive, uma por thread (http.client não é thread-safe).
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], timeout: float) -> None:
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if self.https else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(
+        self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        headers = dict(headers or {})
+        if self.api_key:
+            headers["x-api-key"] = self.api_key
+        for attempt in (0, 1):
+            conn = self._conn()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                return resp.status, {k.lower(): v for k, v in resp.getheaders()}, data
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # Conexão keep-alive fechada pelo servidor: uma nova tentativa com conexão nova
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+            except Exception:
+                conn.close()
+                self._local.conn = None
+                raise
+        raise RuntimeError("inalcançável")
+
+
+def _multipart(filename: str, payload: bytes, mime: str) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {mime}\r\n\r\n"
+    ).encode("utf-8")
+    return head + payload + f"\r\n--{boundary}--\r\n".encode("ascii"), f"multipart/form-data; boundary={boundary}"
+
+
+class _Corpus:
+    """
+    Imagens da pasta carregadas em memória + registro dos payloads já enviados.
+    """
+
+    _MIMES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+    def __init__(self, folder: Path, limit: int = 0) -> None:
+        paths = sorted(p for p in folder.rglob("*") if p.is_file() and p.suffix.lower() in IMAGE_EXTS)
+        if limit > 0:
+            paths = paths[:limit]
+        if not paths:
+            raise SystemExit(f"Nenhuma imagem ({', '.join(sorted(IMAGE_EXTS))}) encontrada em: {folder}")
+        self.items = [(p.name, p.read_bytes(), self._MIMES[p.suffix.lower()]) for p in paths]
+        self._sent: List[Tuple[int, int]] = []  # (índice da imagem, nonce)
+        self._nonce = 0
+        self._lock = threading.Lock()
+
+    def pick(self, rng: random.Random, duplicate_ratio: float) -> Tuple[str, bytes, str, bool]:
+        with self._lock:
+            if self._sent and rng.random() < duplicate_ratio:
+                index, nonce = rng.choice(self._sent)
+                duplicate = True
+            else:
+                self._nonce += 1
+                index, nonce = rng.randrange(len(self.items)), self._nonce
+                self._sent.append((index, nonce))
+                duplicate = False
+        name, data, mime = self.items[index]
+        # Bytes após o marcador de fim (EOI/IEND) são ignorados pelos decodificadores
+        return name, data + b"\0loadtest:%d" % nonce, mime, duplicate
+
+
+class _Phase:
+    def __init__(self, spec: Dict[str, Any], request: Dict[str, Any]) -> None:
+        self.name = str(spec.get("name", "fase"))
+        self.duration = float(spec.get("duration", 30))
+        self.concurrency = int(spec.get("concurrency", 0))
+        self.rate = float(spec.get("rate", 0))
+        if (self.concurrency > 0) == (self.rate > 0):
+            raise ValueError(f"fase {self.name!r}: informe exatamente um de 'concurrency' ou 'rate'")
+        self.think_time = float(spec.get("think_time", 0))
+        self.max_outstanding = int(spec.get("max_outstanding", 256))
+        self.duplicate_ratio = float(spec.get("duplicate_ratio", request.get("duplicate_ratio", 0.0)))
+        self.warmup = bool(spec.get("warmup", False))
+        mix = spec.get("mix") or {"process": 1.0}
+        unknown = set(mix) - set(OPS)
+        if unknown:
+            raise ValueError(f"fase {self.name!r}: operações desconhecidas em 'mix': {sorted(unknown)}")
+        self.ops = [op for op in OPS if mix.get(op, 0) > 0]
+        self.weights = [float(mix[op]) for op in self.ops]
+        self.mode = str(spec.get("mode", request.get("mode", "bbox")))
+        self.conf = float(spec.get("conf", request.get("conf", 0.25)))
+        self.sources = int(spec.get("sources", request.get("sources", 1)))
+
+
+class _Recorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latency: Dict[str, List[float]] = {op: [] for op in OPS}
+        self.errors: Dict[str, int] = {}
+        self.cache: Dict[str, int] = {}
+        self.requests = 0
+        self.ok = 0
+        self.bytes_sent = 0
+        self.image_ids: List[str] = []
+        # Operações sorteadas que não puderam rodar como pedido ("image->list": nenhum X-Image-Id ainda)
+        self.fallbacks: Dict[str, int] = {}
+
+    def fallback(self, key: str) -> None:
+        with self._lock:
+            self.fallbacks[key] = self.fallbacks.get(key, 0) + 1
+
+    def record(self, op: str, ms: float, status: int, headers: Dict[str, str], sent: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            if 200 <= status < 300:
+                self.ok += 1
+                self.latency[op].append(ms)
+                if op == "process":
+                    status_key = headers.get("x-cache") or ("duplicate" if headers.get("x-duplicate") == "true" else "miss")
+                    self.cache[status_key] = self.cache.get(status_key, 0) + 1
+                    if headers.get("x-image-id"):
+                        self.image_ids.append(headers["x-image-id"])
+                return
+            if status < 0:
+                kind = "client_overflow"
+            elif status == 0:
+                kind = "conn"
+            else:
+                kind = str(status) if status in (413, 415, 429, 503) else f"{status // 100}xx"
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def random_image_id(self, rng: random.Random) -> Optional[str]:
+        with self._lock:
+            return rng.choice(self.image_ids) if self.image_ids else None
+
+
+class _RssSampler(threading.Thread):
+    """
+    Lê process_resident_memory_bytes de /metrics a cada `interval` segundos.
+    """
+
+    def __init__(self, client: _Client, interval: float) -> None:
+        super().__init__(daemon=True)
+        self.client = client
+        self.interval = interval
+        self.samples: List[float] = []
+        self.stop = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop.is_set():
+            try:
+                status, _, body = self.client.request("GET", "/metrics")
+                match = _RSS_RE.search(body.decode("utf-8", "replace")) if status == 200 else None
+                if match:
+                    self.samples.append(float(match.group(1)) / (1024 * 1024))
+            except Exception:
+                pass
+            self.stop.wait(self.interval)
+
+    def summary(self) -> Dict[str, float]:
+        if not self.samples:
+            return {}
+        return {
+            "start": round(self.samples[0], 1),
+            "end": round(self.samples[-1], 1),
+            "max": round(max(self.samples), 1),
+        }
+
+
+def _run_op(client: _Client, corpus: _Corpus, phase: _Phase, rec: _Recorder, rng: random.Random, t_start: float) -> None:
+    op = rng.choices(phase.ops, phase.weights)[0]
+    if op == "image":
+        image_id = rec.random_image_id(rng)
+        if image_id is None:
+            # Sem ids (API sem DB ou nenhum upload concluído): vira `list`, contado no relatório
+            rec.fallback("image->list")
+            op = "list"
+    sent = 0
+    try:
+        if op == "process":
+            name, payload, mime, _ = corpus.pick(rng, phase.duplicate_ratio)
+            body, ctype = _multipart(name, payload, mime)
+            query = {"mode": phase.mode, "conf": phase.conf, "source": f"cam{rng.randrange(phase.sources):02d}"}
+            sent = len(body)
+            status, headers, _ = client.request("POST", "/process?" + urlencode(query), body, {"Content-Type": ctype})
+        elif op == "image":
+            status, headers, _ = client.request("GET", f"/images/{image_id}")
+        else:
+            status, headers, _ = client.request("GET", "/images?per_page=20")
+    except Exception:
+        status, headers = 0, {}
+    rec.record(op, (time.perf_counter() - t_start) * 1000.0, status, headers, sent)
+
+
+def _run_closed(client: _Client, corpus: _Corpus, phase: _Phase, rec: _Recorder, seed: int) -> None:
+    deadline = time.perf_counter() + phase.duration
+
+    def loop(i: int) -> None:
+        rng = random.Random(seed + i)
+        while time.perf_counter() < deadline:
+            _run_op(client, corpus, phase, rec, rng, time.perf_counter())
+            if phase.think_time:
+                time.sleep(phase.think_time)
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(phase.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def _run_open(client: _Client, corpus: _Corpus, phase: _Phase, rec: _Recorder, seed: int) -> None:
+    rng = random.Random(seed)
+    outstanding = threading.Semaphore(phase.max_outstanding)
+    t0 = time.perf_counter()
+    next_at = t0
+    with ThreadPoolExecutor(max_workers=phase.max_outstanding) as pool:
+        while True:
+            next_at += rng.expovariate(phase.rate)
+            if next_at - t0 >= phase.duration:
+                break
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if not outstanding.acquire(blocking=False):
+                # Cliente no limite: a chegada é perdida e contada como erro
+                rec.record("process", 0.0, -1, {}, 0)
+                continue
+
+            def job(scheduled: float = next_at, job_rng: random.Random = random.Random(rng.random())) -> None:
+                try:
+                    _run_op(client, corpus, phase, rec, job_rng, scheduled)
+                finally:
+                    outstanding.release()
+
+            pool.submit(job)
+
+
+def _phase_report(phase: _Phase, rec: _Recorder, elapsed: float, rss: Dict[str, float]) -> Dict[str, Any]:
+    errors = sum(rec.errors.values())
+    hits = sum(v for k, v in rec.cache.items() if k != "miss")
+    processed = sum(rec.cache.values())
+    return {
+        "name": phase.name,
+        "warmup": phase.warmup,
+        "load": {"concurrency": phase.concurrency} if phase.concurrency else {"rate": phase.rate},
+        "duplicate_ratio": phase.duplicate_ratio,
+        "elapsed_s": round(elapsed, 2),
+        "requests": rec.requests,
+        "ok": rec.ok,
+        "throughput_rps": round(rec.ok / elapsed, 2) if elapsed else 0.0,
+        "upload_mbps": round(rec.bytes_sent * 8 / elapsed / 1e6, 2) if elapsed else 0.0,
+        "error_rate": round(errors / rec.requests, 4) if rec.requests else 0.0,
+        "errors": dict(sorted(rec.errors.items())),
+        "cache": {**dict(sorted(rec.cache.items())), "hit_ratio": round(hits / processed, 3) if processed else 0.0},
+        "latency_ms": {op: _summarize(v) for op, v in rec.latency.items() if v},
+        "fallbacks": dict(sorted(rec.fallbacks.items())),
+        "server_rss_mb": rss,
+    }
+
+
+def _print_phase(r: Dict[str, Any]) -> None:
+    lat = r["latency_ms"].get("process") or next(iter(r["latency_ms"].values()), {})
+    rss = r["server_rss_mb"]
+    print(
+        f"{r['name']:<16} {r['throughput_rps']:>8.2f} req/s  erros {r['error_rate']:>6.1%}  "
+        f"p50 {lat.get('p50', 0):>8.1f}  p95 {lat.get('p95', 0):>8.1f}  p99 {lat.get('p99', 0):>8.1f} ms  "
+        f"cache {r['cache']['hit_ratio']:.0%}  RSS máx {rss.get('max', float('nan')):.0f} MB",
+        file=sys.stderr,
+    )
+    for key, n in r["fallbacks"].items():
+        print(f"{'':<16} aviso: {n} operação(ões) {key} (sem X-Image-Id para GET /images/{{id}})", file=sys.stderr)
+
+
+def check_slo(phases: List[Dict[str, Any]], slo: Dict[str, float]) -> List[str]:
+    """
+    Violações do SLO (`p95_ms`, `p99_ms`, `error_rate`, `min_throughput_rps`, `max_rss_mb`)
+    nas fases que não são de aquecimento.
+    """
+    out = []
+    for r in phases:
+        if r["warmup"]:
+            continue
+        lat = r["latency_ms"].get("process", {})
+        checks = [
+            ("p95_ms", lat.get("p95", 0.0), lambda v, lim: v > lim),
+            ("p99_ms", lat.get("p99", 0.0), lambda v, lim: v > lim),
+            ("error_rate", r["error_rate"], lambda v, lim: v > lim),
+            ("min_throughput_rps", r["throughput_rps"], lambda v, lim: v < lim),
+            ("max_rss_mb", r["server_rss_mb"].get("max", 0.0), lambda v, lim: v > lim),
+        ]
+        for key, value, violated in checks:
+            if key in slo and violated(value, float(slo[key])):
+                out.append(f"{r['name']}: {key} = {value} (limite {slo[key]})")
+    return out
+
+
+def _serve(server: Dict[str, Any], port: int) -> subprocess.Popen:
+    """
+    Sobe `uvicorn api:app` em 127.0.0.1:`port` com o ambiente do cenário.
+    """
+    env = dict(os.environ)
+    if server.get("db", "none") == "none":
+        for key in DB_ENV:
+            env.pop(key, None)
+    env.update({k: str(v) for k, v in (server.get("env") or {}).items()})
+    cmd = [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    if int(server.get("workers", 1)) > 1:
+        cmd += ["--workers", str(int(server["workers"]))]
+    return subprocess.Popen(cmd, cwd=str(Path(__file__).resolve().parent), env=env)
+
+
+def _wait_ready(client: _Client, proc: Optional[subprocess.Popen], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"A API encerrou durante a inicialização (código {proc.returncode}).")
+        try:
+            if client.request("GET", "/readyz")[0] == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"A API não ficou pronta em {timeout:.0f} s.")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Teste de carga da API (/process e /images) a partir de uma pasta de imagens.")
+    p.add_argument("--scenario", type=str, required=True, help="Cenário JSON (fases, mix, SLO, ambiente do servidor).")
+    p.add_argument("--images", type=str, required=True, help="Pasta com as imagens a reenviar.")
+    p.add_argument("--limit", type=int, default=0, help="Usa no máximo N imagens da pasta (0 = todas).")
+    p.add_argument("--base-url", type=str, default=None, help="API já em execução (padrão: base_url do cenário).")
+    p.add_argument("--serve", action="store_true", help="Sobe a API localmente (uvicorn) com o server.env do cenário.")
+    p.add_argument("--port", type=int, default=8765, help="Porta da API com --serve.")
+    p.add_argument("--api-key", type=str, default=os.getenv("API_KEY"), help="Enviada em x-api-key (padrão: env API_KEY).")
+    p.add_argument("--timeout", type=float, default=60.0, help="Timeout (s) de cada requisição.")
+    p.add_argument("--rss-interval", type=float, default=1.0, help="Intervalo (s) entre leituras de RSS em /metrics.")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", type=str, default=None, help="Grava o relatório JSON aqui (padrão: stdout).")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    scenario = json.loads(Path(args.scenario).read_text(encoding="utf-8"))
+    request = scenario.get("request") or {}
+    try:
+        phases = [_Phase(spec, request) for spec in scenario.get("phases") or []]
+    except ValueError as exc:
+        raise SystemExit(f"Cenário inválido: {exc}")
+    if not phases:
+        raise SystemExit("Cenário sem fases.")
+    corpus = _Corpus(Path(args.images).expanduser(), args.limit)
+
+    server = scenario.get("server") or {}
+    if args.serve and server.get("db", "none") == "none":
+        # Sem Postgres a API não devolve X-Image-Id: `image` nunca mediria GET /images/{id}
+        with_image = [ph.name for ph in phases if "image" in ph.ops]
+        if with_image:
+            raise SystemExit(
+                f"Cenário inválido: 'image' no mix das fases {with_image} exige \"db\": \"env\" "
+                "(com \"db\": \"none\" não há ids de imagem)."
+            )
+    proc = _serve(server, args.port) if args.serve else None
+    base_url = f"http://127.0.0.1:{args.port}" if args.serve else (args.base_url or scenario.get("base_url", "http://localhost:8000"))
+    client = _Client(base_url, args.api_key, args.timeout)
+    results = []
+    try:
+        _wait_ready(client, proc, float(server.get("ready_timeout", 120)))
+        for i, phase in enumerate(phases):
+            rec = _Recorder()
+            sampler = _RssSampler(_Client(base_url, args.api_key, args.timeout), args.rss_interval)
+            sampler.start()
+            t0 = time.perf_counter()
+            if phase.concurrency:
+                _run_closed(client, corpus, phase, rec, args.seed + 1000 * i)
+            else:
+                _run_open(client, corpus, phase, rec, args.seed + 1000 * i)
+            elapsed = time.perf_counter() - t0
+            sampler.stop.set()
+            sampler.join()
+            results.append(_phase_report(phase, rec, elapsed, sampler.summary()))
+            _print_phase(results[-1])
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "base_url": base_url,
+            "served": bool(args.serve),
+            "server": server if args.serve else None,
+            "images": len(corpus.items),
+            "scenario": str(args.scenario),
+        },
+        "phases": results,
+    }
+    violations = check_slo(results, scenario.get("slo") or {})
+    report["slo_violations"] = violations
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+        print(f"Relatório: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if violations:
+        print("SLO violado:", file=sys.stderr)
+        for line in violations:
+            print(f"  - {line}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,66 @@
+"""
+Cache LRU em memória limitado pelo total de bytes.
+
+Usado pela API para manter imagens anotadas "quentes" sem ir ao Postgres.
+Thread-safe: o FastAPI executa endpoints síncronos em um threadpool.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class ByteLRU:
+    """
+    LRU cujo limite é a soma dos tamanhos (em bytes) dos valores armazenados.
+
+    - `max_bytes`: orçamento total; itens menos usados são descartados ao exceder.
+    - `max_item_bytes`: itens maiores que isso nunca entram (padrão: max_bytes // 4).
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_item_bytes = int(max_item_bytes) if max_item_bytes is not None else self.max_bytes // 4
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> bool:
+        """Insere/atualiza `key`. Retorna False se o item não couber no cache."""
+        if size > self.max_item_bytes or size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes and self._items:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._size -= evicted_size
+        return True
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,148 @@
+"""
+Extração de polígonos das máscaras do YOLO-seg a partir de `r.masks.data`.
+
+`r.masks.xy` do Ultralytics roda findContours na máscara inteira de cada
+pessoa, uma a uma. Aqui, para cada detecção:
+- só o recorte da caixa na máscara de baixa resolução (resolução de entrada
+  do modelo, com letterbox) é binarizado e passado ao findContours
+  (com tensores na GPU, a binarização é feita no device, antes da cópia);
+- fica o maior contorno externo, levado de volta ao frame original pela
+  inversa do letterbox (mesma conta de `scale_coords` do Ultralytics);
+- as detecções são processadas em paralelo num pool de threads
+  (o OpenCV libera o GIL).
+
+A saída segue o formato de `_collect_detections`: por máscara, uma lista de
+segmentos (np.ndarray float32 Nx2, em pixels do frame); lista vazia se não
+houver contorno.
+
+Configuração (env):
+- MASK_CONTOUR_SCALE: fator aplicado ao recorte antes do findContours
+  (padrão 1 = resolução da máscara; 2 = contornos mais suaves; 0.5 = mais grossos)
+- MASK_CONTOUR_EPSILON: tolerância (px da máscara) do approxPolyDP; 0 = sem simplificação
+- MASK_WORKERS: threads do pool (padrão 4); lotes com menos de PARALLEL_MIN
+  detecções são processados na thread atual
+"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Abaixo disso o custo de despachar para o pool supera o ganho
+PARALLEL_MIN = 8
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                workers = max(1, int(os.getenv("MASK_WORKERS", "4")))
+                _POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="masks")
+    return _POOL
+
+
+def letterbox_params(mask_shape: Tuple[int, int], orig_shape: Tuple[int, int]) -> Tuple[float, float, float]:
+    """
+    (gain, pad_x, pad_y) do letterbox que leva o frame `orig_shape` (h, w) à
+    máscara `mask_shape` (h, w): x_mascara = x * gain + pad_x.
+    """
+    mh, mw = mask_shape[:2]
+    oh, ow = orig_shape[:2]
+    gain = min(mh / float(oh), mw / float(ow))
+    pad_x = round((mw - ow * gain) / 2 - 0.1)
+    pad_y = round((mh - oh * gain) / 2 - 0.1)
+    return gain, float(pad_x), float(pad_y)
+
+
+def _host_masks(data) -> Tuple["np.ndarray", bool]:
+    """
+    Máscaras (N, h, w) acessíveis pela CPU -> (array, já binarizado?). Na GPU,
+    binariza no device e copia 1 byte por pixel (4x menos que o float); na CPU
+    não há cópia, e cada detecção binariza só o recorte da sua caixa.
+    """
+    import numpy as np
+
+    if hasattr(data, "cpu"):
+        if getattr(data, "is_cuda", False) or str(getattr(data, "device", "cpu")) != "cpu":
+            return (data > 0.5).cpu().numpy().view(np.uint8), True
+        data = data.numpy()
+    return np.asarray(data), False
+
+
+def _one(
+    mask: "np.ndarray",
+    binarized: bool,
+    box: "np.ndarray",
+    gain: float,
+    pad: Tuple[float, float],
+    scale: float,
+    epsilon: float,
+) -> List["np.ndarray"]:
+    import cv2
+    import numpy as np
+
+    mh, mw = mask.shape
+    x0 = max(int(np.floor(box[0] * gain + pad[0])) - 1, 0)
+    y0 = max(int(np.floor(box[1] * gain + pad[1])) - 1, 0)
+    x1 = min(int(np.ceil(box[2] * gain + pad[0])) + 1, mw)
+    y1 = min(int(np.ceil(box[3] * gain + pad[1])) + 1, mh)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return []
+    crop = mask[y0:y1, x0:x1]
+    crop = np.ascontiguousarray(crop) if binarized else (crop > 0.5).view(np.uint8)
+    if scale != 1.0:
+        size = (max(2, int(round((x1 - x0) * scale))), max(2, int(round((y1 - y0) * scale))))
+        crop = cv2.resize(crop, size, interpolation=cv2.INTER_LINEAR if scale > 1.0 else cv2.INTER_AREA)
+    contours, _ = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+    contour = max(contours, key=cv2.contourArea)
+    if epsilon > 0:
+        contour = cv2.approxPolyDP(contour, epsilon * scale, True)
+    pts = contour.reshape(-1, 2).astype(np.float32)
+    if len(pts) < 3:
+        return []
+    # recorte (escalado) -> máscara -> frame original
+    pts /= np.float32(scale)
+    pts += np.array([x0 - pad[0], y0 - pad[1]], dtype=np.float32)
+    pts /= np.float32(gain)
+    return [pts]
+
+
+def extract_polygons(
+    data: Any,
+    boxes_xyxy: "np.ndarray",
+    orig_shape: Tuple[int, int],
+    scale: Optional[float] = None,
+    epsilon: Optional[float] = None,
+) -> List[List["np.ndarray"]]:
+    """
+    Polígonos (um segmento por máscara) das máscaras `data` (N, h, w; tensor ou
+    np.ndarray, na resolução de entrada do modelo) recortadas pelas caixas
+    `boxes_xyxy` (pixels de `orig_shape`).
+    """
+    if scale is None:
+        scale = float(os.getenv("MASK_CONTOUR_SCALE", "1"))
+    if epsilon is None:
+        epsilon = float(os.getenv("MASK_CONTOUR_EPSILON", "0"))
+    if scale <= 0:
+        raise ValueError("MASK_CONTOUR_SCALE deve ser > 0")
+    n = min(len(boxes_xyxy), len(data))
+    if n == 0:
+        return [[] for _ in range(len(boxes_xyxy))]
+    masks, binarized = _host_masks(data)
+    gain, pad_x, pad_y = letterbox_params(masks.shape[1:], orig_shape)
+    args = [(masks[i], binarized, boxes_xyxy[i], gain, (pad_x, pad_y), scale, epsilon) for i in range(n)]
+    if n < PARALLEL_MIN:
+        polys = [_one(*a) for a in args]
+    else:
+        polys = list(_pool().map(lambda a: _one(*a), args))
+    return polys + [[] for _ in range(len(boxes_xyxy) - n)]
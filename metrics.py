@@ -0,0 +1,214 @@
+"""
+Métricas no formato texto do Prometheus (counters, gauges e histogramas).
+
+Sem dependências externas e sem locks no caminho quente: cada thread escreve
+apenas no seu próprio shard (dict), e a coleta (`render`) soma os shards.
+O único lock é tomado uma vez por thread/métrica, ao criar o shard.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Buckets padrão (segundos) para latências
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _snapshots(self) -> List[dict]:
+        # dict.copy() é atômico sob o GIL; os shards de outras threads podem estar sendo escritos
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [s.copy() for s in shards]
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        totals: Dict[tuple, float] = {}
+        for snap in self._snapshots():
+            for key, value in snap.items():
+                totals[key] = totals.get(key, 0) + value
+        lines = self._header()
+        for key, value in sorted(totals.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Gauge somado entre threads (inc/dec). Com `function`, o valor é lido na coleta.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def dec(self, amount: float = 1, *labelvalues: str) -> None:
+        self.inc(-amount, *labelvalues)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        if self._function is not None:
+            try:
+                lines.append(f"{self.name} {_fmt(self._function())}")
+            except Exception:
+                pass
+            return lines
+        totals: Dict[tuple, float] = {}
+        for snap in self._snapshots():
+            for key, value in snap.items():
+                totals[key] = totals.get(key, 0) + value
+        for key, value in sorted(totals.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        shard = self._shard()
+        state = shard.get(labelvalues)
+        if state is None:
+            # [contagens por bucket (+Inf no fim), soma, total]
+            state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            shard[labelvalues] = state
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labelvalues)
+
+    def render(self) -> List[str]:
+        merged: Dict[tuple, list] = {}
+        for snap in self._snapshots():
+            for key, (counts, total, n) in snap.items():
+                acc = merged.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                for i, c in enumerate(list(counts)):
+                    acc[0][i] += c
+                acc[1] += total
+                acc[2] += n
+        lines = self._header()
+        for key, (counts, total, n) in sorted(merged.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                labels = _format_labels(self.labelnames, key, ("le", _fmt(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_fmt(total)}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+
+def render() -> str:
+    """
+    Exposição de todas as métricas registradas (text/plain; version=0.0.4).
+    """
+    lines: List[str] = []
+    for metric in list(_REGISTRY):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes() -> float:
+    """
+    RSS atual do processo (Linux: /proc/self/statm; outros: pico via getrusage).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return float(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except Exception:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return float(peak if sys.platform == "darwin" else peak * 1024)
+
+
+Gauge("process_resident_memory_bytes", "Resident memory size in bytes.", function=resident_memory_bytes)
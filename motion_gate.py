@@ -0,0 +1,102 @@
+"""
+Porta de movimento para sequências de câmera fixa.
+
+Antes da inferência, o frame é reduzido (tons de cinza, ~160 px de largura) e
+comparado com o último frame que passou pelo modelo na mesma fonte. Se a fração
+de pixels alterados ficar abaixo do limiar, as detecções anteriores são
+reutilizadas. A cada `max_skip` frames reaproveitados a inferência é forçada,
+o que limita a defasagem máxima das contagens.
+
+A comparação é feita contra o último frame inferido (e não apenas o anterior):
+movimentos lentos se acumulam e acabam disparando a inferência.
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Lado maior do frame reduzido usado na comparação
+GATE_SIDE = 160
+# Diferença mínima (0..255) para um pixel contar como alterado
+PIXEL_DELTA = 15
+
+
+class MotionGate:
+    """
+    `threshold`: fração de pixels alterados (0..1) abaixo da qual o frame é
+    considerado estático. `max_skip`: máximo de frames seguidos reaproveitados.
+    """
+
+    def __init__(self, threshold: float = 0.002, max_skip: int = 10) -> None:
+        self.threshold = float(threshold)
+        self.max_skip = max(0, int(max_skip))
+        # fonte -> {"ref": frame reduzido, "skipped": int, "payload": detecções}
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.skipped = 0
+        self.gate_ms = 0.0
+
+    @staticmethod
+    def _small(img_bgr):
+        import cv2
+
+        h, w = img_bgr.shape[:2]
+        scale = GATE_SIDE / float(max(h, w))
+        if scale < 1.0:
+            img_bgr = cv2.resize(img_bgr, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (3, 3), 0)
+
+    def check(self, source: str, img_bgr) -> Tuple[Optional[Any], Dict[str, Any]]:
+        """
+        Retorna (payload, info). `payload` são as detecções reaproveitáveis (ou
+        None se é preciso inferir); `info` descreve a decisão para o metadata.
+        Quando payload é None, chame `update(source, payload)` após a inferência.
+        """
+        import cv2
+
+        t0 = time.perf_counter()
+        small = self._small(img_bgr)
+        with self._lock:
+            self.frames += 1
+            st = self._state.get(source)
+            changed = None
+            reuse = None
+            if st is not None and st["ref"].shape == small.shape and st["payload"] is not None:
+                diff = cv2.absdiff(small, st["ref"])
+                changed = float((diff > PIXEL_DELTA).mean())
+                if changed < self.threshold and st["skipped"] < self.max_skip:
+                    st["skipped"] += 1
+                    self.skipped += 1
+                    reuse = st["payload"]
+            if reuse is None:
+                # próximo update() define o novo frame de referência
+                self._state[source] = {"ref": small, "skipped": 0, "payload": None}
+            elapsed = (time.perf_counter() - t0) * 1000.0
+            self.gate_ms += elapsed
+            age = st["skipped"] if reuse is not None else 0
+        info = {
+            "reused": reuse is not None,
+            "changed_ratio": round(changed, 5) if changed is not None else None,
+            "frames_since_inference": age,
+            "gate_ms": round(elapsed, 3),
+        }
+        return reuse, info
+
+    def update(self, source: str, payload: Any) -> None:
+        with self._lock:
+            st = self._state.get(source)
+            if st is not None:
+                st["payload"] = payload
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            frames, skipped, gate_ms = self.frames, self.skipped, self.gate_ms
+        return {
+            "frames": frames,
+            "skipped": skipped,
+            "skip_ratio": round(skipped / frames, 4) if frames else 0.0,
+            "gate_ms_total": round(gate_ms, 1),
+            "gate_ms_avg": round(gate_ms / frames, 3) if frames else 0.0,
+        }
@@ -0,0 +1,180 @@
+"""
+Profiling sob demanda de chamadas lentas (ex.: marcar_pessoas dentro de /process).
+
+- Ativado por requisição (header, validado pela API) ou por amostragem 1 em N.
+- Captura cProfile (ou pyinstrument, se instalado e PROFILE_ENGINE=pyinstrument)
+  e, se o torch estiver disponível, os tempos por operador do torch.profiler.
+- Os perfis ficam em disco num buffer circular limitado (os mais antigos são apagados).
+"""
+
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_ID_RE = re.compile(r"^[0-9]+-[0-9]+$")
+
+
+class ProfileStore:
+    """
+    Buffer circular de perfis em disco: um diretório por perfil com meta.json
+    e os artefatos (cprofile.prof, cprofile.txt, torch_ops.txt, pyinstrument.html).
+    """
+
+    def __init__(self, directory: Path, max_items: int = 50) -> None:
+        self.directory = Path(directory)
+        self.max_items = max(1, int(max_items))
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def save(self, meta: Dict[str, Any], artifacts: Dict[str, bytes]) -> str:
+        profile_id = f"{int(time.time() * 1000)}-{next(self._seq)}"
+        target = self.directory / profile_id
+        with self._lock:
+            target.mkdir(parents=True, exist_ok=True)
+            for name, data in artifacts.items():
+                (target / name).write_bytes(data)
+            meta = dict(meta, id=profile_id, artifacts=sorted(artifacts))
+            (target / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+            for old in self._ids()[: -self.max_items]:
+                shutil.rmtree(self.directory / old, ignore_errors=True)
+        return profile_id
+
+    def _ids(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        ids = [p.name for p in self.directory.iterdir() if p.is_dir() and _ID_RE.match(p.name)]
+        return sorted(ids, key=lambda i: tuple(int(x) for x in i.split("-")))
+
+    def list(self) -> List[Dict[str, Any]]:
+        out = []
+        for profile_id in reversed(self._ids()):
+            try:
+                out.append(json.loads((self.directory / profile_id / "meta.json").read_text(encoding="utf-8")))
+            except Exception:
+                continue
+        return out
+
+    def artifact_path(self, profile_id: str, name: str) -> Optional[Path]:
+        if not _ID_RE.match(profile_id) or "/" in name or "\\" in name or name.startswith("."):
+            return None
+        path = self.directory / profile_id / name
+        return path if path.is_file() else None
+
+
+class RequestProfiler:
+    """
+    Decide quando perfilar e executa a chamada sob o profiler.
+
+    `sample_every`: perfila 1 a cada N chamadas (0 desativa a amostragem).
+    """
+
+    def __init__(self, store: ProfileStore, sample_every: int = 0, engine: str = "cprofile") -> None:
+        self.store = store
+        self.sample_every = max(0, int(sample_every))
+        self.engine = engine
+        self._calls = itertools.count(1)
+
+    def should_sample(self) -> bool:
+        # itertools.count é atômico no CPython: sem lock no caminho quente
+        n = next(self._calls)
+        return self.sample_every > 0 and n % self.sample_every == 0
+
+    def run(self, fn: Callable[[], Any], meta: Dict[str, Any]) -> Tuple[Any, str]:
+        """
+        Executa `fn()` perfilando; salva o perfil e retorna (resultado, profile_id).
+        O perfil é salvo mesmo se `fn` levantar exceção.
+        """
+        artifacts: Dict[str, bytes] = {}
+        torch_prof = _start_torch_profiler()
+        py_prof, stop_py = _start_python_profiler(self.engine)
+        t0 = time.perf_counter()
+        error: Optional[str] = None
+        try:
+            return_value = fn()
+        except Exception as exc:
+            error = repr(exc)
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+            artifacts.update(stop_py(py_prof))
+            if torch_prof is not None:
+                artifacts.update(_stop_torch_profiler(torch_prof))
+            profile_id = self.store.save(
+                dict(meta, elapsed_ms=round(elapsed_ms, 1), engine=self.engine, error=error, created_at=time.time()),
+                artifacts,
+            )
+        return return_value, profile_id
+
+
+def _start_python_profiler(engine: str):
+    if engine == "pyinstrument":
+        try:
+            from pyinstrument import Profiler  # type: ignore
+
+            prof = Profiler()
+            prof.start()
+
+            def stop(p) -> Dict[str, bytes]:
+                p.stop()
+                return {
+                    "pyinstrument.html": p.output_html().encode("utf-8"),
+                    "pyinstrument.txt": p.output_text(unicode=True).encode("utf-8"),
+                }
+
+            return prof, stop
+        except Exception:
+            pass  # cai para cProfile
+
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # Outro profiler já ativo nesta thread (Python 3.12+): segue sem cProfile
+        return None, lambda _: {}
+
+    def stop(p) -> Dict[str, bytes]:
+        p.disable()
+        with tempfile.NamedTemporaryFile(suffix=".prof", delete=False) as tmp:
+            tmp_path = tmp.name
+        try:
+            p.dump_stats(tmp_path)
+            raw = Path(tmp_path).read_bytes()
+        finally:
+            os.unlink(tmp_path)
+        text = io.StringIO()
+        pstats.Stats(p, stream=text).sort_stats("cumulative").print_stats(60)
+        return {"cprofile.prof": raw, "cprofile.txt": text.getvalue().encode("utf-8")}
+
+    return prof, stop
+
+
+def _start_torch_profiler():
+    try:
+        from torch.profiler import profile, ProfilerActivity  # type: ignore
+    except Exception:
+        return None
+    try:
+        prof = profile(activities=[ProfilerActivity.CPU], record_shapes=False)
+        prof.__enter__()
+        return prof
+    except Exception:
+        return None
+
+
+def _stop_torch_profiler(prof) -> Dict[str, bytes]:
+    try:
+        prof.__exit__(None, None, None)
+        table = prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=40)
+        return {"torch_ops.txt": table.encode("utf-8")}
+    except Exception:
+        return {}
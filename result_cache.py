@@ -0,0 +1,92 @@
+"""
+Cache de resultados de /process indexado por (hash do conteúdo, modo, conf, versão do modelo).
+
+Dois níveis:
+- memória: LRU limitado por bytes (lru.ByteLRU);
+- persistente: tabela `result_cache` no Postgres (criada em _db_ensure_table).
+
+Quando a imagem anotada é a mesma guardada em `images.output_image`, a linha do
+cache apenas referencia `image_id` (sem duplicar o BYTEA).
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+from lru import ByteLRU
+
+# Overhead aproximado por entrada, além dos bytes da imagem
+_ENTRY_OVERHEAD = 256
+
+
+def cache_key(content_hash: str, mode: str, conf: float, model: str) -> str:
+    return f"{content_hash}:{mode}:{conf:.4f}:{model}"
+
+
+class ResultCache:
+    def __init__(self, memory_bytes: int) -> None:
+        self.memory = ByteLRU(max_bytes=memory_bytes)
+
+    def get(self, conn, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """
+        Retorna (entrada, status) com status em "hit-memory", "hit-db" ou "miss".
+        Entrada: {"output": bytes, "mime": str, "count": int, "image_id": Optional[int]}.
+        """
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry, "hit-memory"
+        if conn is None:
+            return None, "miss"
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT rc.people_count, rc.output_mime, COALESCE(rc.output_image, i.output_image), rc.image_id
+                FROM result_cache rc LEFT JOIN images i ON i.id = rc.image_id
+                WHERE rc.cache_key = %s;
+                """,
+                [key],
+            )
+            row = cur.fetchone()
+        if not row or row[2] is None:
+            return None, "miss"
+        entry = {"output": bytes(row[2]), "mime": row[1], "count": row[0], "image_id": row[3]}
+        self.memory.put(key, entry, len(entry["output"]) + _ENTRY_OVERHEAD)
+        return entry, "hit-db"
+
+    def put(
+        self,
+        conn,
+        key: str,
+        entry: Dict[str, Any],
+        content_hash: str,
+        mode: str,
+        conf: float,
+        model: str,
+        output_in_images: bool,
+    ) -> None:
+        """
+        Guarda a entrada nos dois níveis. `output_in_images=True` indica que a
+        imagem anotada já está em images.output_image (image_id) e não é copiada.
+        """
+        self.memory.put(key, entry, len(entry["output"]) + _ENTRY_OVERHEAD)
+        if conn is None:
+            return
+        import psycopg2
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO result_cache (cache_key, image_hash, mode, conf, model, image_id, people_count, output_mime, output_image)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (cache_key) DO NOTHING;
+                """,
+                [
+                    key,
+                    content_hash,
+                    mode,
+                    conf,
+                    model,
+                    entry.get("image_id"),
+                    entry.get("count"),
+                    entry["mime"],
+                    None if output_in_images else psycopg2.Binary(entry["output"]),
+                ],
+            )
@@ -0,0 +1,187 @@
+"""
+Regiões de interesse (ROI) por fonte/câmera.
+
+Cada fonte pode definir polígonos `include` (onde pessoas contam) e `exclude`
+(céu, paredes, pistas...). Antes da inferência o frame é recortado ao
+retângulo envolvente das regiões incluídas e as áreas fora da ROI são pintadas
+de cinza; depois, as coordenadas voltam ao frame completo e detecções com
+centroide fora da ROI são descartadas.
+
+Configuração (JSON), chaveada por `source` com fallback em "default":
+    {
+      "cam01": {"include": [[[0, 300], [1920, 300], [1920, 1080], [0, 1080]]],
+                "exclude": [[[800, 300], [1100, 300], [1100, 600], [800, 600]]]},
+      "default": {"include": [[[0.0, 0.2], [1.0, 0.2], [1.0, 1.0], [0.0, 1.0]]]}
+    }
+Coordenadas em pixels do frame completo, ou normalizadas (0..1) quando todos
+os valores de um polígono são <= 1.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Cor usada nas áreas mascaradas (a mesma do letterbox do YOLO)
+FILL_VALUE = 114
+
+
+def _polygons(value: Any, name: str) -> List[List[List[float]]]:
+    """
+    Valida uma lista de polígonos [[[x, y], ...], ...] (ValueError com mensagem clara).
+    """
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f"'{name}' da ROI deve ser uma lista de polígonos [[[x, y], ...], ...].")
+    polys = []
+    for poly in value:
+        if not isinstance(poly, (list, tuple)) or len(poly) < 3:
+            raise ValueError("Polígonos de ROI precisam de pelo menos 3 pontos.")
+        pts = []
+        for pt in poly:
+            if (
+                not isinstance(pt, (list, tuple))
+                or len(pt) != 2
+                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in pt)
+            ):
+                raise ValueError("Pontos de ROI devem ser pares [x, y] numéricos.")
+            pts.append(list(pt))
+        polys.append(pts)
+    return polys
+
+
+class RegionOfInterest:
+    def __init__(self, include: Optional[List[Any]] = None, exclude: Optional[List[Any]] = None) -> None:
+        self.include = _polygons(include, "include")
+        self.exclude = _polygons(exclude, "exclude")
+        spec = json.dumps({"include": self.include, "exclude": self.exclude}, sort_keys=True)
+        self.fingerprint = hashlib.sha1(spec.encode("utf-8")).hexdigest()[:12]
+
+    @staticmethod
+    def _to_pixels(poly: List[List[float]], shape) -> "np.ndarray":
+        import numpy as np
+
+        arr = np.asarray(poly, dtype=np.float32)
+        if float(arr.max()) <= 1.0:
+            h, w = shape[:2]
+            arr = arr * np.array([w, h], dtype=np.float32)
+        return np.round(arr).astype(np.int32)
+
+    def scaled(self, fx: float, fy: float) -> "RegionOfInterest":
+        """
+        A mesma ROI para um frame redimensionado por (fx, fy); polígonos normalizados não mudam.
+        """
+
+        def scale(poly: List[List[float]]) -> List[List[float]]:
+            if max(max(pt) for pt in poly) <= 1.0:
+                return poly
+            return [[x * fx, y * fy] for x, y in poly]
+
+        return RegionOfInterest([scale(p) for p in self.include], [scale(p) for p in self.exclude])
+
+    def bbox(self, shape) -> Tuple[int, int, int, int]:
+        """
+        Retângulo (x0, y0, x1, y1) que envolve as regiões incluídas, limitado ao frame.
+        """
+        h, w = shape[:2]
+        if not self.include:
+            return 0, 0, w, h
+        import numpy as np
+
+        pts = np.concatenate([self._to_pixels(p, shape) for p in self.include])
+        x0, y0 = np.maximum(pts.min(axis=0), 0)
+        x1, y1 = np.minimum(pts.max(axis=0) + 1, [w, h])
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("ROI fora do frame.")
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def apply(self, img_bgr: "np.ndarray", crop: bool = True) -> Tuple["np.ndarray", Tuple[int, int], "np.ndarray"]:
+        """
+        Retorna (imagem para inferência, deslocamento (ox, oy), máscara uint8 da ROI
+        na mesma resolução da imagem retornada). Com `crop=False` só mascara.
+        """
+        import cv2
+        import numpy as np
+
+        x0, y0, x1, y1 = self.bbox(img_bgr.shape) if crop else (0, 0, img_bgr.shape[1], img_bgr.shape[0])
+        view = img_bgr[y0:y1, x0:x1]
+        offset = np.array([x0, y0], dtype=np.int32)
+        if self.include:
+            mask = np.zeros(view.shape[:2], dtype=np.uint8)
+            cv2.fillPoly(mask, [self._to_pixels(p, img_bgr.shape) - offset for p in self.include], 255)
+        else:
+            mask = np.full(view.shape[:2], 255, dtype=np.uint8)
+        if self.exclude:
+            cv2.fillPoly(mask, [self._to_pixels(p, img_bgr.shape) - offset for p in self.exclude], 0)
+        out = view.copy()
+        out[mask == 0] = FILL_VALUE
+        return out, (x0, y0), mask
+
+    @staticmethod
+    def filter_detections(
+        boxes_xyxy: "np.ndarray",
+        scores: List[float],
+        masks_polys: List[List["np.ndarray"]],
+        offset: Tuple[int, int],
+        mask: "np.ndarray",
+    ) -> Tuple["np.ndarray", List[float], List[List["np.ndarray"]]]:
+        """
+        Leva caixas/polígonos de volta ao frame completo e mantém só as detecções
+        cujo centroide (no recorte) cai dentro da máscara da ROI.
+        """
+        import numpy as np
+
+        boxes = np.asarray(boxes_xyxy, dtype=np.float32).reshape(-1, 4)
+        if len(boxes) == 0:
+            return boxes, list(scores), list(masks_polys)
+        h, w = mask.shape[:2]
+        cx = np.clip(((boxes[:, 0] + boxes[:, 2]) / 2).astype(int), 0, w - 1)
+        cy = np.clip(((boxes[:, 1] + boxes[:, 3]) / 2).astype(int), 0, h - 1)
+        keep = np.nonzero(mask[cy, cx])[0]
+
+        ox, oy = offset
+        shift = np.array([ox, oy, ox, oy], dtype=np.float32)
+        out_boxes = boxes[keep] + shift
+        out_scores = [scores[i] for i in keep if i < len(scores)]
+        out_polys = [
+            [np.asarray(seg, dtype=np.float32) + np.array([ox, oy], dtype=np.float32) for seg in masks_polys[i]]
+            if i < len(masks_polys)
+            else []
+            for i in keep
+        ]
+        return out_boxes, out_scores, out_polys
+
+
+def load_roi_config(path: Optional[str]) -> Dict[str, RegionOfInterest]:
+    """
+    Lê o JSON de ROIs (ver docstring do módulo). Caminho vazio/None -> {}.
+    """
+    if not path:
+        return {}
+    raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(raw, dict):
+        raise ValueError("Configuração de ROI deve ser um objeto {fonte: {include, exclude}}.")
+    config: Dict[str, RegionOfInterest] = {}
+    for key, entry in raw.items():
+        if not isinstance(entry, dict):
+            raise ValueError(f"ROI '{key}': esperado um objeto {{include, exclude}}, recebido {type(entry).__name__}.")
+        unknown = sorted(set(entry) - {"include", "exclude"})
+        if unknown:
+            raise ValueError(f"ROI '{key}': campos desconhecidos {unknown}.")
+        try:
+            config[str(key)] = RegionOfInterest(entry.get("include"), entry.get("exclude"))
+        except ValueError as exc:
+            raise ValueError(f"ROI '{key}': {exc}") from None
+    return config
+
+
+def roi_for(config: Dict[str, RegionOfInterest], source: Optional[str]) -> Optional[RegionOfInterest]:
+    if not config:
+        return None
+    if source and source in config:
+        return config[source]
+    return config.get("default")
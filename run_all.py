@@ -44,7 +44,8 @@ def main() -> int:
     api_proc = subprocess.Popen(api_cmd, env=env)
 
     # 2) Aguarda API subir
-    ok = wait_for_api("http://127.0.0.1:8000/docs", timeout_seconds=90)
+    # /healthz responde assim que o servidor sobe; o modelo é aquecido em segundo plano (/readyz)
+    ok = wait_for_api("http://127.0.0.1:8000/healthz", timeout_seconds=90)
     if not ok:
         try:
             api_proc.terminate()
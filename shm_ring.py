@@ -0,0 +1,270 @@
+"""
+Transporte de frames em memória compartilhada entre processos de decodificação
+e o processo que hospeda o modelo.
+
+Os frames decodificados são escritos direto em slots de um segmento
+`multiprocessing.shared_memory`; pelas filas só passam o índice do slot, o
+shape e metadados. O consumidor recebe uma view numpy sobre o slot (sem cópia
+nem pickling do buffer) e o slot volta para o produtor quando o consumidor
+pede o próximo frame.
+
+- iter_images(paths, workers): decodifica imagens em `workers` processos;
+  entrega na ordem de `paths`. No máximo `slots` tarefas ficam pendentes, então
+  a memória é limitada e não há deadlock na reordenação.
+- iter_video(path, stride): um processo lê o vídeo com VideoCapture.read()
+  escrevendo no slot (sem cópia quando o shape bate).
+
+As views entregues só valem até a próxima iteração; quem precisar guardar o
+frame deve copiá-lo.
+"""
+
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Tamanho padrão do slot: um frame BGR de ~10 MP
+DEFAULT_SLOT_BYTES = 32 * 1024 * 1024
+
+
+class FrameRing:
+    """
+    `slots` slots de `slot_bytes` bytes num único segmento de memória compartilhada.
+    Criado pelo consumidor (`name=None`); os produtores se conectam com `attach`.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int, name: Optional[str] = None) -> None:
+        self.slots = int(slots)
+        self.slot_bytes = int(slot_bytes)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        else:
+            try:
+                # Python >= 3.13: quem só se conecta não deve registrar o segmento no resource tracker
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Workers criados por este módulo compartilham o resource tracker do
+                # processo dono; o registro repetido é inócuo e o unlink fica com o dono
+                self.shm = shared_memory.SharedMemory(name=name)
+
+    @classmethod
+    def attach(cls, spec: Tuple[str, int, int]) -> "FrameRing":
+        name, slots, slot_bytes = spec
+        return cls(slots, slot_bytes, name=name)
+
+    @property
+    def spec(self) -> Tuple[str, int, int]:
+        return self.shm.name, self.slots, self.slot_bytes
+
+    def view(self, slot: int, shape: Tuple[int, ...], dtype: str = "uint8") -> "np.ndarray":
+        import numpy as np
+
+        dt = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dt.itemsize
+        if nbytes > self.slot_bytes:
+            raise ValueError(f"frame de {nbytes} bytes não cabe no slot ({self.slot_bytes} bytes)")
+        return np.ndarray(shape, dtype=dt, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def write(self, slot: int, arr: "np.ndarray") -> Tuple[int, ...]:
+        """
+        Copia `arr` para o slot (quando o decodificador não escreve direto nele); retorna o shape.
+        """
+        dst = self.view(slot, arr.shape, arr.dtype.str)
+        dst[...] = arr
+        return tuple(arr.shape)
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _image_worker(spec: Tuple[str, int, int], tasks, results) -> None:
+    from count_people import _read_image_fix_exif
+
+    ring = FrameRing.attach(spec)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            index, path, slot = task
+            try:
+                shape = ring.write(slot, _read_image_fix_exif(Path(path)))
+                results.put((index, slot, shape, None))
+            except Exception as exc:
+                results.put((index, slot, None, repr(exc)))
+    finally:
+        ring.close()
+
+
+def _video_worker(spec: Tuple[str, int, int], path: str, stride: int, free_slots, results) -> None:
+    import cv2
+    import numpy as np
+
+    ring = FrameRing.attach(spec)
+    cap = cv2.VideoCapture(path)
+    try:
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        index = -1
+        while True:
+            slot = free_slots.get()
+            if slot is None:
+                break
+            # Frames pulados só são demultiplexados (grab), não decodificados
+            grabbed = True
+            for _ in range(stride - 1 if index >= 0 else 0):
+                grabbed = cap.grab()
+                index += 1
+                if not grabbed:
+                    break
+            if not grabbed:
+                break
+            view = ring.view(slot, (h, w, 3))
+            ok, frame = cap.read(view)
+            if not ok or frame is None:
+                break
+            index += 1
+            if not np.shares_memory(frame, view):
+                # Shape inesperado (ex.: stream que muda de resolução): uma cópia
+                ring.write(slot, frame)
+            results.put((index, slot, tuple(frame.shape), cap.get(cv2.CAP_PROP_POS_MSEC)))
+    except Exception as exc:
+        results.put(exc)
+    finally:
+        results.put(None)
+        cap.release()
+        ring.close()
+
+
+def _context():
+    # spawn: os workers não herdam threads do torch/OpenCV do processo principal
+    return mp.get_context("spawn")
+
+
+def iter_images(
+    paths: List[Path],
+    workers: int = 2,
+    slots: Optional[int] = None,
+    slot_bytes: int = DEFAULT_SLOT_BYTES,
+) -> Iterator[Tuple[Path, Optional["np.ndarray"]]]:
+    """
+    Gera (caminho, frame BGR) na ordem de `paths`. Se a decodificação falhar ou
+    o frame não couber no slot, o frame é None (o chamador decodifica localmente
+    e reporta o erro real).
+    """
+    ctx = _context()
+    workers = max(1, int(workers))
+    slots = max(2, int(slots or workers * 2))
+    ring = FrameRing(slots, slot_bytes)
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_image_worker, args=(ring.spec, tasks, results), daemon=True) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    free = list(range(slots))
+    ready = {}
+    sent = 0
+    try:
+        for index, path in enumerate(paths):
+            while free and sent < len(paths):
+                tasks.put((sent, str(paths[sent]), free.pop()))
+                sent += 1
+            while index not in ready:
+                try:
+                    i, slot, shape, error = results.get(timeout=1.0)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in procs):
+                        raise RuntimeError("processos de decodificação encerraram inesperadamente")
+                    continue
+                ready[i] = (slot, shape, error)
+            slot, shape, error = ready.pop(index)
+            try:
+                yield path, (ring.view(slot, shape) if error is None else None)
+            finally:
+                free.append(slot)
+    finally:
+        for _ in procs:
+            tasks.put(None)
+        for p in procs:
+            p.join(5)
+            if p.is_alive():
+                p.terminate()
+        ring.close()
+
+
+def iter_video(
+    path: Path,
+    stride: int = 1,
+    slots: int = 4,
+    use_process: bool = True,
+) -> Iterator[Tuple[int, "np.ndarray", float]]:
+    """
+    Gera (índice do frame, frame BGR, posição em ms) a cada `stride` frames.
+    Com `use_process=False`, lê no próprio processo (sem memória compartilhada).
+    """
+    import cv2
+
+    stride = max(1, int(stride))
+    if not use_process:
+        cap = cv2.VideoCapture(str(path))
+        if not cap.isOpened():
+            raise RuntimeError(f"não foi possível abrir o vídeo {path}")
+        index = -1
+        try:
+            while True:
+                if not cap.grab():
+                    break
+                index += 1
+                if index % stride:
+                    continue
+                ok, frame = cap.retrieve()
+                if ok:
+                    yield index, frame, cap.get(cv2.CAP_PROP_POS_MSEC)
+        finally:
+            cap.release()
+        return
+
+    probe = cv2.VideoCapture(str(path))
+    if not probe.isOpened():
+        raise RuntimeError(f"não foi possível abrir o vídeo {path}")
+    w, h = int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    probe.release()
+
+    ctx = _context()
+    ring = FrameRing(max(2, int(slots)), max(1, w * h * 3))
+    free_slots = ctx.Queue()
+    results = ctx.Queue()
+    for slot in range(ring.slots):
+        free_slots.put(slot)
+    proc = ctx.Process(target=_video_worker, args=(ring.spec, str(path), stride, free_slots, results), daemon=True)
+    proc.start()
+    try:
+        while True:
+            try:
+                item = results.get(timeout=1.0)
+            except queue.Empty:
+                if not proc.is_alive():
+                    raise RuntimeError("processo de decodificação do vídeo encerrou inesperadamente")
+                continue
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            index, slot, shape, pos_ms = item
+            try:
+                yield index, ring.view(slot, shape), pos_ms
+            finally:
+                free_slots.put(slot)
+    finally:
+        free_slots.put(None)
+        proc.join(5)
+        if proc.is_alive():
+            proc.terminate()
+        ring.close()
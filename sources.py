@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Registro de fontes (câmeras) e agendador multi-fonte.
+
+Cada fonte tem id, tipo (`folder` ou `video`), caminho e configurações próprias
+de modo, confiança, ROI, intervalo de amostragem e prioridade. A configuração
+fica num JSON (SOURCES_CONFIG / --config), editável também pela API (/sources):
+
+    {
+      "cam01": {"kind": "video", "path": "rtsp://10.0.0.5/stream1", "mode": "bbox",
+                "conf": 0.3, "interval": 2.0, "priority": 4,
+                "roi": {"include": [[[0, 0.3], [1, 0.3], [1, 1], [0, 1]]]}},
+      "doca":  {"kind": "folder", "path": "/mnt/doca", "recursive": true, "interval": 5}
+    }
+
+- `folder`: ingestão incremental (manifesto de watch_folder), varrida a cada `interval` s.
+- `video`: arquivo ou stream (cv2.VideoCapture); um frame a cada `interval` s
+  (tempo do vídeo para arquivos, relógio para streams `://`). Streams ao vivo
+  descartam o frame mais antigo da fila quando a inferência não acompanha;
+  pastas e arquivos de vídeo esperam (nada é perdido).
+
+O agendador mantém uma fila curta por fonte e um único pool de workers; a
+próxima fonte atendida é escolhida por round-robin ponderado suave (peso =
+`priority`), com no máximo um frame por fonte em processamento, então nenhuma
+câmera monopoliza os workers e a ordem dos frames de cada fonte é preservada.
+
+Uso:
+    python sources.py --config sources.json --output_dir saida --workers 4 --db-store
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from roi import RegionOfInterest
+
+SOURCE_KINDS = ("folder", "video")
+_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class SourceConfig:
+    FIELDS = ("kind", "path", "mode", "conf", "interval", "priority", "roi", "recursive", "enabled", "loop")
+
+    def __init__(
+        self,
+        source_id: str,
+        kind: str,
+        path: str,
+        mode: str = "seg",
+        conf: float = 0.25,
+        interval: float = 1.0,
+        priority: int = 1,
+        roi: Optional[Dict[str, Any]] = None,
+        recursive: bool = False,
+        enabled: bool = True,
+        loop: bool = False,
+    ) -> None:
+        if not _ID_RE.match(str(source_id)):
+            raise ValueError("id da fonte deve ter 1-64 caracteres [A-Za-z0-9_.-].")
+        if kind not in SOURCE_KINDS:
+            raise ValueError(f"kind deve ser um de {SOURCE_KINDS}.")
+        if not path:
+            raise ValueError("path é obrigatório.")
+        if mode not in ("seg", "bbox", "density"):
+            raise ValueError("mode deve ser 'seg', 'bbox' ou 'density'.")
+        if not 0.0 <= float(conf) <= 1.0:
+            raise ValueError("conf deve estar entre 0 e 1.")
+        if float(interval) < 0:
+            raise ValueError("interval não pode ser negativo.")
+        if int(priority) < 1:
+            raise ValueError("priority deve ser >= 1.")
+        if roi is not None and not isinstance(roi, dict):
+            raise ValueError("roi deve ser um objeto {include, exclude}.")
+        if roi and set(roi) - {"include", "exclude"}:
+            raise ValueError(f"Campos desconhecidos em roi: {sorted(set(roi) - {'include', 'exclude'})}")
+        self.id = str(source_id)
+        self.kind = kind
+        self.path = str(path)
+        self.mode = mode
+        self.conf = float(conf)
+        self.interval = float(interval)
+        self.priority = int(priority)
+        self.roi = roi or None
+        self.recursive = bool(recursive)
+        self.enabled = bool(enabled)
+        self.loop = bool(loop)
+        self.roi_region = RegionOfInterest(self.roi.get("include"), self.roi.get("exclude")) if self.roi else None
+
+    @classmethod
+    def from_dict(cls, source_id: str, data: Dict[str, Any]) -> "SourceConfig":
+        if not isinstance(data, dict):
+            raise ValueError("Configuração da fonte deve ser um objeto JSON.")
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Campos desconhecidos: {sorted(unknown)}")
+        return cls(source_id, **data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    @property
+    def live(self) -> bool:
+        return self.kind == "video" and "://" in self.path
+
+    @property
+    def fingerprint(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+class SourceRegistry:
+    """
+    Fontes persistidas num arquivo JSON; alterações (put/delete) regravam o
+    arquivo de forma atômica. Outro processo (ex.: o agendador) enxerga as
+    mudanças via reload_if_changed().
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._sources: Dict[str, SourceConfig] = {}
+        self._mtime: Optional[int] = None
+        self.reload()
+
+    def reload(self) -> None:
+        with self._lock:
+            if not self.path.exists():
+                self._sources, self._mtime = {}, None
+                return
+            mtime = self.path.stat().st_mtime_ns
+            raw = json.loads(self.path.read_text(encoding="utf-8") or "{}")
+            if not isinstance(raw, dict):
+                raise ValueError("Configuração de fontes deve ser um objeto {id: {...}}.")
+            self._sources = {str(k): SourceConfig.from_dict(k, v) for k, v in raw.items()}
+            self._mtime = mtime
+
+    def reload_if_changed(self) -> bool:
+        with self._lock:
+            mtime = self.path.stat().st_mtime_ns if self.path.exists() else None
+            if mtime == self._mtime:
+                return False
+            try:
+                self.reload()
+            except (OSError, ValueError) as exc:
+                # Arquivo inválido (edição manual em andamento): mantém a versão anterior
+                print(f"Aviso: configuração de fontes inválida, ignorada: {exc}", file=sys.stderr)
+                self._mtime = mtime
+                return False
+            return True
+
+    def list(self) -> List[SourceConfig]:
+        with self._lock:
+            return [self._sources[k] for k in sorted(self._sources)]
+
+    def get(self, source_id: str) -> Optional[SourceConfig]:
+        with self._lock:
+            return self._sources.get(source_id)
+
+    def put(self, source_id: str, data: Dict[str, Any]) -> SourceConfig:
+        cfg = SourceConfig.from_dict(source_id, data)
+        with self._lock:
+            self._sources[cfg.id] = cfg
+            self._save()
+        return cfg
+
+    def delete(self, source_id: str) -> bool:
+        with self._lock:
+            if self._sources.pop(source_id, None) is None:
+                return False
+            self._save()
+            return True
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        data = {k: v.to_dict() for k, v in sorted(self._sources.items())}
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._mtime = self.path.stat().st_mtime_ns
+
+
+class _SourceRunner:
+    """
+    Produtor de uma fonte: lê frames/arquivos e os coloca na fila da fonte no agendador.
+    """
+
+    def __init__(self, cfg: SourceConfig, scheduler: "SourceScheduler") -> None:
+        self.cfg = cfg
+        self.scheduler = scheduler
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.busy = False
+        self.current_weight = 0
+        self.stop_event = threading.Event()
+        self.finished = False
+        self.stats: Dict[str, Any] = {
+            "frames": 0, "errors": 0, "dropped": 0, "last_count": None, "last_ts": None, "busy_seconds": 0.0,
+        }
+        self._manifest = None
+        self._manifest_lock = threading.Lock()
+        target = self._run_folder if cfg.kind == "folder" else self._run_video
+        self.thread = threading.Thread(target=self._guard, args=(target,), name=f"source-{cfg.id}", daemon=True)
+
+    def _guard(self, target: Callable[[], None]) -> None:
+        try:
+            target()
+        except Exception as exc:
+            print(f"ERRO: fonte {self.cfg.id}: {exc}", file=sys.stderr)
+        finally:
+            self.finished = True
+
+    # Pastas: manifesto incremental (um por fonte) ---------------------------------
+    def _run_folder(self) -> None:
+        from watch_folder import DEFAULT_EXTS, Manifest, _Scanner
+
+        root = Path(self.cfg.path).expanduser().resolve()
+        manifest = Manifest(self.scheduler.state_dir / f"{self.cfg.id}.sqlite")
+        self._manifest = manifest
+        scanner = _Scanner(root, manifest, self.cfg.recursive, DEFAULT_EXTS, [self.scheduler.output_dir], 1.0)
+        interval = self.cfg.interval or 2.0
+        try:
+            while not self.stop_event.is_set():
+                with self._manifest_lock:
+                    scanner.scan()
+                    pending = manifest.pending(limit=self.scheduler.queue_size)
+                for fpath in pending:
+                    with self._manifest_lock:
+                        manifest.set_status(fpath, "processing")
+                    job = {"source": self.cfg.id, "path": Path(fpath), "frame": None, "ts": time.time()}
+                    if not self.scheduler.put(self, job, block=True):
+                        return
+                if len(pending) < self.scheduler.queue_size:
+                    self.stop_event.wait(interval)
+        finally:
+            with self._manifest_lock:
+                self._manifest = None
+                manifest.close()
+
+    # Vídeo: arquivo ou stream --------------------------------------------------------
+    def _run_video(self) -> None:
+        import cv2
+
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            cap = cv2.VideoCapture(self.cfg.path)
+            if not cap.isOpened():
+                if not self.cfg.live:
+                    raise RuntimeError(f"não foi possível abrir {self.cfg.path}")
+                # Stream fora do ar: tenta de novo com backoff exponencial
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+            backoff = 1.0
+            fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+            step = max(1, int(round(fps * self.cfg.interval))) if fps > 0 and not self.cfg.live else 1
+            index = -1
+            next_wall = 0.0
+            try:
+                while not self.stop_event.is_set():
+                    if not cap.grab():
+                        break
+                    index += 1
+                    if self.cfg.live:
+                        # Streams: amostra pelo relógio; grab() sem decodificar mantém o buffer em dia
+                        now = time.monotonic()
+                        if now < next_wall:
+                            continue
+                        next_wall = now + self.cfg.interval
+                    elif index % step:
+                        continue
+                    ok, frame = cap.retrieve()
+                    if not ok:
+                        continue
+                    job = {
+                        "source": self.cfg.id,
+                        "path": Path(f"{self.cfg.id}_{index:08d}.jpg"),
+                        "frame": frame,
+                        "frame_index": index,
+                        "pos_ms": cap.get(cv2.CAP_PROP_POS_MSEC),
+                        "ts": time.time(),
+                    }
+                    if not self.scheduler.put(self, job, block=not self.cfg.live):
+                        return
+            finally:
+                cap.release()
+            if not self.cfg.live and not self.cfg.loop:
+                return
+
+    def done(self, job: Dict[str, Any], result: Any) -> None:
+        if job.get("frame") is not None:
+            return
+        with self._manifest_lock:
+            if self._manifest is None:
+                return
+            if isinstance(result, Exception):
+                self._manifest.set_status(str(job["path"]), "error", repr(result))
+            else:
+                info = {k: result.get(k) for k in ("count", "output_image", "db_id")}
+                self._manifest.set_status(str(job["path"]), "done", json.dumps(info, ensure_ascii=False, default=str))
+
+
+class SourceScheduler:
+    """
+    Agenda os frames das fontes habilitadas do `registry` num pool de `workers`
+    threads, chamando `process(cfg, job)`. `on_result(cfg, job, resultado ou
+    exceção, segundos)` e `on_drop(cfg)` permitem métricas/eventos por fonte.
+    """
+
+    def __init__(
+        self,
+        registry: SourceRegistry,
+        process: Callable[[SourceConfig, Dict[str, Any]], Dict[str, Any]],
+        output_dir: Path,
+        workers: int = 2,
+        queue_size: int = 4,
+        state_dir: Optional[Path] = None,
+        reload_interval: float = 5.0,
+        on_result: Optional[Callable[[SourceConfig, Dict[str, Any], Any, float], None]] = None,
+        on_drop: Optional[Callable[[SourceConfig], None]] = None,
+    ) -> None:
+        self.registry = registry
+        self.process = process
+        self.output_dir = Path(output_dir).resolve()
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.state_dir = Path(state_dir) if state_dir else self.output_dir / ".sources"
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.reload_interval = reload_interval
+        self.on_result = on_result
+        self.on_drop = on_drop
+        self._runners: Dict[str, _SourceRunner] = {}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self.sync()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"source-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._watch_registry, name="source-registry", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        with self._cond:
+            for runner in self._runners.values():
+                runner.stop_event.set()
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        for runner in list(self._runners.values()):
+            runner.thread.join(timeout)
+
+    def sync(self) -> None:
+        """
+        Alinha os produtores ao registro: inicia fontes novas, para as removidas
+        ou desabilitadas e reinicia as que mudaram de configuração.
+        """
+        wanted = {cfg.id: cfg for cfg in self.registry.list() if cfg.enabled}
+        started = []
+        with self._cond:
+            for sid, runner in list(self._runners.items()):
+                cfg = wanted.get(sid)
+                if cfg is None or cfg.fingerprint != runner.cfg.fingerprint:
+                    runner.stop_event.set()
+                    runner.queue.clear()
+                    del self._runners[sid]
+            for sid, cfg in wanted.items():
+                if sid not in self._runners:
+                    runner = _SourceRunner(cfg, self)
+                    self._runners[sid] = runner
+                    started.append(runner)
+            self._cond.notify_all()
+        for runner in started:
+            runner.thread.start()
+
+    def _watch_registry(self) -> None:
+        while not self._stop.wait(self.reload_interval):
+            if self.registry.reload_if_changed():
+                self.sync()
+
+    def put(self, runner: _SourceRunner, job: Dict[str, Any], block: bool) -> bool:
+        """
+        Enfileira um frame da fonte. Com `block`, espera espaço na fila; sem,
+        descarta o mais antigo. Retorna False se a fonte foi parada.
+        """
+        dropped = False
+        with self._cond:
+            while block and len(runner.queue) >= self.queue_size and not runner.stop_event.is_set():
+                self._cond.wait(0.5)
+            if runner.stop_event.is_set():
+                return False
+            if len(runner.queue) >= self.queue_size:
+                runner.queue.popleft()
+                runner.stats["dropped"] += 1
+                dropped = True
+            runner.queue.append(job)
+            self._cond.notify_all()
+        if dropped and self.on_drop is not None:
+            self.on_drop(runner.cfg)
+        return True
+
+    def _pick(self) -> Optional[_SourceRunner]:
+        # Round-robin ponderado suave (nginx): justo por peso, sem rajadas da mesma fonte
+        eligible = [r for r in self._runners.values() if r.queue and not r.busy]
+        if not eligible:
+            return None
+        total = 0
+        for r in eligible:
+            r.current_weight += r.cfg.priority
+            total += r.cfg.priority
+        best = max(eligible, key=lambda r: r.current_weight)
+        best.current_weight -= total
+        return best
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                runner = self._pick()
+                while runner is None and not self._stop.is_set():
+                    self._cond.wait(0.5)
+                    runner = self._pick()
+                if runner is None:
+                    return
+                job = runner.queue.popleft()
+                runner.busy = True
+                self._cond.notify_all()
+            t0 = time.perf_counter()
+            try:
+                result: Any = self.process(runner.cfg, job)
+            except Exception as exc:
+                result = exc
+                print(f"ERRO: fonte {runner.cfg.id}: {job['path'].name} -> {exc}", file=sys.stderr)
+            elapsed = time.perf_counter() - t0
+            with self._cond:
+                runner.busy = False
+                st = runner.stats
+                st["busy_seconds"] += elapsed
+                if isinstance(result, Exception):
+                    st["errors"] += 1
+                else:
+                    st["frames"] += 1
+                    st["last_count"] = result.get("count")
+                    st["last_ts"] = job["ts"]
+                self._cond.notify_all()
+            runner.done(job, result)
+            if self.on_result is not None:
+                try:
+                    self.on_result(runner.cfg, job, result, elapsed)
+                except Exception as exc:
+                    print(f"Aviso: on_result falhou para {runner.cfg.id}: {exc}", file=sys.stderr)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._cond:
+            out = {}
+            for sid, r in self._runners.items():
+                st = dict(r.stats)
+                processed = st["frames"] + st["errors"]
+                st["avg_ms"] = round(st.pop("busy_seconds") * 1000.0 / processed, 1) if processed else None
+                st.update(queued=len(r.queue), busy=r.busy, running=not r.finished)
+                out[sid] = st
+            return out
+
+
+def make_processor(
+    output_dir: Path,
+    device: Optional[str] = None,
+    codec: Optional[Dict[str, Any]] = None,
+    renditions: Optional[List[int]] = None,
+    rendition_format: str = "jpeg",
+    db_store: bool = False,
+    max_pixels: Optional[int] = None,
+) -> Callable[[SourceConfig, Dict[str, Any]], Dict[str, Any]]:
+    """
+    Processador padrão: marcar_pessoas em <output_dir>/<id da fonte>/ e, com
+    `db_store`, grava no Postgres com `source` = id (uma conexão por worker).
+    """
+    from count_people import (
+        _db_connect_from_env,
+        _db_ensure_table,
+        _db_store_result,
+        marcar_pessoas,
+    )
+
+    local = threading.local()
+    schema_ready = threading.Event()
+
+    def connection():
+        conn = getattr(local, "conn", None)
+        if conn is None or conn.closed:
+            conn = local.conn = _db_connect_from_env()
+            if conn is not None and not schema_ready.is_set():
+                _db_ensure_table(conn)
+                schema_ready.set()
+        return conn
+
+    def process(cfg: SourceConfig, job: Dict[str, Any]) -> Dict[str, Any]:
+        frame = job.get("frame")
+        r = marcar_pessoas(
+            input_image=job["path"],
+            output_dir=Path(output_dir) / cfg.id,
+            mode=cfg.mode,
+            conf=cfg.conf,
+            device=device,
+            export_csv=False,
+            renditions=renditions,
+            rendition_format=rendition_format,
+            roi=cfg.roi_region,
+            codec=codec,
+            frame=frame,
+            max_pixels=max_pixels,
+        )
+        r["source"] = cfg.id
+        r["db_id"] = None
+        conn = connection() if db_store else None
+        if conn is None:
+            return r
+        if frame is not None:
+            r["frame_index"] = job.get("frame_index")
+            r["pos_ms"] = job.get("pos_ms")
+        r["db_id"] = _db_store_result(conn, job["path"], r, source=cfg.id, frame=frame)
+        return r
+
+    return process
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Processa continuamente as fontes (câmeras) registradas.")
+    p.add_argument("--config", type=str, default=os.getenv("SOURCES_CONFIG", "sources.json"), help="JSON com as fontes.")
+    p.add_argument("--output_dir", type=str, required=True, help="Saídas em <dir>/<id da fonte>/.")
+    p.add_argument("--workers", type=int, default=2, help="Workers de inferência compartilhados entre as fontes.")
+    p.add_argument("--queue-size", type=int, default=4, help="Frames em espera por fonte.")
+    p.add_argument("--device", type=str, default=None, help="cpu, cuda:0, mps (padrão: auto).")
+    p.add_argument("--db-store", action="store_true", help="Grava os resultados no Postgres (variáveis DB_*).")
+    p.add_argument("--stats-interval", type=float, default=30.0, help="Imprime estatísticas por fonte a cada N s (0 = nunca).")
+    p.add_argument(
+        "--max-megapixels",
+        type=float,
+        default=float(os.getenv("MAX_WORKING_MEGAPIXELS", "0")),
+        help="Frames maiores são processados reduzidos a este tamanho (0 = sem limite).",
+    )
+    return p.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    registry = SourceRegistry(Path(args.config))
+    if not registry.list():
+        print(f"Aviso: nenhuma fonte em {args.config}; aguardando alterações no arquivo.", file=sys.stderr)
+    output_dir = Path(args.output_dir).expanduser().resolve()
+    scheduler = SourceScheduler(
+        registry,
+        make_processor(
+            output_dir, device=args.device, db_store=args.db_store, max_pixels=int(args.max_megapixels * 1_000_000) or None
+        ),
+        output_dir,
+        workers=args.workers,
+        queue_size=args.queue_size,
+    )
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                for sid, st in sorted(scheduler.stats().items()):
+                    print(
+                        f"{sid}: {st['frames']} frame(s), {st['errors']} erro(s), {st['dropped']} descartado(s), "
+                        f"fila {st['queued']}, média {st['avg_ms']} ms, última contagem {st['last_count']}"
+                    )
+    except KeyboardInterrupt:
+        print("Encerrando...")
+    finally:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,10 @@ def _load_css(file_path: pathlib.Path) -> None:
 
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
 API_KEY = os.getenv("API_KEY")
+# Intervalo (s) em que o histórico do servidor é reaproveitado entre reruns
+HISTORY_TTL = int(os.getenv("UI_HISTORY_TTL", "15"))
+HISTORY_PAGE = 50
+HISTORY_FIELDS = "id,created_at,input_filename,count,title,description"
 
 
 def _auth_headers() -> dict:
@@ -26,6 +30,109 @@ def _auth_headers() -> dict:
         h["x-api-key"] = API_KEY
     return h
 
+
+@st.cache_resource
+def _api_session() -> requests.Session:
+    # Uma sessão por processo: conexões keep-alive reaproveitadas entre reruns e usuários
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(_auth_headers())
+    return session
+
+
+@st.cache_data(ttl=HISTORY_TTL, show_spinner=False)
+def _fetch_history(api_url: str, cursor: str = None, created_from: str = None) -> dict:
+    """
+    Uma página de GET /images (projeção enxuta). Reruns dentro do TTL não chamam a API.
+    """
+    params = {"per_page": HISTORY_PAGE, "fields": HISTORY_FIELDS}
+    if cursor:
+        params["cursor"] = cursor
+    if created_from:
+        params["created_from"] = created_from
+    resp = _api_session().get(f"{api_url}/images", params=params, timeout=4)
+    resp.raise_for_status()
+    payload = resp.json()
+    return payload if isinstance(payload, dict) else {}
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _read_saved_image(path: str, mtime: float) -> bytes:
+    # `mtime` entra na chave do cache: arquivo regravado invalida a entrada
+    return Path(path).read_bytes()
+
+
+# Extensão do arquivo salvo conforme o Content-Type (output_mime) devolvido pela API
+_EXT_BY_MIME = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+_MIME_BY_EXT = {ext: mime for mime, ext in _EXT_BY_MIME.items()}
+
+
+def _ext_for_mime(mime: str) -> str:
+    return _EXT_BY_MIME.get((mime or "").split(";")[0].strip().lower(), ".jpg")
+
+
+def _mime_for_path(path: str) -> str:
+    return _MIME_BY_EXT.get(Path(path).suffix.lower(), "image/jpeg")
+
+
+def _saved_image_bytes(nome: str):
+    path = st.session_state.imagens_salvas.get(nome)
+    if path is None:
+        return None
+    try:
+        return _read_saved_image(path, os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+def _analise_key(a: dict):
+    return a.get("_server_id") or (a.get("nome"), a.get("data"))
+
+
+def _merge_server_items(server_items: list, newer: bool = False) -> None:
+    """
+    Mescla itens do servidor (mais recentes primeiro) no histórico local;
+    duplicatas são detectadas em O(1) pelo conjunto de chaves do session_state.
+    `newer=True`: itens mais novos que os já vistos vão para o fim (mais recentes).
+    """
+    keys = st.session_state.analises_keys
+    novos = []
+    for it in server_items:
+        nome = it.get("title") or it.get("input_filename") or f"img_{it.get('id')}"
+        created = it.get("created_at")
+        # formata data semelhante ao local
+        try:
+            dt = datetime.fromisoformat(created)
+            data_str = dt.strftime("%d/%m/%Y %H:%M")
+        except Exception:
+            data_str = created or ""
+        item = {
+            "nome": nome,
+            "data": data_str,
+            "pessoas": it.get("count") if it.get("count") is not None else "",
+            "descricao": it.get("description") or "",
+            "saved_image": None,
+            "_server_id": it.get("id"),
+        }
+        if created and (st.session_state.srv_newest is None or created > st.session_state.srv_newest):
+            st.session_state.srv_newest = created
+        if _analise_key(item) in keys or (nome, data_str) in keys:
+            continue
+        keys.add(_analise_key(item))
+        keys.add((nome, data_str))
+        novos.append(item)
+    if not novos:
+        return
+    # a lista local é cronológica (mais recente no fim)
+    novos.reverse()
+    if newer:
+        st.session_state.analises_realizadas.extend(novos)
+    else:
+        st.session_state.analises_realizadas[:0] = novos
+
+
 st.set_page_config(
     page_title="Crowd Counting System",
     page_icon="👥",
@@ -39,6 +146,8 @@ _load_css(pathlib.Path(__file__).parent / "style.css")
 # Estado
 if "analises_realizadas" not in st.session_state:
     st.session_state.analises_realizadas = []
+if "analises_keys" not in st.session_state:
+    st.session_state.analises_keys = set()
 if "imagem_atual" not in st.session_state:
     st.session_state.imagem_atual = None
 if "imagem_atual_bytes" not in st.session_state:
@@ -50,7 +159,14 @@ if "imagem_atual_type" not in st.session_state:
 if "resultado_contagem" not in st.session_state:
     st.session_state.resultado_contagem = None
 if "imagens_salvas" not in st.session_state:
+    # nome da análise -> caminho do arquivo em disco (bytes lidos só ao exibir o download)
     st.session_state.imagens_salvas = {}
+if "srv_newest" not in st.session_state:
+    st.session_state.srv_newest = None
+if "srv_cursor" not in st.session_state:
+    st.session_state.srv_cursor = None
+if "srv_loaded" not in st.session_state:
+    st.session_state.srv_loaded = False
 
 # --- Identificador do usuário/ sessão persistente via query param 'sid'
 query_params = st.query_params
@@ -69,62 +185,47 @@ base_data_dir = Path(__file__).parent / "data"
 user_dir = base_data_dir / sid
 user_dir.mkdir(parents=True, exist_ok=True)
 
-# Carrega análises salvas localmente para este sid (se existirem)
+# Carrega análises salvas localmente para este sid uma única vez por sessão
+# (os reruns seguintes usam o session_state, que já reflete as alterações)
 meta_file = user_dir / "metadata.json"
-if meta_file.exists():
-    try:
-        with open(meta_file, "r", encoding="utf-8") as mf:
-            data = json.load(mf)
-            # Coloca no session_state para uso pela UI
+if st.session_state.get("local_loaded_sid") != sid:
+    st.session_state.local_loaded_sid = sid
+    if meta_file.exists():
+        try:
+            with open(meta_file, "r", encoding="utf-8") as mf:
+                data = json.load(mf)
             st.session_state.analises_realizadas = data.get("analises", [])
-            # Carrega imagens salvas (se houverem arquivos referenciados)
+            st.session_state.analises_keys = {_analise_key(a) for a in st.session_state.analises_realizadas}
+            st.session_state.analises_keys |= {(a.get("nome"), a.get("data")) for a in st.session_state.analises_realizadas}
+            # Só os caminhos das imagens salvas; os bytes são lidos sob demanda
             st.session_state.imagens_salvas = {}
             for a in st.session_state.analises_realizadas:
                 img_name = a.get("saved_image")
                 if img_name:
                     img_path = user_dir / img_name
                     if img_path.exists():
-                        st.session_state.imagens_salvas[a["nome"]] = img_path.read_bytes()
-    except Exception:
-        # falha ao ler — ignora e segue com estado em branco
-        pass
+                        st.session_state.imagens_salvas[a["nome"]] = str(img_path)
+        except Exception:
+            # falha ao ler — ignora e segue com estado em branco
+            pass
 
-# --- Tenta carregar histórico do servidor e mesclar (GET /images)
+# --- Histórico do servidor (GET /images): primeira página uma vez por sessão,
+# depois só o que é mais novo que o último item visto (created_from)
 try:
-    headers = _auth_headers()
-    resp = requests.get(f"{API_URL}/images", params={"page": 1, "per_page": 50}, headers=headers, timeout=4)
-    if resp.status_code == 200:
-        payload = resp.json()
-        server_items = payload.get("images", []) if isinstance(payload, dict) else []
-        # Converte para o formato local e mescla (server items primeiro)
-        merged = []
-        for it in server_items:
-            meta = it.get("metadata", {}) or {}
-            nome = meta.get("title") or meta.get("input", it.get("input_filename") or f"img_{it.get('id')}")
-            created = it.get("created_at")
-            # formata data semelhante ao local
-            try:
-                dt = datetime.fromisoformat(created)
-                data_str = dt.strftime("%d/%m/%Y %H:%M")
-            except Exception:
-                data_str = created or ""
-            pessoas = meta.get("count") if isinstance(meta.get("count"), int) else meta.get("count")
-            descricao_srv = meta.get("description") or meta.get("descricao") or ""
-            merged.append({
-                "nome": nome,
-                "data": data_str,
-                "pessoas": pessoas if pessoas is not None else "",
-                "descricao": descricao_srv,
-                "saved_image": None,
-                "_server_id": it.get("id"),
-            })
-        # evita duplicatas simples (mesma nome+data)
-        existing_keys = {(a.get("nome"), a.get("data")) for a in st.session_state.analises_realizadas}
-        for m in merged:
-            key = (m.get("nome"), m.get("data"))
-            if key not in existing_keys:
-                st.session_state.analises_realizadas.insert(0, m)
-                existing_keys.add(key)
+    if not st.session_state.srv_loaded:
+        payload = _fetch_history(API_URL)
+        st.session_state.srv_loaded = True
+        st.session_state.srv_cursor = payload.get("next_cursor")
+        _merge_server_items(payload.get("images", []))
+    else:
+        # Segue next_cursor até chegar em srv_newest: mais de uma página de itens
+        # novos no mesmo TTL não pode deixar um buraco entre o mais novo e os vistos
+        payload = _fetch_history(API_URL, created_from=st.session_state.srv_newest)
+        novos = list(payload.get("images", []))
+        while payload.get("next_cursor"):
+            payload = _fetch_history(API_URL, cursor=payload["next_cursor"], created_from=st.session_state.srv_newest)
+            novos.extend(payload.get("images", []))
+        _merge_server_items(novos, newer=True)
 except Exception:
     # falha ao contatar API — segue com histórico local
     pass
@@ -218,13 +319,15 @@ with col_sidebar:
                     )
                 with col_actions:
                     # Botões em coluna vertical
-                    if analise["nome"] in st.session_state.imagens_salvas:
-                        imagem_data = st.session_state.imagens_salvas[analise["nome"]]
+                    # Bytes lidos só para as análises visíveis (cache por caminho+mtime)
+                    imagem_data = _saved_image_bytes(analise["nome"])
+                    if imagem_data is not None:
+                        saved_path = st.session_state.imagens_salvas[analise["nome"]]
                         st.download_button(
                             label="📥",
                             data=imagem_data,
-                            file_name=f"{analise['nome']}.jpg",
-                            mime="image/jpeg",
+                            file_name=f"{analise['nome']}{Path(saved_path).suffix or '.jpg'}",
+                            mime=_mime_for_path(saved_path),
                             key=f"download_btn_{analise_id}",
                             help="Baixar imagem",
                             use_container_width=True,
@@ -237,6 +340,16 @@ with col_sidebar:
                         # Marcar para exclusão no próximo rerun
                         st.session_state.delete_analise_id = analise_id
                         st.rerun()
+        if st.session_state.srv_cursor:
+            if st.button("⬇️ Carregar mais antigas", key="historico_mais", use_container_width=True):
+                try:
+                    payload = _fetch_history(API_URL, cursor=st.session_state.srv_cursor)
+                    st.session_state.srv_cursor = payload.get("next_cursor")
+                    _merge_server_items(payload.get("images", []))
+                except Exception as e:
+                    st.warning(f"Falha ao carregar histórico: {e}")
+                st.rerun()
+        st.caption(f"{total_analises} análise(s) no histórico")
     else:
         st.info("Nenhuma análise realizada ainda")
 
@@ -308,7 +421,7 @@ with col_main:
                         img_mime = st.session_state.imagem_atual_type or "image/jpeg"
                         files = {"file": (img_name, img_bytes, img_mime)}
                         params = {"mode": mode, "conf": conf}
-                        resp = requests.post(f"{API_URL}/process", files=files, params=params, timeout=180)
+                        resp = _api_session().post(f"{API_URL}/process", files=files, params=params, timeout=180)
                         if resp.status_code != 200:
                             st.session_state.resultado_contagem = None
                             st.error(f"Erro da API: {resp.status_code} - {resp.text}")
@@ -324,6 +437,8 @@ with col_main:
                                 count_val = None
                             st.session_state.resultado_contagem = count_val
                             annotated_bytes = resp.content
+                            out_mime = resp.headers.get("Content-Type", "image/jpeg")
+                            out_ext = _ext_for_mime(out_mime)
                             st.image(
                                 io.BytesIO(annotated_bytes),
                                 caption=f"Resultado (ID: {img_id}{' • duplicado' if duplicate else ''})",
@@ -332,18 +447,17 @@ with col_main:
                             st.download_button(
                                 label="📥 Baixar imagem anotada",
                                 data=annotated_bytes,
-                                file_name=f"annotated_{img_name}",
-                                mime="image/jpeg",
+                                file_name=f"annotated_{Path(img_name).stem}{out_ext}",
+                                mime=out_mime,
                                 key="download_result_btn",
                             )
-                            st.session_state.imagens_salvas[nome_analise] = annotated_bytes
-                            # Persistência local leve: salva também no diretório do sid
+                            # Persistência local leve: salva no diretório do sid e guarda só o caminho
                             try:
                                 # gera nome seguro para arquivo
-                                safe_img_name = f"{nome_analise.replace(' ', '_')}.jpg"
+                                safe_img_name = f"{nome_analise.replace(' ', '_')}{out_ext}"
                                 img_path = user_dir / safe_img_name
                                 img_path.write_bytes(annotated_bytes)
-                                # atualiza metadata no objeto de análise (se houver)
+                                st.session_state.imagens_salvas[nome_analise] = str(img_path)
                             except Exception:
                                 pass
                             if count_val is None:
@@ -389,17 +503,19 @@ with col_main:
                     # prefer annotated image se disponível, senão imagem original
                     try:
                         if nome_analise in st.session_state.imagens_salvas:
-                            img_bytes = st.session_state.imagens_salvas[nome_analise]
+                            img_bytes = _saved_image_bytes(nome_analise)
+                            img_ext = Path(st.session_state.imagens_salvas[nome_analise]).suffix or ".jpg"
                         elif st.session_state.imagem_atual_bytes is not None:
                             img_bytes = st.session_state.imagem_atual_bytes
+                            img_ext = _ext_for_mime(st.session_state.imagem_atual_type)
                         else:
                             img_bytes = None
                         if img_bytes:
-                            safe_img_name = f"{nome_final.replace(' ', '_')}.jpg"
+                            safe_img_name = f"{nome_final.replace(' ', '_')}{img_ext}"
                             img_path = user_dir / safe_img_name
                             img_path.write_bytes(img_bytes)
                             nova_analise["saved_image"] = safe_img_name
-                            st.session_state.imagens_salvas[nome_final] = img_bytes
+                            st.session_state.imagens_salvas[nome_final] = str(img_path)
                     except Exception:
                         # não falha a UI por erro de disco
                         pass
@@ -408,13 +524,14 @@ with col_main:
                     try:
                         img_id_to_update = st.session_state.get("last_image_id")
                         if img_id_to_update:
-                            headers = _auth_headers()
                             patch_body = {"title": nome_final, "description": nova_analise.get("descricao", "")}
-                            requests.patch(f"{API_URL}/images/{img_id_to_update}", json=patch_body, headers=headers, timeout=5)
+                            _api_session().patch(f"{API_URL}/images/{img_id_to_update}", json=patch_body, timeout=5)
                     except Exception:
                         pass
 
                     st.session_state.analises_realizadas.append(nova_analise)
+                    st.session_state.analises_keys.add(_analise_key(nova_analise))
+                    st.session_state.analises_keys.add((nova_analise["nome"], nova_analise["data"]))
 
                     # salva metadata completa no disco para persistência entre reloads
                     try:
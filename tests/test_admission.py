@@ -0,0 +1,153 @@
+"""
+Controle de admissão: fila cheia, desalojamento por prioridade, timeout de
+espera, liberação da vaga quando o cliente desconecta e CORS nas recusas.
+"""
+
+import asyncio
+
+import pytest
+
+from admission import PRIORITIES, AdmissionController, AdmissionMiddleware, RateLimiter, Rejected
+
+HIGH, NORMAL, LOW = PRIORITIES["high"], PRIORITIES["normal"], PRIORITIES["low"]
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_full_queue_rejects_with_503():
+    async def main():
+        ctl = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+        await ctl.acquire()
+        waiting = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as exc:
+            await ctl.acquire()
+        assert (exc.value.status, exc.value.reason) == (503, "server saturated")
+        assert exc.value.retry_after >= 1
+        ctl.release(0.1)
+        await waiting
+        assert (ctl.in_flight, ctl.queued) == (1, 0)
+
+    _run(main())
+
+
+def test_higher_priority_sheds_lowest_waiter():
+    async def main():
+        ctl = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+        await ctl.acquire()
+        low = asyncio.ensure_future(ctl.acquire(LOW))
+        await asyncio.sleep(0)
+        high = asyncio.ensure_future(ctl.acquire(HIGH))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as exc:
+            await low
+        assert exc.value.reason == "shed for higher priority work"
+        ctl.release()
+        assert await high >= 0.0
+        assert (ctl.in_flight, ctl.queued) == (1, 0)
+
+    _run(main())
+
+
+def test_queue_wait_timeout_leaves_queue_empty():
+    async def main():
+        ctl = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.05)
+        await ctl.acquire()
+        with pytest.raises(Rejected) as exc:
+            await ctl.acquire()
+        assert (exc.value.status, exc.value.reason) == (503, "queue wait timeout")
+        assert (ctl.in_flight, ctl.queued) == (1, 0)
+
+    _run(main())
+
+
+def test_cancelled_waiter_frees_its_place_and_slot():
+    async def main():
+        ctl = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=5)
+        await ctl.acquire()
+        # Desconectou ainda na fila
+        gone = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        assert ctl.queued == 0
+
+        # Recebeu a vaga e foi cancelado antes de voltar a rodar: a vaga é devolvida
+        granted = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        ctl.release()
+        assert ctl.in_flight == 1
+        granted.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await granted
+        assert (ctl.in_flight, ctl.queued) == (0, 0)
+
+    _run(main())
+
+
+def _scope(path="/process"):
+    return {"type": "http", "method": "POST", "path": path, "headers": [], "client": ("127.0.0.1", 1)}
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def test_slot_released_when_client_disconnects_mid_stream():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"linha\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("client disconnected")
+
+    async def main():
+        ctl = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=1)
+        mw = AdmissionMiddleware(app, ctl)
+        with pytest.raises(OSError):
+            await mw(_scope(), _receive, send)
+        assert ctl.in_flight == 0
+
+        sent = []
+
+        async def ok_send(message):
+            sent.append(message)
+
+        await mw(_scope(), _receive, ok_send)
+        # Liberada uma única vez, ao fim do corpo
+        assert ctl.in_flight == 0
+        assert (b"server-timing", b"queue;dur=0.0") in sent[0]["headers"]
+
+    _run(main())
+
+
+def test_rate_limit_rejects_with_429():
+    limiter = RateLimiter(rate=0.001, burst=1)
+    limiter.check("ip:1")
+    with pytest.raises(Rejected) as exc:
+        limiter.check("ip:1")
+    assert exc.value.status == 429
+    limiter.check("ip:2")
+
+
+def test_admission_rejection_carries_cors_headers(monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+
+    import api
+
+    origin = api.allow_origins[0]
+    # Servidor saturado e sem fila: a próxima requisição é recusada na hora
+    monkeypatch.setattr(api._admission, "in_flight", api._admission.max_in_flight)
+    monkeypatch.setattr(api._admission, "max_queue", 0)
+    r = TestClient(api.app).post("/process", headers={"Origin": origin}, files={"file": ("a.jpg", b"x", "image/jpeg")})
+
+    assert r.status_code == 503
+    assert int(r.headers["Retry-After"]) >= 1
+    assert r.headers["access-control-allow-origin"] == origin
+    assert "retry-after" in r.headers["access-control-expose-headers"].lower()
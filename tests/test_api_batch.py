@@ -0,0 +1,109 @@
+"""
+POST /process/batch com o modelo stub e sem Postgres: ordem das linhas NDJSON,
+erros por imagem e cache de resultados compartilhado com POST /process.
+"""
+
+import io
+import json
+import zipfile
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+
+import api  # noqa: E402
+import count_people as cp  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+
+
+def _jpeg(value, size=(120, 100)):
+    return cv2.imencode(".jpg", np.full((size[1], size[0], 3), value, dtype=np.uint8))[1].tobytes()
+
+
+def _png(value, size=(60, 50)):
+    return cv2.imencode(".png", np.full((size[1], size[0], 3), value, dtype=np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("PEOPLE_MODEL_STUB", "0:4")
+    monkeypatch.setattr(cp, "_MODELS", {})
+    monkeypatch.setattr(api, "_ensure_db", lambda: None)
+    monkeypatch.setattr(api, "_results", ResultCache(memory_bytes=16 * 1024 * 1024))
+    monkeypatch.setattr(api, "_BATCH_SIZE", 2)
+    return TestClient(api.app)
+
+
+def _batch(client, files, **params):
+    r = client.post("/process/batch", params={"mode": "bbox", **params}, files=[("files", f) for f in files])
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def test_ndjson_lines_order_and_per_item_errors(client):
+    files = [
+        ("a.jpg", _jpeg(10), "image/jpeg"),
+        ("quebrada.jpg", b"isto nao e uma imagem", "image/jpeg"),
+        ("b.png", _png(20), "image/png"),
+        ("c.jpg", _jpeg(30), "image/jpeg"),
+        ("d.jpg", _jpeg(40), "image/jpeg"),
+    ]
+    lines = _batch(client, files)
+
+    summary = lines.pop()
+    assert summary == {"summary": {"total": 5, "ok": 4, "failed": 1, "people": 16}}
+    assert sorted(line["index"] for line in lines) == [0, 1, 2, 3, 4]
+    # Falhas saem na hora; as inferidas saem na ordem de entrada, lote a lote
+    assert lines[0] == {
+        "index": 1,
+        "filename": "quebrada.jpg",
+        "ok": False,
+        "error": "Unsupported image format (expected JPEG, PNG, WebP, BMP or TIFF)",
+    }
+    misses = lines[1:]
+    assert [line["index"] for line in misses] == [0, 2, 3, 4]
+    assert [line["filename"] for line in misses] == ["a.jpg", "b.png", "c.jpg", "d.jpg"]
+    assert all(line["ok"] and line["cache"] == "miss" and line["count"] == 4 for line in misses)
+
+
+def test_batch_result_is_a_cache_hit_for_process(client):
+    img = _jpeg(50)
+    first = _batch(client, [("a.jpg", img, "image/jpeg")])
+    assert first[0]["cache"] == "miss"
+
+    r = client.post("/process", params={"mode": "bbox"}, files={"file": ("outra.jpg", img, "image/jpeg")})
+    assert r.status_code == 200
+    assert r.headers["X-Cache"] == "hit-memory"
+    assert r.headers["X-Count"] == "4"
+    # Outros parâmetros: outra chave
+    r = client.post("/process", params={"mode": "bbox", "conf": 0.5}, files={"file": ("a.jpg", img, "image/jpeg")})
+    assert r.headers["X-Cache"] == "miss"
+
+
+def test_process_result_is_a_cache_hit_for_batch(client):
+    cached, fresh = _jpeg(60), _jpeg(70)
+    r = client.post("/process", params={"mode": "bbox"}, files={"file": ("a.jpg", cached, "image/jpeg")})
+    assert r.headers["X-Cache"] == "miss"
+
+    lines = _batch(client, [("novo.jpg", fresh, "image/jpeg"), ("a.jpg", cached, "image/jpeg")])
+    # O acerto no cache responde antes das que vão para a inferência
+    assert [(line["index"], line["cache"]) for line in lines[:-1]] == [(1, "hit-memory"), (0, "miss")]
+    assert lines[0]["count"] == 4
+    assert lines[-1]["summary"]["ok"] == 2
+
+
+def test_zip_output_has_annotated_images_and_report(client):
+    files = [("a.jpg", _jpeg(80), "image/jpeg"), ("x.jpg", b"lixo", "image/jpeg")]
+    r = client.post(
+        "/process/batch", params={"mode": "bbox", "output": "zip"}, files=[("files", f) for f in files]
+    )
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        names = zf.namelist()
+        report = [json.loads(line) for line in zf.read("results.ndjson").decode().splitlines()]
+    assert "00000_a_marked.jpg" in names
+    assert [line.get("index") for line in report] == [1, 0, None]
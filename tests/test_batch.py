@@ -0,0 +1,54 @@
+"""
+Processamento em lote (marcar_pessoas_batch) com o modelo stub.
+"""
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+import count_people as cp  # noqa: E402
+import density  # noqa: E402
+
+
+class _FlatDensity:
+    def predict(self, img_bgr):
+        return np.full((8, 8), 0.5, dtype=np.float32)
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    monkeypatch.setenv("PEOPLE_MODEL_STUB", "0:4")
+    monkeypatch.setattr(cp, "_MODELS", {})
+    monkeypatch.setattr(density, "get_estimator", lambda path=None: _FlatDensity())
+    yield
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for name, size in (("pequena.jpg", (100, 100)), ("grande.jpg", (2000, 2000))):
+        path = tmp_path / name
+        cv2.imwrite(str(path), np.full((size[1], size[0], 3), 128, dtype=np.uint8))
+        paths.append(path)
+    return paths
+
+
+def test_batch_density_switch_matches_single_image(stub_model, images, tmp_path):
+    # 4 pessoas: 400/MP na pequena, 1/MP na grande; só a pequena troca para density
+    kwargs = dict(mode="bbox", export_csv=False, density_model="crowd.onnx", density_switch=100)
+    batch = list(cp.marcar_pessoas_batch(images, tmp_path / "lote", **kwargs))
+    single = [cp.marcar_pessoas(p, tmp_path / "uma", **kwargs) for p in images]
+
+    for b, s in zip(batch, single):
+        assert not isinstance(b, Exception)
+        assert b["count"] == s["count"]
+        assert b.get("switched_from") == s.get("switched_from")
+    assert batch[0]["switched_from"] == {"mode": "bbox", "boxes": 4}
+    assert batch[0]["count"] == 32 and batch[0]["detections"] == []
+    assert "switched_from" not in batch[1] and batch[1]["count"] == 4
+
+
+def test_batch_without_switch_keeps_detections(stub_model, images, tmp_path):
+    out = list(cp.marcar_pessoas_batch(images, tmp_path / "lote", mode="bbox", export_csv=False))
+    assert [r["count"] for r in out] == [4, 4]
+    assert all("switched_from" not in r for r in out)
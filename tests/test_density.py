@@ -0,0 +1,46 @@
+"""
+Cache de estimadores do modo density (chave: caminho + impressão digital dos pesos).
+"""
+
+import os
+
+import pytest
+
+import density
+
+
+class _StubEstimator:
+    def __init__(self, path, max_side=1024):
+        self.path = path
+        self.max_side = max_side
+
+
+@pytest.fixture
+def weights(tmp_path, monkeypatch):
+    path = tmp_path / "crowd.onnx"
+    path.write_bytes(b"v1")
+    monkeypatch.setattr(density, "_ESTIMATORS", {})
+    monkeypatch.setattr(density, "DensityEstimator", _StubEstimator)
+    monkeypatch.setenv("DENSITY_MODEL", str(path))
+    return path
+
+
+def test_loaded_after_get_estimator(weights):
+    assert not density.loaded()
+    est = density.get_estimator()
+    assert density.loaded()
+    assert density.loaded(str(weights))
+    assert density.get_estimator() is est
+
+
+def test_weights_replaced_in_place_reload(weights):
+    est = density.get_estimator()
+    v1 = density.model_version()
+    weights.write_bytes(b"v2-maior")
+    os.utime(weights, ns=(0, 1_000_000_000))
+
+    assert density.model_version() != v1
+    # Ainda pronto até a próxima carga, que troca o estimador
+    assert density.loaded()
+    assert density.get_estimator() is not est
+    assert len(density._ESTIMATORS) == 1
@@ -0,0 +1,53 @@
+"""
+Acúmulo incremental do heatmap a partir dos *_marked_meta.json.
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+from heatmap import HeatmapStore, OccupancyHeatmap, accumulate_meta  # noqa: E402
+
+
+def _write_meta(path, mtime, boxes=((10, 10, 50, 90),)):
+    path.write_text(
+        json.dumps({"frame_size": [160, 90], "detections": [{"bbox": list(b)} for b in boxes]}), encoding="utf-8"
+    )
+    os.utime(path, (mtime, mtime))
+
+
+def test_files_sharing_the_watermark_mtime_are_not_skipped(tmp_path):
+    metas = tmp_path / "out"
+    metas.mkdir()
+    _write_meta(metas / "a_marked_meta.json", 1000.0)
+    store = HeatmapStore(tmp_path / "heat")
+    assert accumulate_meta(store, metas, "cam", None) == 1
+
+    # Outro arquivo com o mesmo mtime chega depois da primeira passada
+    _write_meta(metas / "b_marked_meta.json", 1000.0)
+    store = HeatmapStore(tmp_path / "heat")
+    assert accumulate_meta(store, metas, "cam", None) == 1
+    assert accumulate_meta(HeatmapStore(tmp_path / "heat"), metas, "cam", None) == 0
+    assert OccupancyHeatmap.load(store.path_for("cam")).frames == 2
+
+
+def test_resume_after_crash_does_not_double_count(tmp_path):
+    metas = tmp_path / "out"
+    metas.mkdir()
+    for i in range(5):
+        _write_meta(metas / f"{i}_marked_meta.json", 1000.0 + i)
+    store = HeatmapStore(tmp_path / "heat", flush_every=2)
+    original_flush = store.flush
+    store.flush = lambda: None  # "crash": o flush final não acontece
+    accumulate_meta(store, metas, "cam", None)
+    saved = OccupancyHeatmap.load(store.path_for("cam"))
+    # Gravado no 4º frame: grade e marca d'água juntas
+    assert saved.frames == 4
+    assert saved.watermark == (1003.0, "3_marked_meta.json")
+    store.flush = original_flush
+
+    resumed = HeatmapStore(tmp_path / "heat")
+    assert accumulate_meta(resumed, metas, "cam", None) == 1
+    assert OccupancyHeatmap.load(resumed.path_for("cam")).frames == 5
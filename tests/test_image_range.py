@@ -0,0 +1,90 @@
+"""
+GET /images/{id}: ETag/If-None-Match e Range, servidos do LRU de imagens
+quentes (sem Postgres).
+"""
+
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi import HTTPException  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import api  # noqa: E402
+from lru import ByteLRU  # noqa: E402
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+ETAG = api._etag("abc123")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    hot = ByteLRU(max_bytes=1024 * 1024, max_item_bytes=1024 * 1024)
+    hot.put((7, 0), (DATA, ETAG, "image/jpeg"), len(DATA))
+    monkeypatch.setattr(api, "_hot_images", hot)
+    monkeypatch.setattr(api, "_ensure_db", lambda: None)
+    return TestClient(api.app)
+
+
+def test_full_body_with_strong_etag(client):
+    r = client.get("/images/7")
+    assert r.status_code == 200
+    assert r.content == DATA
+    assert r.headers["ETag"] == ETAG
+    assert r.headers["Accept-Ranges"] == "bytes"
+
+
+@pytest.mark.parametrize("header", [ETAG, f"W/{ETAG}", f'"outra", {ETAG}', "*"])
+def test_if_none_match_returns_304(client, header):
+    r = client.get("/images/7", headers={"If-None-Match": header})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["ETag"] == ETAG
+
+
+def test_if_none_match_other_etag_serves_body(client):
+    r = client.get("/images/7", headers={"If-None-Match": '"outra", W/"mais-uma"'})
+    assert r.status_code == 200 and r.content == DATA
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [
+        ("bytes=0-99", 0, 99),
+        ("bytes=1000-", 1000, 1023),
+        ("bytes=-24", 1000, 1023),  # sufixo: últimos 24 bytes
+        ("bytes=-5000", 0, 1023),  # sufixo maior que o corpo: corpo inteiro
+        ("bytes=1000-5000", 1000, 1023),  # fim além do corpo é truncado
+    ],
+)
+def test_single_range_returns_206(client, header, start, end):
+    r = client.get("/images/7", headers={"Range": header})
+    assert r.status_code == 206
+    assert r.content == DATA[start:end + 1]
+    assert r.headers["Content-Range"] == f"bytes {start}-{end}/1024"
+    assert r.headers["Content-Length"] == str(end - start + 1)
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=5000-6000", "bytes=1024-1030"])
+def test_unsatisfiable_range_returns_416(client, header):
+    r = client.get("/images/7", headers={"Range": header})
+    assert r.status_code == 416
+    assert r.headers["Content-Range"] == "bytes */1024"
+
+
+@pytest.mark.parametrize("header", ["bytes=0-9,20-29", "bytes=9-0", "bytes=-0", "bytes=abc", "items=0-9", "bytes=-"])
+def test_unsupported_or_invalid_range_serves_full_body(client, header):
+    r = client.get("/images/7", headers={"Range": header})
+    assert r.status_code == 200
+    assert r.content == DATA
+
+
+def test_if_none_match_wins_over_range(client):
+    r = client.get("/images/7", headers={"If-None-Match": ETAG, "Range": "bytes=0-9"})
+    assert r.status_code == 304
+
+
+def test_parse_range_on_empty_body():
+    assert api._parse_range(None, 0) is None
+    with pytest.raises(HTTPException) as exc:
+        api._parse_range("bytes=-10", 0)
+    assert exc.value.status_code == 416
@@ -0,0 +1,146 @@
+"""
+GET /images: paginação por cursor (created_at, id).
+
+Como em test_rollups.py, a consulta roda num SQLite em memória no lugar do
+Postgres (comparação de row values e `->>` exigem SQLite >= 3.38), com os
+placeholders `%s` trocados por `?`.
+"""
+
+import base64
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+
+import api  # noqa: E402
+
+UTC = timezone.utc
+T0 = datetime(2026, 3, 1, 10, 0, 0, tzinfo=UTC)
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat())
+sqlite3.register_converter("TIMESTAMPTZ", lambda b: datetime.fromisoformat(b.decode()))
+
+pytestmark = pytest.mark.skipif(sqlite3.sqlite_version_info < (3, 38), reason="SQLite sem ->>")
+
+
+class _Cursor:
+    def __init__(self, cur: sqlite3.Cursor) -> None:
+        self._cur = cur
+
+    def __enter__(self) -> "_Cursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._cur.close()
+
+    def execute(self, sql: str, params=()) -> None:
+        self._cur.execute(sql.replace("%s", "?"), list(params))
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+
+class _Conn:
+    def __init__(self) -> None:
+        self.db = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self.db.execute(
+            """
+            CREATE TABLE images (
+                id INTEGER PRIMARY KEY,
+                created_at TIMESTAMPTZ NOT NULL,
+                input_filename TEXT,
+                output_filename TEXT,
+                people_count INTEGER,
+                source TEXT,
+                metadata TEXT
+            );
+            """
+        )
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self.db.cursor())
+
+
+# id -> segundos após T0; vários ids dividem o mesmo created_at
+ROWS = {1: 0, 2: 0, 3: 60, 4: 60, 5: 60, 6: 120, 7: 60}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    conn = _Conn()
+    for img_id, secs in ROWS.items():
+        conn.db.execute(
+            "INSERT INTO images (id, created_at, input_filename, people_count, metadata) VALUES (?, ?, ?, ?, '{}');",
+            [img_id, T0 + timedelta(seconds=secs), f"{img_id}.jpg", img_id],
+        )
+    monkeypatch.setattr(api, "_ensure_db", lambda: conn)
+    return TestClient(api.app)
+
+
+def _expected_order():
+    return [i for i, _ in sorted(ROWS.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)]
+
+
+@pytest.mark.parametrize("per_page", [1, 2, 3, 7, 10])
+def test_cursor_pages_cover_ties_exactly_once(client, per_page):
+    seen, cursor = [], None
+    for _ in range(20):
+        params = {"per_page": per_page, **({"cursor": cursor} if cursor else {})}
+        r = client.get("/images", params=params)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        seen += [img["id"] for img in body["images"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    # created_at DESC, id DESC; empates em created_at não repetem nem pulam linhas
+    assert seen == _expected_order()
+
+
+def test_cursor_combines_with_filters(client):
+    r = client.get("/images", params={"per_page": 2, "min_count": 3})
+    first = r.json()
+    r = client.get("/images", params={"per_page": 2, "min_count": 3, "cursor": first["next_cursor"]})
+    ids = [img["id"] for img in first["images"] + r.json()["images"]]
+    assert ids == [i for i in _expected_order() if i >= 3][:4]
+
+
+@pytest.mark.parametrize(
+    "ts",
+    [
+        T0,
+        datetime(2026, 3, 1, 10, 0, 0, 123456, tzinfo=UTC),
+        datetime(2026, 3, 1, 7, 0, 0, tzinfo=timezone(timedelta(hours=-3))),
+    ],
+)
+def test_cursor_round_trip(ts):
+    token = api._encode_cursor(ts, 42)
+    assert "=" not in token
+    assert api._decode_cursor(token) == (ts, 42)
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "nao-e-base64!!",
+        "é",
+        _b64("lixo"),
+        _b64("2026-03-01T10:00:00+00:00|abc"),
+        _b64("ontem|5"),
+        _b64("2026-03-01T10:00:00|5"),  # sem fuso
+        _b64("2026-03-01T10:00:00+00:00|-1"),
+        _b64(f"2026-03-01T10:00:00+00:00|{2**63}"),
+        base64.urlsafe_b64encode(b"\xff\xfe|1").decode(),
+    ],
+)
+def test_invalid_cursor_is_400(client, cursor):
+    r = client.get("/images", params={"cursor": cursor})
+    assert r.status_code == 400
+    assert r.json() == {"detail": "Invalid cursor"}
@@ -0,0 +1,72 @@
+"""
+Polígonos das máscaras de baixa resolução: a inversa do letterbox leva os
+contornos de volta ao frame original.
+"""
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+import count_people as cp  # noqa: E402
+from mask_polygons import PARALLEL_MIN, extract_polygons, letterbox_params  # noqa: E402
+
+
+def test_letterbox_params_match_ultralytics_padding():
+    # 1920x1080 -> 640x384: gain 1/3, 12 px de borda em cima e embaixo
+    gain, pad_x, pad_y = letterbox_params((384, 640), (1080, 1920))
+    assert gain == pytest.approx(1 / 3)
+    assert (pad_x, pad_y) == (0.0, 12.0)
+    # Retrato: borda nas laterais
+    gain, pad_x, pad_y = letterbox_params((640, 384), (1920, 1080))
+    assert gain == pytest.approx(1 / 3)
+    assert (pad_x, pad_y) == (12.0, 0.0)
+
+
+def test_known_rectangle_maps_back_to_original_frame():
+    orig = (1080, 1920)
+    gain, pad_x, pad_y = letterbox_params((384, 640), orig)
+    box = np.array([[300.0, 210.0, 900.0, 810.0]], dtype=np.float32)
+    data = np.zeros((1, 384, 640), dtype=np.float32)
+    x0, y0 = int(box[0, 0] * gain + pad_x), int(box[0, 1] * gain + pad_y)
+    x1, y1 = int(box[0, 2] * gain + pad_x), int(box[0, 3] * gain + pad_y)
+    data[0, y0:y1, x0:x1] = 1.0
+
+    (poly,), = extract_polygons(data, box, orig)
+    # Um pixel da máscara vale 1/gain = 3 px do frame
+    tol = 1.0 / gain + 1
+    assert np.allclose(poly.min(axis=0), box[0, :2], atol=tol)
+    assert np.allclose(poly.max(axis=0), box[0, 2:], atol=tol)
+
+
+@pytest.mark.parametrize("shape", [(1080, 1920), (1920, 1080), (333, 517), (3000, 4000)])
+@pytest.mark.parametrize("people", [3, PARALLEL_MIN + 1])
+def test_stub_masks_map_back_to_frame_size(shape, people):
+    h, w = shape
+    model = cp._StubModel(f"0:{people}", seg=True)
+    (r,) = model(np.zeros((h, w, 3), dtype=np.uint8))
+    boxes = r.boxes.xyxy.numpy()
+    data = r.masks.data
+
+    polys = extract_polygons(data, boxes, r.masks.orig_shape)
+    assert len(polys) == people
+    gain, _, _ = letterbox_params(data.shape[1:], (h, w))
+    # elipse com eixos inteiros e borda sem arredondamento no stub: ~2 px da máscara
+    tol = 2.0 / gain + 1
+    for (x1, y1, x2, y2), segs in zip(boxes, polys):
+        (poly,) = segs
+        assert poly.dtype == np.float32 and poly.shape[1] == 2
+        assert (poly >= -tol).all() and (poly[:, 0] <= w + tol).all() and (poly[:, 1] <= h + tol).all()
+        assert np.allclose(poly.min(axis=0), [x1, y1], atol=tol)
+        assert np.allclose(poly.max(axis=0), [x2, y2], atol=tol)
+
+
+def test_contour_scale_and_epsilon_keep_the_mapping():
+    h, w = 720, 1280
+    (r,) = cp._StubModel("0:4", seg=True)(np.zeros((h, w, 3), dtype=np.uint8))
+    boxes = r.boxes.xyxy.numpy()
+    base = extract_polygons(r.masks.data, boxes, (h, w))
+    for scale, epsilon in ((2.0, 0.0), (0.5, 0.0), (1.0, 1.5)):
+        other = extract_polygons(r.masks.data, boxes, (h, w), scale=scale, epsilon=epsilon)
+        for (a,), (b,) in zip(base, other):
+            assert np.allclose(a.min(axis=0), b.min(axis=0), atol=8)
+            assert np.allclose(a.max(axis=0), b.max(axis=0), atol=8)
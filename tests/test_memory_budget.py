@@ -0,0 +1,137 @@
+"""
+Orçamento de memória (`max_pixels`): a inferência roda na cópia reduzida, mas
+caixas, polígonos e `frame_size` voltam ao frame original.
+"""
+
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+import count_people as cp  # noqa: E402
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    # Stub sem latência; as caixas são frações fixas do frame que ele recebe
+    monkeypatch.setenv("PEOPLE_MODEL_STUB", "0:4")
+    monkeypatch.setattr(cp, "_MODELS", {})
+    yield
+
+
+@pytest.fixture
+def big_image(tmp_path):
+    path = tmp_path / "grande.jpg"
+    img = np.full((3000, 4000, 3), 128, dtype=np.uint8)
+    cv2.imwrite(str(path), img)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["bbox", "seg"])
+def test_downscale_maps_detections_to_original_frame(stub_model, big_image, tmp_path, mode):
+    full = cp.marcar_pessoas(big_image, tmp_path / "full", mode=mode, export_csv=False)
+    small = cp.marcar_pessoas(big_image, tmp_path / "small", mode=mode, export_csv=False, max_pixels=1_000_000)
+
+    assert "working_size" not in full
+    if sys.platform.startswith("linux"):
+        # Imagem sozinha no processo: o pico é atribuído a ela
+        assert small["memory"]["peak_rss_mb"] is not None
+    w, h = small["working_size"]
+    assert w * h <= 1_000_000 and w < 4000
+    assert small["frame_size"] == full["frame_size"] == [4000, 3000]
+
+    # Tolerância de ~1 px da cópia de trabalho, levado ao frame original
+    tol = 4000 / w + 1
+    assert small["count"] == full["count"] == 4
+    for a, b in zip(small["detections"], full["detections"]):
+        assert np.allclose(a["bbox"], b["bbox"], atol=tol)
+        assert max(a["bbox"]) > w  # coordenadas no frame original, não no de trabalho
+    if mode == "seg":
+        for a, b in zip(small["detections"], full["detections"]):
+            pa, pb = np.array(a["polygons"][0]), np.array(b["polygons"][0])
+            assert np.allclose(pa.min(axis=0), pb.min(axis=0), atol=2 * tol)
+            assert np.allclose(pa.max(axis=0), pb.max(axis=0), atol=2 * tol)
+
+    out = cv2.imread(small["output_image"])
+    assert out.shape[1::-1] == (w, h)
+
+
+def test_peak_rss_not_attributed_to_overlapping_images():
+    alone = cp._PeakRss()
+    assert alone.isolated
+    alone.close()
+
+    first = cp._PeakRss()
+    second = cp._PeakRss()
+    try:
+        # Começou com outra em andamento / outra começou durante ela
+        assert second.peak_mb() is None
+        assert first.peak_mb() is None
+    finally:
+        second.close()
+        first.close()
+
+    after = cp._PeakRss()
+    try:
+        assert after.isolated
+    finally:
+        after.close()
+
+
+def test_peak_rss_is_null_under_concurrent_calls(stub_model, tmp_path, monkeypatch):
+    img = np.full((200, 300, 3), 90, dtype=np.uint8)
+    barrier = threading.Barrier(2)
+    results = []
+    real_infer = cp._infer
+
+    def infer(*args, **kwargs):
+        # As duas imagens ficam em andamento ao mesmo tempo
+        barrier.wait(timeout=10)
+        return real_infer(*args, **kwargs)
+
+    monkeypatch.setattr(cp, "_infer", infer)
+    threads = [
+        threading.Thread(
+            target=lambda i=i: results.append(
+                cp.marcar_pessoas(tmp_path / f"f{i}.jpg", tmp_path, mode="bbox", export_csv=False, frame=img.copy())
+            )
+        )
+        for i in range(2)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 2
+    assert all(r["memory"]["peak_rss_mb"] is None for r in results)
+    assert cp._PeakRss._active == 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="VmHWM só existe no Linux")
+def test_batch_images_carry_peak_including_shared_stages(stub_model, big_image, tmp_path):
+    small = tmp_path / "pequena.jpg"
+    cv2.imwrite(str(small), np.full((100, 100, 3), 128, dtype=np.uint8))
+    out = list(cp.marcar_pessoas_batch([big_image, small], tmp_path / "lote", mode="bbox", export_csv=False))
+
+    peaks = [r["memory"]["peak_rss_mb"] for r in out]
+    assert all(p is not None for p in peaks)
+    # A pequena dividiu o decode com a grande: o pico dela não fica abaixo do do lote
+    assert peaks[1] >= out[1]["memory"]["rss_start_mb"]
+    assert all(r["memory"]["batch_images"] == 2 for r in out)
+    assert cp._PeakRss._active == 0
+
+
+def test_batch_peak_is_null_when_shared_stages_overlap(stub_model, tmp_path):
+    path = tmp_path / "a.jpg"
+    cv2.imwrite(str(path), np.full((100, 100, 3), 128, dtype=np.uint8))
+    other = cp._PeakRss()
+    try:
+        gen = cp.marcar_pessoas_batch([path], tmp_path / "lote", mode="bbox", export_csv=False)
+        first = next(gen)
+    finally:
+        other.close()
+    assert first["memory"]["peak_rss_mb"] is None
+    assert list(gen) == []
+    assert cp._PeakRss._active == 0
@@ -0,0 +1,51 @@
+"""
+Leitura do JSON de ROIs (load_roi_config): erros apontam a fonte com problema.
+"""
+
+import json
+
+import pytest
+
+from roi import RegionOfInterest, load_roi_config, roi_for
+
+SQUARE = [[[0, 0], [1, 0], [1, 1], [0, 1]]]
+
+
+def _write(tmp_path, config):
+    path = tmp_path / "roi.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    return str(path)
+
+
+def test_valid_config_with_default_fallback(tmp_path):
+    config = load_roi_config(_write(tmp_path, {"cam01": {"include": SQUARE, "exclude": []}, "default": {"include": SQUARE}}))
+    assert set(config) == {"cam01", "default"}
+    assert isinstance(config["cam01"], RegionOfInterest)
+    assert roi_for(config, "cam01") is config["cam01"]
+    assert roi_for(config, "outra") is config["default"]
+    assert load_roi_config(None) == {} and load_roi_config("") == {}
+
+
+@pytest.mark.parametrize(
+    "entry, message",
+    [
+        (SQUARE, "ROI 'cam02': esperado um objeto {include, exclude}, recebido list"),
+        ("cam01", "ROI 'cam02': esperado um objeto {include, exclude}, recebido str"),
+        (None, "ROI 'cam02': esperado um objeto {include, exclude}, recebido NoneType"),
+        ({"include": SQUARE, "exlude": []}, "ROI 'cam02': campos desconhecidos ['exlude']"),
+        ({"include": [[["a", 0], [1, 0], [1, 1]]]}, "ROI 'cam02': Pontos de ROI devem ser pares [x, y] numéricos."),
+        # um único polígono no lugar da lista de polígonos
+        ({"include": SQUARE[0]}, "ROI 'cam02': Polígonos de ROI precisam de pelo menos 3 pontos."),
+        ({"exclude": {"x": 1}}, "ROI 'cam02': 'exclude' da ROI deve ser uma lista de polígonos"),
+    ],
+)
+def test_bad_entry_raises_value_error_naming_the_key(tmp_path, entry, message):
+    path = _write(tmp_path, {"cam01": {"include": SQUARE}, "cam02": entry})
+    with pytest.raises(ValueError) as exc:
+        load_roi_config(path)
+    assert str(exc.value).startswith(message)
+
+
+def test_top_level_must_be_an_object(tmp_path):
+    with pytest.raises(ValueError, match="Configuração de ROI"):
+        load_roi_config(_write(tmp_path, [SQUARE]))
@@ -0,0 +1,121 @@
+"""
+Agregados de contagem (count_rollups) e GET /stats/timeseries.
+
+O Postgres não está disponível nos testes: o upsert de _db_update_rollups e a
+consulta do endpoint rodam num SQLite em memória (>= 3.24, ON CONFLICT ... DO
+UPDATE), com os placeholders `%s` trocados por `?`. A migração de backfill
+(_db_backfill_counts) usa SQL específico do Postgres e não é coberta aqui.
+"""
+
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("fastapi")
+import api  # noqa: E402
+from count_people import _db_update_rollups  # noqa: E402
+
+UTC = timezone.utc
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat())
+sqlite3.register_converter("TIMESTAMPTZ", lambda b: datetime.fromisoformat(b.decode()))
+
+
+class _Cursor:
+    def __init__(self, cur: sqlite3.Cursor) -> None:
+        self._cur = cur
+
+    def __enter__(self) -> "_Cursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._cur.close()
+
+    def execute(self, sql: str, params=()) -> None:
+        self._cur.execute(sql.replace("%s", "?"), list(params))
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+
+class _Conn:
+    def __init__(self) -> None:
+        self.db = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+        # Mesmo DDL de _db_ensure_table
+        self.db.execute(
+            """
+            CREATE TABLE count_rollups (
+                granularity TEXT NOT NULL,
+                source TEXT NOT NULL DEFAULT '',
+                bucket_start TIMESTAMPTZ NOT NULL,
+                n BIGINT NOT NULL,
+                total BIGINT NOT NULL,
+                max_count INTEGER NOT NULL,
+                PRIMARY KEY (granularity, source, bucket_start)
+            );
+            """
+        )
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self.db.cursor())
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    c = _Conn()
+    observations = [
+        (datetime(2026, 3, 1, 10, 0, 10, tzinfo=UTC), "cam1", 3),
+        (datetime(2026, 3, 1, 10, 0, 50, tzinfo=UTC), "cam1", 5),
+        (datetime(2026, 3, 1, 10, 7, 0, tzinfo=UTC), "cam1", 2),
+        (datetime(2026, 3, 1, 10, 1, 0, tzinfo=UTC), "cam2", 4),
+        # Timestamp sem fuso é tratado como UTC
+        (datetime(2026, 3, 1, 11, 30, 0), None, 1),
+    ]
+    with c.cursor() as cur:
+        for ts, source, count in observations:
+            _db_update_rollups(cur, ts, source, count)
+    monkeypatch.setattr(api, "_ensure_db", lambda: c)
+    return c
+
+
+def _series(interval, source=None, start=datetime(2026, 3, 1, 10, tzinfo=UTC), end=datetime(2026, 3, 1, 12, tzinfo=UTC)):
+    resp = api.stats_timeseries(interval=interval, source=source, start=start, end=end)
+    return json.loads(resp.body)
+
+
+def test_rollups_keep_n_total_and_max_per_bucket(conn):
+    rows = conn.db.execute(
+        "SELECT bucket_start, n, total, max_count FROM count_rollups "
+        "WHERE granularity = 'minute' AND source = 'cam1' ORDER BY bucket_start"
+    ).fetchall()
+    assert [(r[0].minute, r[1], r[2], r[3]) for r in rows] == [(0, 2, 8, 5), (7, 1, 2, 2)]
+    (day,) = conn.db.execute("SELECT n FROM count_rollups WHERE granularity = 'day' AND source = 'cam1'").fetchone()
+    assert day == 3
+
+
+def test_timeseries_rebuckets_minute_rollups(conn):
+    out = _series("5m")
+    assert out["granularity"] == "minute"
+    by_source = {s["source"]: s["points"] for s in out["series"]}
+    assert by_source["cam1"] == [
+        {"t": "2026-03-01T10:00:00+00:00", "n": 2, "sum": 8, "max": 5, "avg": 4.0},
+        {"t": "2026-03-01T10:05:00+00:00", "n": 1, "sum": 2, "max": 2, "avg": 2.0},
+    ]
+    assert by_source["cam2"] == [{"t": "2026-03-01T10:00:00+00:00", "n": 1, "sum": 4, "max": 4, "avg": 4.0}]
+    # Fonte vazia ('' na tabela) volta como null
+    assert by_source[None][0]["t"] == "2026-03-01T11:30:00+00:00"
+
+
+def test_timeseries_uses_hour_rollups_and_filters_source(conn):
+    out = _series("1h", source="cam1")
+    assert out["granularity"] == "hour"
+    assert out["series"] == [
+        {"source": "cam1", "points": [{"t": "2026-03-01T10:00:00+00:00", "n": 3, "sum": 10, "max": 5, "avg": 3.333}]}
+    ]
+
+
+def test_timeseries_range_is_half_open(conn):
+    out = _series("1m", source="cam1", end=datetime(2026, 3, 1, 10, 7, tzinfo=UTC))
+    assert [p["t"] for p in out["series"][0]["points"]] == ["2026-03-01T10:00:00+00:00"]
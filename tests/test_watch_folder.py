@@ -0,0 +1,89 @@
+"""
+Varredura por polling do modo --watch.
+"""
+
+import os
+import threading
+import time
+
+from watch_folder import Manifest, _Scanner, run_watch
+
+
+def _touch(path, data, mtime):
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+
+
+def _scanner(root, manifest):
+    return _Scanner(root, manifest, recursive=True, exts={".jpg"}, exclude=[], settle_seconds=0)
+
+
+def test_in_place_rewrite_is_requeued_without_dir_mtime_change(tmp_path):
+    root = tmp_path / "cams"
+    root.mkdir()
+    img = root / "a.jpg"
+    _touch(img, b"x" * 10, 1000.0)
+    manifest = Manifest(tmp_path / "manifest.sqlite")
+    scanner = _scanner(root, manifest)
+
+    assert scanner.scan() == 1
+    manifest.set_status(str(img), "done")
+    assert scanner.scan() == 0
+
+    # Reescrita no lugar: o mtime do diretório não muda
+    dir_mtime = root.stat().st_mtime_ns
+    _touch(img, b"y" * 12, 2000.0)
+    assert root.stat().st_mtime_ns == dir_mtime
+    # A passada leve não relê o diretório; a completa compara o arquivo
+    assert scanner.scan(full=False) == 0
+    assert scanner.scan(full=True) == 1
+    assert manifest.pending() == [str(img)]
+    manifest.close()
+
+
+def test_light_pass_finds_new_files_in_nested_dirs(tmp_path):
+    root = tmp_path / "cams"
+    sub = root / "cam01" / "2024"
+    sub.mkdir(parents=True)
+    _touch(sub / "a.jpg", b"x", 1000.0)
+    manifest = Manifest(tmp_path / "manifest.sqlite")
+    scanner = _scanner(root, manifest)
+
+    assert scanner.scan(full=False) == 1
+    assert scanner.scan(full=False) == 0
+    # Só o mtime da pasta mais funda muda; as de cima vêm das subpastas guardadas
+    _touch(sub / "b.jpg", b"y", 1000.0)
+    assert scanner.scan(full=False) == 1
+    assert sorted(manifest.pending()) == [str(sub / "a.jpg"), str(sub / "b.jpg")]
+    manifest.close()
+
+
+def test_poll_backend_picks_up_rewrite_on_full_rescan(tmp_path):
+    root = tmp_path / "cams"
+    root.mkdir()
+    img = root / "a.jpg"
+    _touch(img, b"x" * 10, 1000.0)
+    seen = []
+    stop = threading.Event()
+
+    def process(path):
+        seen.append(path.read_bytes())
+        return {"count": 0}
+
+    worker = threading.Thread(
+        target=run_watch,
+        args=(root, process, tmp_path / "manifest.sqlite"),
+        kwargs=dict(backend="poll", poll_interval=0.05, rescan_interval=0.3, settle_seconds=0, stop_event=stop),
+    )
+    worker.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not seen and time.monotonic() < deadline:
+            time.sleep(0.02)
+        _touch(img, b"y" * 12, 2000.0)
+        while len(seen) < 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        worker.join(timeout=5)
+    assert seen == [b"x" * 10, b"y" * 12]
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Ingestão incremental e retomável de uma árvore de diretórios (modo daemon).
+
+- Manifesto local em SQLite com os arquivos vistos (caminho + mtime + tamanho)
+  e o estado de cada um (pending, processing, done, error).
+- Só arquivos novos/alterados passam pelo pipeline; cada arquivo é um
+  checkpoint (commit), então um crash retoma de onde parou.
+- A cada `poll_interval`, uma passada leve: só diretórios cujo mtime mudou são
+  relidos (custa O(diretórios), com a lista de subpastas guardada no manifesto).
+- A cada `rescan_interval`, a varredura completa compara (tamanho, mtime) de
+  cada arquivo com o manifesto, em lotes: reescrever um arquivo no lugar não
+  muda o mtime do diretório, e sem inotify só essa varredura o encontra.
+- Observa com inotify (via `watchdog`, se instalado) e sempre mantém uma
+  varredura periódica por polling; em NFS, eventos de outros hosts não chegam
+  via inotify.
+
+Uso pelo CLI:
+    python count_people.py --input /mnt/cameras --watch --recursive --output_dir out
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+DEFAULT_EXTS = {".jpg", ".jpeg", ".png"}
+
+# Caminhos por consulta ao manifesto (abaixo do limite de parâmetros do SQLite)
+_LOOKUP_BATCH = 500
+
+
+class Manifest:
+    """
+    Índice persistente de arquivos processados.
+
+    files(path, mtime_ns, size, status, updated_at, info)
+    dir_index(path, mtime_ns, subdirs)  -- mtime e subpastas na última leitura do diretório
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        self._db.execute("PRAGMA synchronous=NORMAL;")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                info TEXT
+            );
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_status_idx ON files (status, path);")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dir_index (path TEXT PRIMARY KEY, mtime_ns INTEGER, subdirs TEXT NOT NULL);"
+        )
+        # Retomada: o que estava em processamento quando o processo caiu volta para a fila
+        self._db.execute("UPDATE files SET status = 'pending' WHERE status = 'processing';")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def dirs(self) -> Dict[str, Tuple[Optional[int], List[str]]]:
+        """
+        {diretório: (mtime da última leitura completa ou None, subpastas)}.
+        """
+        rows = self._db.execute("SELECT path, mtime_ns, subdirs FROM dir_index;")
+        return {path: (mtime_ns, json.loads(subdirs)) for path, mtime_ns, subdirs in rows}
+
+    def record_dir(self, path: str, mtime_ns: Optional[int], subdirs: List[str]) -> None:
+        """
+        Guarda o mtime (None = reler na próxima passada) e as subpastas de um diretório.
+        """
+        self._db.execute(
+            "INSERT OR REPLACE INTO dir_index (path, mtime_ns, subdirs) VALUES (?, ?, ?);",
+            [path, mtime_ns, json.dumps(subdirs)],
+        )
+
+    def enqueue(self, fpath: str, mtime_ns: int, size: int) -> bool:
+        return self.record_files([(fpath, mtime_ns, size)]) > 0
+
+    def _known(self, paths: List[str]) -> Dict[str, Tuple[int, int]]:
+        known: Dict[str, Tuple[int, int]] = {}
+        for i in range(0, len(paths), _LOOKUP_BATCH):
+            chunk = paths[i : i + _LOOKUP_BATCH]
+            marks = ", ".join("?" * len(chunk))
+            for fpath, f_mtime, f_size in self._db.execute(
+                f"SELECT path, mtime_ns, size FROM files WHERE path IN ({marks});", chunk
+            ):
+                known[fpath] = (f_mtime, f_size)
+        return known
+
+    def record_files(self, files: List[Tuple[str, int, int]]) -> int:
+        """
+        Registra como 'pending' os arquivos novos ou alterados (tamanho ou mtime
+        diferentes do manifesto), numa única transação. Retorna quantos entraram na fila.
+        """
+        known = self._known([f[0] for f in files])
+        changed = [f for f in files if known.get(f[0]) != (f[1], f[2])]
+        if not changed:
+            return 0
+        now = time.time()
+        self._db.execute("BEGIN;")
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, status, updated_at, info) VALUES (?, ?, ?, 'pending', ?, NULL);",
+                [(fpath, f_mtime, f_size, now) for fpath, f_mtime, f_size in changed],
+            )
+            self._db.execute("COMMIT;")
+        except Exception:
+            self._db.execute("ROLLBACK;")
+            raise
+        return len(changed)
+
+    def pending(self, limit: int = 100) -> List[str]:
+        rows = self._db.execute("SELECT path FROM files WHERE status = 'pending' ORDER BY path LIMIT ?;", [limit])
+        return [r[0] for r in rows]
+
+    def set_status(self, fpath: str, status: str, info: Optional[str] = None) -> None:
+        self._db.execute(
+            "UPDATE files SET status = ?, updated_at = ?, info = ? WHERE path = ?;",
+            [status, time.time(), info, fpath],
+        )
+
+    def counts(self) -> Dict[str, int]:
+        return {status: n for status, n in self._db.execute("SELECT status, COUNT(*) FROM files GROUP BY status;")}
+
+
+class _Scanner:
+    """
+    Varredura por polling. `scan(full=True)` lista todos os diretórios e compara
+    (tamanho, mtime) de cada arquivo com o manifesto; `scan(full=False)` só relê
+    diretórios cujo mtime mudou (arquivos novos, removidos ou renomeados) e
+    desce pelas subpastas guardadas dos demais. Arquivos ainda sendo escritos
+    (mtime recente) mantêm o diretório "sujo" para a próxima passada.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        manifest: Manifest,
+        recursive: bool,
+        exts: Set[str],
+        exclude: Iterable[Path],
+        settle_seconds: float,
+    ) -> None:
+        self.root = root
+        self.manifest = manifest
+        self.recursive = recursive
+        self.exts = {e.lower() for e in exts}
+        self.exclude = [str(Path(p).resolve()) for p in exclude]
+        self.settle_seconds = settle_seconds
+
+    def _excluded(self, path: str) -> bool:
+        return any(path == ex or path.startswith(ex + os.sep) for ex in self.exclude)
+
+    def scan(self, full: bool = True) -> int:
+        added = 0
+        known = {} if full else self.manifest.dirs()
+        stack = [str(self.root)]
+        while stack:
+            d = stack.pop()
+            try:
+                d_mtime = os.stat(d).st_mtime_ns
+            except (FileNotFoundError, PermissionError):
+                continue
+            seen = known.get(d)
+            if seen is not None and seen[0] == d_mtime:
+                stack.extend(seen[1])
+                continue
+            files: List[Tuple[str, int, int]] = []
+            subdirs: List[str] = []
+            unsettled = False
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive and not self._excluded(entry.path):
+                                subdirs.append(entry.path)
+                            continue
+                        if os.path.splitext(entry.name)[1].lower() not in self.exts:
+                            continue
+                        st = entry.stat()
+                        if time.time() - st.st_mtime < self.settle_seconds:
+                            unsettled = True
+                            continue
+                        files.append((entry.path, st.st_mtime_ns, st.st_size))
+            except (FileNotFoundError, PermissionError):
+                continue
+            stack.extend(subdirs)
+            added += self.manifest.record_files(files)
+            # sem o mtime, o diretório é relido na próxima passada leve
+            self.manifest.record_dir(d, None if unsettled else d_mtime, subdirs)
+        return added
+
+
+def _start_inotify(root: Path, recursive: bool, events: "queue.Queue[str]"):
+    """
+    Inicia um observador inotify (watchdog). Retorna o observer ou None se indisponível.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler  # type: ignore
+        from watchdog.observers import Observer  # type: ignore
+    except Exception:
+        return None
+
+    class _Handler(FileSystemEventHandler):
+        def on_any_event(self, event):  # noqa: D401
+            if event.is_directory:
+                return
+            path = getattr(event, "dest_path", None) or event.src_path
+            events.put(path)
+
+    observer = Observer()
+    observer.schedule(_Handler(), str(root), recursive=recursive)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+
+def run_watch(
+    root: Path,
+    process: Callable[[Path], Dict[str, Any]],
+    manifest_path: Path,
+    recursive: bool = True,
+    exts: Optional[Set[str]] = None,
+    exclude: Iterable[Path] = (),
+    poll_interval: float = 2.0,
+    rescan_interval: float = 60.0,
+    settle_seconds: float = 1.0,
+    backend: str = "auto",
+    once: bool = False,
+    stop_event: Optional[threading.Event] = None,
+    on_result: Optional[Callable[[Path, Dict[str, Any]], None]] = None,
+) -> Dict[str, int]:
+    """
+    Processa incrementalmente os arquivos de `root` com `process(path)`.
+
+    backend: "auto" (inotify se `watchdog` estiver instalado, senão polling),
+    "inotify" ou "poll". A varredura completa ocorre a cada `rescan_interval`
+    (rede de segurança para NFS e única forma de ver reescritas no lugar sem
+    inotify); com polling, há também uma passada leve a cada `poll_interval`.
+    `once=True` faz uma única passada completa (varre, processa pendentes e retorna).
+    Retorna a contagem de arquivos por estado no manifesto.
+    """
+    import json
+
+    root = Path(root).resolve()
+    stop_event = stop_event or threading.Event()
+    manifest = Manifest(manifest_path)
+    scanner = _Scanner(root, manifest, recursive, exts or DEFAULT_EXTS, exclude, settle_seconds)
+
+    events: "queue.Queue[str]" = queue.Queue()
+    observer = None
+    if not once and backend in ("auto", "inotify"):
+        observer = _start_inotify(root, recursive, events)
+        if observer is None and backend == "inotify":
+            print("Aviso: inotify indisponível (instale 'watchdog'); usando polling.", file=sys.stderr)
+    interval = rescan_interval if observer is not None else min(poll_interval, rescan_interval)
+
+    last_scan = 0.0
+    last_full: Optional[float] = None
+    unsettled: List[str] = []
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if last_full is None or now - last_full >= rescan_interval:
+                scanner.scan(full=True)
+                last_scan = last_full = time.monotonic()
+            elif now - last_scan >= interval:
+                scanner.scan(full=False)
+                last_scan = time.monotonic()
+
+            # Eventos do inotify: enfileira arquivos já estáveis; os demais são revistos na próxima volta
+            for fpath in unsettled:
+                events.put(fpath)
+            unsettled = []
+            while True:
+                try:
+                    fpath = events.get_nowait()
+                except queue.Empty:
+                    break
+                p = Path(fpath)
+                if p.suffix.lower() not in scanner.exts or scanner._excluded(str(p)):
+                    continue
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                if time.time() - st.st_mtime >= settle_seconds:
+                    manifest.enqueue(str(p), st.st_mtime_ns, st.st_size)
+                else:
+                    unsettled.append(fpath)
+
+            batch = manifest.pending(limit=100)
+            for fpath in batch:
+                if stop_event.is_set():
+                    break
+                manifest.set_status(fpath, "processing")
+                try:
+                    result = process(Path(fpath))
+                    manifest.set_status(fpath, "done", json.dumps(result, ensure_ascii=False, default=str))
+                    if on_result is not None:
+                        on_result(Path(fpath), result)
+                except Exception as exc:
+                    manifest.set_status(fpath, "error", repr(exc))
+                    print(f"ERRO: {fpath} -> {exc}", file=sys.stderr)
+
+            if once and not batch:
+                break
+            if not batch:
+                stop_event.wait(min(poll_interval, interval))
+    finally:
+        if observer is not None:
+            observer.stop()
+        counts = manifest.counts()
+        manifest.close()
+    return counts